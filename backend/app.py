@@ -2,15 +2,56 @@
 
 '''Flask backend for QR Generator webapp.'''
 
-import io
+import os
 import json
+import time
+import uuid
 import base64
+import logging
 
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, Response, request, render_template, jsonify, stream_with_context, g
+from werkzeug.exceptions import NotFound
 
-from contact_qr import ContactQr
-from wifi_qr import WifiQr
-from link_qr import LinkQr
+from qr import Encoding, clear_encode_cache, encode_cache_stats
+from qr_types import (
+    normalize_payload,
+    validate_payload,
+    payload_hash,
+    PayloadError,
+    SECRET_TYPES
+)
+from capacity import ERROR_LEVELS, MAX_VERSION
+from render_cache import RenderCache, CacheLimits
+from render import (
+    render_images,
+    render_file,
+    warm_up,
+    image_name,
+    crop_box,
+    options_encoding,
+    VARIANTS,
+    FORMATS,
+    DEFAULT_OPTIONS,
+    SIZE_RANGE
+)
+from batch import render_batch, iter_batch, get_render_executor, RENDER_WORKERS
+from archive import stream_zip
+from sheet import (
+    SheetLayout,
+    DEFAULT_LAYOUT,
+    PAGE_SIZES,
+    cell_size,
+    min_cell_size,
+    paginate,
+    render_page,
+    stream_pdf
+)
+from render_executor import RenderExecutor, RenderQueueFull, RenderTimeout
+from layout_cache import layout_cache
+from single_flight import SingleFlight
+from memory import memory_budget
+from metrics import metrics
+from logger import logger, setup_logging, redact
 
 
 app = Flask(
@@ -19,6 +60,163 @@ app = Flask(
     template_folder='../templates'
 )
 
+# JSON log lines written to stdout by a background thread, QR_LOG_SAMPLE_RATE
+# (0-1) is the fraction of request logs kept (warnings and errors always kept)
+setup_logging(
+    level=os.environ.get('QR_LOG_LEVEL', 'INFO'),
+    sample_rate=float(os.environ.get('QR_LOG_SAMPLE_RATE', 1))
+)
+
+# Rendered images keyed by payload hash, optional sqlite tier shared by workers
+render_cache = RenderCache(
+    limits=CacheLimits(
+        entries=int(os.environ.get('QR_CACHE_SIZE', 256)),
+        bytes=int(os.environ.get('QR_CACHE_MAX_MIB', 64)) * 2**20,
+        disk_entries=int(os.environ.get('QR_CACHE_DISK_SIZE', 10000)),
+        disk_bytes=int(os.environ.get('QR_CACHE_DISK_MAX_MIB', 1024)) * 2**20
+    ),
+    path=os.environ.get('QR_CACHE_PATH') or None,
+    persist_secrets=os.environ.get('QR_CACHE_PERSIST_SECRETS', '').lower() == 'true'
+)
+
+# Renders for /generate and /qr run in the calling thread unless QR_RENDER_MODE
+# is process (renders run in the render process pool, separate from the batch
+# pool so they do not wait for batch work, request threads only wait)
+render_executor = RenderExecutor(
+    get_executor=get_render_executor if os.environ.get('QR_RENDER_MODE') == 'process' else None,
+    max_pending=int(os.environ.get('QR_RENDER_MAX_PENDING', 0)) or RENDER_WORKERS * 2,
+    timeout=float(os.environ.get('QR_RENDER_TIMEOUT', 10))
+)
+
+# Concurrent requests for the same uncached image wait for 1 render and share
+# it, across workers too if QR_COALESCE_DIR is set (other workers get the
+# images from the shared render cache, requires QR_CACHE_PATH)
+single_flight = SingleFlight(lock_dir=os.environ.get('QR_COALESCE_DIR') or None)
+
+
+# Worker over QR_MEMORY_BUDGET drops its in-memory render cache first (disk
+# tier keeps the images), see gunicorn.conf.py
+memory_budget.add_trimmer(render_cache.clear_memory)
+memory_budget.add_trimmer(clear_encode_cache)
+
+
+def runtime_metrics():
+    '''Returns render cache counters and number of in-flight renders in the
+    format expected by Metrics.add_collector.
+    '''
+    stats = render_cache.stats()
+    layouts = layout_cache.stats()
+    flights = single_flight.stats()
+    memory = memory_budget.stats()
+    encodes = encode_cache_stats()
+    return [
+        ('counter', 'qr_cache_hits_total', {'tier': 'memory'}, stats['memory_hits']),
+        ('counter', 'qr_cache_hits_total', {'tier': 'disk'}, stats['disk_hits']),
+        ('counter', 'qr_cache_misses_total', None, stats['misses']),
+        ('counter', 'qr_cache_evictions_total', {'tier': 'memory'}, stats['evictions']),
+        ('counter', 'qr_cache_evictions_total', {'tier': 'disk'}, stats['disk_evictions']),
+        ('counter', 'qr_cache_oversized_total', None, stats['oversized']),
+        ('counter', 'qr_cache_disk_errors_total', None, stats['disk_errors']),
+        ('gauge', 'qr_cache_bytes', {'tier': 'memory'}, stats['bytes']),
+        ('counter', 'qr_renders_coalesced_total', {'scope': 'worker'},
+         flights['coalesced_worker']),
+        ('counter', 'qr_renders_coalesced_total', {'scope': 'cross_worker'},
+         flights['coalesced_cross_worker']),
+        ('counter', 'qr_layout_cache_hits_total', None, layouts['hits']),
+        ('counter', 'qr_layout_cache_misses_total', None, layouts['misses']),
+        ('counter', 'qr_layout_cache_evictions_total', None, layouts['evictions']),
+        ('counter', 'qr_encode_cache_hits_total', None, encodes['hits']),
+        ('counter', 'qr_encode_cache_misses_total', None, encodes['misses']),
+        ('counter', 'qr_memory_trims_total', None, memory['trims']),
+        ('counter', 'qr_memory_budget_exceeded_total', None, memory['exceeded']),
+        ('gauge', 'qr_resident_memory_bytes', None, memory['resident']),
+        ('gauge', 'qr_renders_in_flight', None, render_executor.pending())
+    ]
+
+
+metrics.add_collector(runtime_metrics)
+
+# Load fonts and initialize render path at import (before fork if gunicorn
+# preload_app is enabled) so first request on each worker is not slower
+if os.environ.get('QR_WARMUP', 'true').lower() == 'true':
+    warm_up()
+
+# Seconds clients should wait before retrying when render queue is full
+RETRY_AFTER = int(os.environ.get('QR_RETRY_AFTER', 1))
+
+# Content hashes never change, allow browsers and proxies to cache for 1 year
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Maximum number of payloads accepted by /generate/batch
+BATCH_MAX_ITEMS = int(os.environ.get('QR_BATCH_MAX_ITEMS', 1000))
+
+
+@app.errorhandler(RenderQueueFull)
+def render_queue_full(_):
+    '''Returns 503 with Retry-After header when too many renders are pending.'''
+    return 'Server busy, try again later', 503, {'Retry-After': str(RETRY_AFTER)}
+
+
+@app.errorhandler(RenderTimeout)
+def render_timeout(_):
+    '''Returns 504 when render does not finish before QR_RENDER_TIMEOUT.'''
+    return 'Timed out generating QR code', 504
+
+
+@app.before_request
+def start_request_timer():
+    '''Records request start time and request ID (from X-Request-ID header if
+    set by proxy) for log_request and record_request_metrics.
+    '''
+    g.request_start = time.perf_counter()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.log_fields = {}
+
+
+@app.after_request
+def log_request(response):
+    '''Logs 1 line per request with request ID, status, duration, and fields
+    added by the endpoint (eg render_ms). Returns request ID in X-Request-ID.
+    '''
+    if 'request_id' not in g:
+        return response
+    response.headers['X-Request-ID'] = g.request_id
+    logger.log(
+        logging.ERROR if response.status_code >= 500 else logging.INFO,
+        '%s %s %s',
+        request.method,
+        request.path,
+        response.status_code,
+        extra={'fields': {
+            'request_id': g.request_id,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - g.request_start) * 1000, 2),
+            **g.log_fields
+        }}
+    )
+    return response
+
+
+@app.after_request
+def record_request_metrics(response):
+    '''Adds request count and duration (time until response is returned, not
+    until a streamed body finishes) to metrics, labelled by URL rule.
+    '''
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc(
+        'qr_http_requests_total',
+        {'endpoint': endpoint, 'method': request.method, 'status': response.status_code}
+    )
+    if 'request_start' in g:
+        metrics.observe(
+            'qr_http_request_duration_seconds',
+            time.perf_counter() - g.request_start,
+            {'endpoint': endpoint}
+        )
+    return response
+
 
 @app.get("/")
 def serve():
@@ -26,51 +224,514 @@ def serve():
     return render_template('index.html')
 
 
-def img_to_base64_string(img):
-    '''Takes PIL.Image, saves to memory buffer, returns as base64 string'''
-    img_buffer = io.BytesIO()
-    img.save(img_buffer, format="PNG")
-    return base64.b64encode(img_buffer.getvalue()).decode("utf-8")
+def bytes_to_base64_string(data):
+    '''Takes bytes, returns as base64 string'''
+    return base64.b64encode(data).decode("utf-8")
+
+
+def error_response(error, status=400):
+    '''Takes PayloadError, returns JSON response with error message and the
+    field that caused it.
+    '''
+    return jsonify(error.to_dict()), status
+
+
+def cache_images(key, payload, options, images):
+    '''Adds dict of rendered images to render cache. The payload and options
+    are stored with the images so /qr/<key> can render missing variants.
+    '''
+    source = json.dumps({'payload': payload, 'options': options})
+    render_cache.set(
+        key,
+        {**images, 'source': source.encode()},
+        secret=payload['type'] in SECRET_TYPES
+    )
+
+
+def render_missing(payload, images, variants, options, image_format):
+    '''Takes payload, its render cache entry (images already rendered), and
+    list of variants (in image_format) missing from it. Renders the missing
+    variants and adds them to the cache. Returns tuple with dict of all images
+    and how the render was shared (see SingleFlight.do, None if rendered).
+
+    Concurrent calls for the same images wait for the first call and share
+    its result, so a popular payload is only rendered once.
+    '''
+    key = payload_hash(payload, options)
+
+    def cached():
+        entry = render_cache.get(key) or {}
+        if all(image_name(variant, image_format) in entry for variant in variants):
+            return entry
+        return None
+
+    def render():
+        entry = {
+            **images,
+            **render_executor.run(render_images, payload, variants, options, image_format)
+        }
+        cache_images(key, payload, options, entry)
+        return entry
+
+    return single_flight.do((key, image_format, tuple(variants)), render, cached)
+
+
+def parse_encoding_options(data):
+    '''Takes request JSON, returns Encoding with error, mask, version and
+    min_version keys (None if missing, segno chooses).
+    Raises PayloadError naming the invalid option.
+    '''
+
+    error = data.get('error')
+    if error is not None and error not in ERROR_LEVELS:
+        raise PayloadError(f'error must be one of {", ".join(ERROR_LEVELS)}', 'error')
+
+    mask = data.get('mask')
+    if mask is not None and (
+        isinstance(mask, bool) or not isinstance(mask, int) or not 0 <= mask <= 7
+    ):
+        raise PayloadError('mask must be integer between 0 and 7', 'mask')
+
+    versions = {}
+    for name in ('version', 'min_version'):
+        versions[name] = data.get(name)
+        if versions[name] is not None and (
+            isinstance(versions[name], bool) or not isinstance(versions[name], int)
+            or not 1 <= versions[name] <= MAX_VERSION
+        ):
+            raise PayloadError(f'{name} must be integer between 1 and {MAX_VERSION}', name)
+    if versions['version'] is not None and versions['min_version'] is not None:
+        raise PayloadError('version and min_version cannot both be set', 'min_version')
+
+    return Encoding(error, mask, versions['version'], versions['min_version'])
+
+
+def parse_render_options(data):
+    '''Takes payload from frontend, returns tuple with list of requested image
+    variants, format, dict of render options (same keys as DEFAULT_OPTIONS
+    plus any encoding options that are set), and bool (return crop box).
+    Raises PayloadError naming the invalid option.
+    '''
+
+    image_format = data.get('format', 'png')
+    if image_format not in FORMATS:
+        raise PayloadError(f'format must be one of {", ".join(FORMATS)}', 'format')
+
+    variants = data.get('variants', list(VARIANTS))
+    if not isinstance(variants, list) or not variants or not all(
+        isinstance(variant, str) and variant in VARIANTS for variant in variants
+    ):
+        raise PayloadError(
+            f'variants must be list containing {", ".join(VARIANTS)}', 'variants'
+        )
+
+    crop = data.get('crop', False)
+    if crop is not False and (
+        crop is not True or 'caption' not in variants or image_format != 'png'
+    ):
+        raise PayloadError('crop requires caption variant and png format', 'crop')
+
+    options = dict(DEFAULT_OPTIONS)
+    compress_level = data.get('compress_level', options['compress_level'])
+    # bool is an int subclass, True would render as level 1 with its own cache key
+    if (
+        isinstance(compress_level, bool) or not isinstance(compress_level, int)
+        or not 0 <= compress_level <= 9
+    ):
+        raise PayloadError('compress_level must be integer between 0 and 9', 'compress_level')
+    options['compress_level'] = compress_level
+
+    optimize = data.get('optimize', options['optimize'])
+    if not isinstance(optimize, bool):
+        raise PayloadError('optimize must be boolean', 'optimize')
+    options['optimize'] = optimize
+
+    size = data.get('size', options['size'])
+    if not isinstance(size, int) or not SIZE_RANGE[0] <= size <= SIZE_RANGE[1]:
+        raise PayloadError(
+            f'size must be integer between {SIZE_RANGE[0]} and {SIZE_RANGE[1]}', 'size'
+        )
+    options['size'] = size
+
+    dpi = data.get('dpi', options['dpi'])
+    if dpi is not None and (not isinstance(dpi, int) or not 72 <= dpi <= 2400):
+        raise PayloadError('dpi must be integer between 72 and 2400', 'dpi')
+    options['dpi'] = dpi
+
+    # Only set encoding options are added (default renders keep their hash)
+    options.update({
+        name: value
+        for name, value in parse_encoding_options(data)._asdict().items()
+        if value is not None
+    })
+
+    return variants, image_format, options, crop
+
+
+def parse_sheet_options(data):
+    '''Takes /generate/sheet request JSON, returns tuple with SheetLayout
+    (missing keys use DEFAULT_LAYOUT) and format (pdf or png).
+    Raises PayloadError naming the invalid option.
+    '''
+
+    image_format = data.get('format', 'pdf')
+    if image_format not in ('pdf', 'png'):
+        raise PayloadError('format must be one of pdf, png', 'format')
+
+    page = data.get('page', DEFAULT_LAYOUT.page)
+    if page not in PAGE_SIZES:
+        raise PayloadError(f'page must be one of {", ".join(PAGE_SIZES)}', 'page')
+
+    grid = {}
+    for name in ('rows', 'columns'):
+        grid[name] = data.get(name, getattr(DEFAULT_LAYOUT, name))
+        if not isinstance(grid[name], int) or not 1 <= grid[name] <= 20:
+            raise PayloadError(f'{name} must be integer between 1 and 20', name)
+
+    margin = data.get('margin', DEFAULT_LAYOUT.margin)
+    if not isinstance(margin, (int, float)) or not 0 <= margin <= 50:
+        raise PayloadError('margin must be number of millimeters between 0 and 50', 'margin')
+
+    dpi = data.get('dpi', DEFAULT_LAYOUT.dpi)
+    if not isinstance(dpi, int) or not 72 <= dpi <= 600:
+        raise PayloadError('dpi must be integer between 72 and 600', 'dpi')
+
+    encoding = parse_encoding_options(data)
+    layout = SheetLayout(page, grid['rows'], grid['columns'], margin, dpi, encoding)
+    width, height = cell_size(layout)
+    min_width, min_height = min_cell_size(encoding)
+    if width < min_width or height < min_height:
+        raise PayloadError(
+            f'cells must be at least {min_width}x{min_height} pixels, use fewer '
+            'rows/columns or higher dpi',
+            'columns' if width < min_width else 'rows'
+        )
+    return layout, image_format
 
 
 @app.post("/generate")
 def generate():
     '''Expects POST containing form data from frontend.
     Instantiates correct QR class, generates image, returns as base64 string.
+    Images are cached by payload hash, repeat requests skip rendering.
+
+    Optional keys:
+    - variants: list of images to return (caption, no_caption), default both
+    - crop: if true also return crop key with [left, top, right, bottom] box
+      of the QR code within the caption image that the caption does not
+      overlap (client can derive no_caption by padding the crop with white to
+      a square, the rows below the box are light border)
+    - compress_level: PNG zlib level 0-9 (lower is faster but larger)
+    - optimize: if true spend extra time to make PNG smaller
+    - size: approximate image width in pixels (default 500), caption is scaled
+    - dpi: print resolution written to PNG metadata and used for SVG size
+    - format: png (default) or svg (vector, caption is text elements)
+    - error: lowest error correction level (L, M, Q, H), segno raises it if
+      it fits in the same version
+    - mask: mask pattern 0-7 (skips scoring all 8 masks)
+    - version: fixed QR code version 1-40 (same symbol size for any payload)
+    - min_version: smallest version to use (larger if the payload needs it)
+
+    The X-QR-Hash response header contains the payload hash, which can be used
+    to GET the same images from /qr/<hash>.png and /qr/<hash>.svg.
     '''
 
     data = request.get_json()
-    print(f'\nGenerate:\n{json.dumps(data, indent=4)}\n')
-
-    # Instantiate class for selected QR type
-    if data['type'] == 'contact-qr':
-        qr = ContactQr(
-            data['firstName'],
-            data['lastName'],
-            data['phone'],
-            data['email']
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            'Generate payload',
+            extra={'fields': {'request_id': g.request_id, 'payload': redact(data)}}
         )
 
-    elif data['type'] == 'wifi-qr':
-        qr = WifiQr(
-            data['ssid'],
-            data['password']
-        )
+    # Rejects invalid payloads and options before anything is rendered
+    try:
+        validate_payload(data)
+        variants, image_format, options, crop = parse_render_options(data)
+        payload = normalize_payload(data, options_encoding(options))
+    except PayloadError as error:
+        return error_response(error)
+    g.log_fields['type'] = payload['type']
 
-    elif data['type'] == 'link-qr':
-        qr = LinkQr(
-            data['url'],
-            data['text']
+    # Instantiate class for selected QR type unless requested variants cached
+    key = payload_hash(payload, options)
+    images = render_cache.get(key) or {}
+    missing = [
+        variant for variant in variants
+        if image_name(variant, image_format) not in images
+    ]
+    g.log_fields['cache'] = 'miss' if missing else 'hit'
+    if missing:
+        render_start = time.perf_counter()
+        images, shared = render_missing(payload, images, missing, options, image_format)
+        g.log_fields['render_ms'] = round((time.perf_counter() - render_start) * 1000, 2)
+        if shared:
+            g.log_fields['coalesced'] = shared
+
+    # Return JSON containing requested variants as base64 strings
+    with metrics.timer('qr_response_encode_seconds', {'type': payload['type']}):
+        response = {
+            variant: bytes_to_base64_string(images[image_name(variant, image_format)])
+            for variant in variants
+        }
+    if crop:
+        response['crop'] = crop_box(payload, options)
+    response = jsonify(response)
+    response.headers['X-QR-Hash'] = key
+    return response
+
+
+@app.get("/qr/<key>.<extension>")
+def get_qr_file(key, extension):
+    '''Returns raw PNG (extension png) or SVG (extension svg) bytes for a
+    payload hash returned by /generate (X-QR-Hash header). Images include the
+    caption unless the variant=no_caption query param is passed.
+
+    Responses are immutable (content depends only on hash) and have a strong
+    ETag, requests with a matching If-None-Match header receive 304.
+    Returns 404 if the hash is not in the render cache.
+    '''
+
+    if extension not in FORMATS:
+        raise NotFound()
+    mimetype = 'image/png' if extension == 'png' else 'image/svg+xml'
+
+    variant = request.args.get('variant', 'caption')
+    if variant not in VARIANTS:
+        return error_response(
+            PayloadError(f'variant must be one of {", ".join(VARIANTS)}', 'variant')
         )
+    name = image_name(variant, extension)
 
+    # Content for a hash never changes, skip cache lookup if client has it
+    etag = f'{key}-{name}'
+    if etag in request.if_none_match:
+        response = Response(status=304)
     else:
-        return 'Unsupported QR code type', 400
+        entry = render_cache.get(key)
+        if entry is None or 'source' not in entry:
+            return 'Unknown QR code hash', 404
+        source = json.loads(entry['source'])
+        payload = source['payload']
 
-    # Return JSON containing QR code with and without caption as base64 strings
-    return jsonify({
-        'caption': img_to_base64_string(qr.qr_complete),
-        'no_caption': img_to_base64_string(qr.qr_image)
-    })
+        # Render variant if not cached yet
+        g.log_fields['type'] = payload['type']
+        if name not in entry:
+            render_start = time.perf_counter()
+            entry, shared = render_missing(
+                payload, entry, [variant], source['options'], extension
+            )
+            g.log_fields['render_ms'] = round((time.perf_counter() - render_start) * 1000, 2)
+            if shared:
+                g.log_fields['coalesced'] = shared
+
+        response = Response(entry[name], mimetype=mimetype)
+        response.cache_control.private = payload['type'] in SECRET_TYPES
+        response.cache_control.public = payload['type'] not in SECRET_TYPES
+
+    response.set_etag(etag)
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+@app.post("/generate/batch")
+def generate_batch():
+    '''Expects POST containing JSON object with items key (list of payloads in
+    same format as /generate). Renders all uncached payloads in parallel.
+
+    Returns JSON object with results key containing 1 item per payload in the
+    same order. Each item has caption and no_caption keys (base64 PNGs), or an
+    error key if the payload could not be rendered.
+    '''
+
+    data = request.get_json()
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return error_response(PayloadError('Expected list of payloads in items key', 'items'))
+    if len(items) > BATCH_MAX_ITEMS:
+        return error_response(
+            PayloadError(f'Batch cannot exceed {BATCH_MAX_ITEMS} items', 'items'), 413
+        )
+
+    # Normalize payloads, get cached images (remaining payloads need rendering)
+    results = [None] * len(items)
+    pending = {}
+    for index, data in enumerate(items):
+        try:
+            payload = normalize_payload(data)
+        except PayloadError as error:
+            results[index] = error.to_dict()
+            continue
+
+        key = payload_hash(payload, DEFAULT_OPTIONS)
+        images = render_cache.get(key) if key not in pending else None
+        if images is None or not VARIANTS.keys() <= images.keys():
+            # Duplicate payloads in the same batch are only rendered once
+            pending.setdefault(key, (payload, []))[1].append(index)
+        else:
+            results[index] = images
+
+    # Render uncached payloads in parallel, add to cache
+    rendered = render_batch([payload for payload, _ in pending.values()])
+    for (key, (payload, indices)), images in zip(pending.items(), rendered):
+        if isinstance(images, Exception):
+            images = {'error': 'Failed to render QR code'}
+        else:
+            cache_images(key, payload, DEFAULT_OPTIONS, images)
+        for index in indices:
+            results[index] = images
+
+    return jsonify({'results': [
+        result if 'error' in result else {
+            'caption': bytes_to_base64_string(result['caption']),
+            'no_caption': bytes_to_base64_string(result['no_caption'])
+        }
+        for result in results
+    ]})
+
+
+@app.post("/generate/archive")
+def generate_archive():
+    '''Expects POST containing JSON object with items key (list of payloads in
+    same format as /generate). Returns streaming ZIP archive containing a PNG
+    (with caption) for each payload, named the same way as Qr.save.
+
+    Each PNG is sent as soon as it is rendered. Payloads that could not be
+    rendered are listed in errors.txt at the end of the archive.
+    '''
+
+    data = request.get_json()
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return error_response(PayloadError('Expected list of payloads in items key', 'items'))
+
+    # Normalize payloads, record errors (item index + reason) for invalid payloads
+    errors = []
+    payloads = []
+    for index, item in enumerate(items):
+        try:
+            payloads.append((index, normalize_payload(item)))
+        except PayloadError as error:
+            errors.append((index, str(error)))
+
+    def files():
+        results = iter_batch((payload for _, payload in payloads), render_file)
+        for (index, _), result in zip(payloads, results):
+            if isinstance(result, Exception):
+                errors.append((index, 'Failed to render QR code'))
+            else:
+                yield result
+        if errors:
+            yield 'errors.txt', '\n'.join(
+                f'{index}: {error}' for index, error in sorted(errors)
+            ).encode()
+
+    return Response(
+        stream_with_context(stream_zip(files())),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=qr-codes.zip'}
+    )
+
+
+@app.post("/generate/sheet")
+def generate_sheet():
+    '''Expects POST containing JSON object with items key (list of payloads in
+    same format as /generate) and optional grid layout keys:
+    - page: a4 (default) or letter
+    - rows, columns: number of QR codes on each page (default 4 x 3)
+    - margin: blank space around the grid in millimeters (default 10)
+    - dpi: print resolution (default 300, max 600)
+    - format: pdf (default, 1 page per sheet) or png (ZIP with 1 PNG per page)
+    - error, mask, version, min_version: encoding options (same as /generate),
+      a fixed version gives every code on the sheet the same symbol size
+
+    QR codes are placed left to right, top to bottom, each scaled to fit its
+    cell with caption. Pages are rendered in parallel (batch render processes)
+    and streamed as soon as each is finished, so memory use does not depend on
+    the number of pages. Cells of payloads that fail to render are left blank
+    (listed in errors.txt in png format).
+    '''
+
+    data = request.get_json()
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return error_response(PayloadError('Expected list of payloads in items key', 'items'))
+    if len(items) > BATCH_MAX_ITEMS:
+        return error_response(
+            PayloadError(f'Sheet cannot exceed {BATCH_MAX_ITEMS} items', 'items'), 413
+        )
+
+    # Payload positions matter (skipping 1 would shift the grid), reject the
+    # whole sheet if any payload is invalid (field is eg items.3.url)
+    payloads = []
+    try:
+        layout, image_format = parse_sheet_options(data)
+        for index, item in enumerate(items):
+            try:
+                payloads.append(normalize_payload(item, layout.encoding))
+            except PayloadError as error:
+                raise PayloadError(
+                    f'Invalid payload at index {index}: {error}',
+                    f'items.{index}' + (f'.{error.field}' if error.field else '')
+                ) from error
+    except PayloadError as error:
+        return error_response(error)
+    g.log_fields['items'] = len(payloads)
+
+    pages = paginate(payloads, layout)
+    results = iter_batch(((page, layout, image_format) for page in pages), render_page)
+    per_page = layout.rows * layout.columns
+    errors = []
+
+    def page_results():
+        for number, result in enumerate(results):
+            if isinstance(result, Exception):
+                raise result
+            page, failed = result
+            errors.extend(number * per_page + index for index in failed)
+            yield number, page
+
+    if image_format == 'pdf':
+        def pdf():
+            yield from stream_pdf((page for _, page in page_results()), layout.dpi)
+            if errors:
+                logger.warning('Sheet items failed to render', extra={'fields': {
+                    'request_id': g.request_id, 'indices': errors
+                }})
+        return Response(
+            stream_with_context(pdf()),
+            mimetype='application/pdf',
+            headers={'Content-Disposition': 'attachment; filename=qr-sheet.pdf'}
+        )
+
+    def files():
+        for number, page in page_results():
+            yield f'page-{number + 1:03d}.png', page
+        if errors:
+            yield 'errors.txt', '\n'.join(
+                f'{index}: Failed to render QR code' for index in errors
+            ).encode()
+
+    return Response(
+        stream_with_context(stream_zip(files())),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=qr-sheet.zip'}
+    )
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    '''Returns render cache hit/miss/eviction counters for this worker.'''
+    return jsonify(render_cache.stats())
+
+
+@app.get("/metrics")
+def get_metrics():
+    '''Returns request, render stage timing, cache, and in-flight render
+    metrics in Prometheus text format. Includes every gunicorn worker and
+    render process if QR_METRICS_DIR is set, otherwise only this worker.
+    '''
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -0,0 +1,71 @@
+'''Streams ZIP archives without holding the whole archive in memory.'''
+
+import io
+import zipfile
+
+
+class _StreamBuffer(io.RawIOBase):
+    '''Write-only file object used as ZipFile output. Stores bytes written since
+    last call to pop so they can be sent to the client immediately.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def pop(self):
+        '''Returns all bytes written since last call, clears buffer.'''
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def unique_filename(filename, used):
+    '''Takes filename and set of filenames already in archive, returns filename
+    with numeric suffix added before extension if it was already used (eg
+    John-Doe_contact.png, John-Doe_contact_2.png). Adds result to used set.
+    '''
+
+    # Prevent path separators in URLs creating directories
+    filename = filename.replace('/', '_').replace('\\', '_')
+
+    name, extension = filename.rsplit('.', 1) if '.' in filename else (filename, '')
+    extension = f'.{extension}' if extension else ''
+    candidate = filename
+    count = 1
+    while candidate in used:
+        count += 1
+        candidate = f'{name}_{count}{extension}'
+
+    used.add(candidate)
+    return candidate
+
+
+def stream_zip(files):
+    '''Takes iterable of (filename, bytes) tuples, yields ZIP archive chunks
+    as soon as each file is written. Duplicate filenames get numeric suffix.
+
+    Files are stored without compression (PNGs are already compressed).
+    '''
+
+    buffer = _StreamBuffer()
+    used = set()
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for filename, data in files:
+            archive.writestr(unique_filename(filename, used), data)
+            yield buffer.pop()
+
+    # Central directory written when archive closed
+    yield buffer.pop()
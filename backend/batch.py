@@ -0,0 +1,119 @@
+'''Renders lists of payloads in parallel worker processes.'''
+
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from render import render_images, warm_up
+from qr_types import render_cost
+
+
+# Number of batch render processes per gunicorn worker, defaults to the CPUs
+# split between workers (QR_WORKERS, set by gunicorn.conf.py) so all workers
+# together start 1 process per CPU
+BATCH_WORKERS = int(os.environ.get('QR_BATCH_WORKERS', 0)) or max(
+    1, os.cpu_count() // int(os.environ.get('QR_WORKERS', 1))
+)
+
+# Number of processes rendering single QR codes (/generate in process mode),
+# a separate pool so interactive renders never queue behind batch work
+RENDER_WORKERS = int(os.environ.get('QR_RENDER_WORKERS', 0)) or max(1, BATCH_WORKERS // 2)
+
+# Shared process pools for each pid, created on first use (an executor
+# inherited from the gunicorn master process cannot be used after fork)
+_executors = {}
+
+
+def warm_worker():
+    '''Runs once in each render process before it accepts work.
+    Loads all caption fonts so the first render does not read them from disk.
+    '''
+    warm_up()
+
+
+def create_executor(max_workers=BATCH_WORKERS):
+    '''Returns new ProcessPoolExecutor with warmed worker processes.
+    Uses spawn (not fork) since the flask process may have running threads.
+    '''
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=warm_worker
+    )
+
+
+def get_executor(pool='batch'):
+    '''Returns shared ProcessPoolExecutor for the current process, pool is
+    batch (BATCH_WORKERS processes) or render (RENDER_WORKERS processes).
+    '''
+    key = (os.getpid(), pool)
+    if key not in _executors:
+        _executors[key] = create_executor(RENDER_WORKERS if pool == 'render' else BATCH_WORKERS)
+    return _executors[key]
+
+
+def get_render_executor():
+    '''Returns shared render pool for the current process (single renders).'''
+    return get_executor('render')
+
+
+def iter_batch(payloads, func=render_images, executor=None, window=None):
+    '''Takes iterable of normalized payloads, calls func (must be picklable)
+    with each payload in parallel worker processes.
+
+    Yields 1 result per payload in the same order. Each result is either the
+    value returned by func or an Exception instance raised while rendering that
+    payload (does not prevent other payloads rendering).
+
+    At most window payloads (default 2 per worker) are submitted at a time, so
+    memory use does not depend on the number of payloads.
+    '''
+
+    if executor is None:
+        executor = get_executor()
+    if window is None:
+        window = BATCH_WORKERS * 2
+
+    pending = deque()
+    for payload in payloads:
+        pending.append(executor.submit(func, payload))
+        if len(pending) >= window:
+            yield _result(pending.popleft())
+
+    while pending:
+        yield _result(pending.popleft())
+
+
+def _result(future):
+    '''Returns result of finished future, or exception if it raised one.'''
+    try:
+        return future.result()
+    except Exception as exception:  # pylint: disable=broad-exception-caught
+        return exception
+
+
+def render_batch(payloads, executor=None, window=None):
+    '''Takes list of normalized payloads, renders all in parallel (at most
+    window submitted at a time, see iter_batch).
+
+    Returns list with one item per payload in the same order. Each item is
+    either the dict returned by render_images or an Exception instance raised
+    while rendering that payload (does not prevent other payloads rendering).
+    '''
+
+    if not payloads:
+        return []
+
+    # Submit the most expensive renders first (cost hint of each type), so the
+    # renders left when processes start running out of work are the short ones.
+    # Submitted in a bounded window (not all at once) so other requests using
+    # the pool do not wait for the whole batch
+    order = sorted(range(len(payloads)), key=lambda index: -render_cost(payloads[index]))
+    results = [None] * len(payloads)
+    rendered = iter_batch(
+        [payloads[index] for index in order], executor=executor, window=window
+    )
+    for index, result in zip(order, rendered):
+        results[index] = result
+    return results
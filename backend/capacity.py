@@ -0,0 +1,116 @@
+'''Precomputed QR code capacity, finds the version a payload needs without
+encoding it (rejects payloads that can not fit before any rendering).'''
+
+import re
+from bisect import bisect_left
+
+from segno import consts
+
+
+# Error correction levels (lowest to highest), segno picks the smallest
+# version at L and then raises the level if it still fits in that version
+ERROR_LEVELS = ('L', 'M', 'Q', 'H')
+
+# Largest QR code version (177 x 177 modules)
+MAX_VERSION = 40
+
+# Bits used by each character in each mode, segno picks the most compact mode
+# that can hold the whole content (numeric packs 3 digits in 10 bits and
+# alphanumeric 2 characters in 11 bits)
+MODES = ('numeric', 'alphanumeric', 'kanji', 'byte')
+_MODE_CONSTS = {
+    'numeric': consts.MODE_NUMERIC,
+    'alphanumeric': consts.MODE_ALPHANUMERIC,
+    'kanji': consts.MODE_KANJI,
+    'byte': consts.MODE_BYTE
+}
+_ALPHANUMERIC = re.compile(b'^[' + re.escape(consts.ALPHANUMERIC_CHARS) + b']*$')
+
+
+def _data_bits(mode, length):
+    '''Returns number of bits used by length characters in mode.'''
+    if mode == 'numeric':
+        return length // 3 * 10 + (0, 4, 7)[length % 3]
+    if mode == 'alphanumeric':
+        return length // 2 * 11 + length % 2 * 6
+    if mode == 'kanji':
+        return length * 13
+    return length * 8
+
+
+def _max_length(mode, version, error):
+    '''Returns max characters of mode that fit in version at error level
+    (symbol capacity minus mode indicator and character count indicator).
+    '''
+    version_range = 1 if version < 10 else 2 if version < 27 else 3
+    count_bits = consts.CHAR_COUNT_INDICATOR_LENGTH[_MODE_CONSTS[mode]][version_range]
+    available = consts.SYMBOL_CAPACITY[version][consts.ERROR_MAPPING[error]] - 4 - count_bits
+
+    # Each character uses at least 3 bits (numeric), start above the answer
+    length = min(available // 3, 2 ** count_bits - 1)
+    while _data_bits(mode, length) > available:
+        length -= 1
+    return length
+
+
+# Max characters per error level and mode, 1 tuple item per version (index 0
+# is version 1), built once at import so checking a payload is 1 bisect
+CAPACITY = {
+    error: {
+        mode: tuple(_max_length(mode, version, error) for version in range(1, MAX_VERSION + 1))
+        for mode in MODES
+    }
+    for error in ERROR_LEVELS
+}
+
+
+def encoded_length(content):
+    '''Takes string, returns tuple with the mode segno encodes it in and its
+    length in characters of that mode. Same encoding order as segno: ISO
+    8859-1, then Shift JIS, then UTF-8, mode is found from the bytes.
+
+    Raises UnicodeError if content can not be encoded (lone surrogates).
+    '''
+    for encoding in ('iso-8859-1', 'shift_jis'):
+        try:
+            data = content.encode(encoding)
+            break
+        except UnicodeError:
+            continue
+    else:
+        data = content.encode('utf-8')
+
+    if data.isdigit():
+        return 'numeric', len(data)
+    if _ALPHANUMERIC.match(data):
+        return 'alphanumeric', len(data)
+    if _is_kanji(data):
+        return 'kanji', len(data) // 2
+    return 'byte', len(data)
+
+
+def _is_kanji(data):
+    '''Returns True if bytes are all double byte Shift JIS kanji characters.'''
+    if not data or len(data) % 2:
+        return False
+    return all(
+        0x8140 <= code <= 0x9ffc or 0xe040 <= code <= 0xebbf
+        for code in (data[index] << 8 | data[index + 1] for index in range(0, len(data), 2))
+    )
+
+
+def min_version(content, error='L'):
+    '''Returns smallest QR code version (1-40) that can hold content string at
+    error level, or None if it does not fit in any version.
+    '''
+    mode, length = encoded_length(content)
+    version = bisect_left(CAPACITY[error][mode], length) + 1
+    return version if version <= MAX_VERSION else None
+
+
+def max_capacity(content, error='L'):
+    '''Returns tuple with mode content is encoded in, its length, and max
+    length of that mode in the largest version at error level.
+    '''
+    mode, length = encoded_length(content)
+    return mode, length, CAPACITY[error][mode][-1]
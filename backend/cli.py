@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+'''Command line interface for rendering QR codes in bulk.
+
+Example:
+    python3 backend/cli.py batch contacts.csv --type contact --out badges/ -j 4
+
+Warm the caption layout cache (loaded from QR_LAYOUT_CACHE_PATH at startup):
+    python3 backend/cli.py layouts contacts.csv --type contact --out layouts.json
+
+Each CSV row (or JSONL line) must contain the same fields as the frontend
+payload for the selected type (eg firstName, lastName, phone, email), snake_case
+column names (eg first_name) are also accepted. JSONL lines may contain a type
+key to override --type. Existing output files are skipped, so an interrupted
+job can be resumed by running the same command again. Rows that produce the
+same filename but a different QR code get a numeric suffix in row order (eg
+John-Doe_contact_2.png), rows identical to an earlier row are not rendered.
+'''
+
+import os
+import re
+import csv
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+from qr import Encoding, QR_TYPES
+from qr_types import normalize_payload, build_qr, payload_hash
+from capacity import ERROR_LEVELS, MAX_VERSION
+from batch import warm_worker
+from archive import unique_filename
+from layout_cache import layout_cache
+
+
+# Maps --type arg to payload type of each registered Qr subclass (eg contact)
+TYPES = {key.removesuffix('-qr'): key for key in QR_TYPES}
+
+
+def read_rows(path):
+    '''Takes path to CSV or JSONL file, yields 1 dict per row/line (or the
+    exception raised parsing it, so 1 malformed line does not stop the rest).
+    '''
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.endswith('.jsonl'):
+            for line in file:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as error:
+                        yield error
+        else:
+            yield from csv.DictReader(file)
+
+
+def row_to_payload(row, qr_type):
+    '''Takes dict from read_rows and default type, returns frontend payload
+    dict (snake_case keys converted to camelCase). Raises ValueError if the row
+    is not a dict or has more CSV columns than the header.
+    '''
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError(f'Expected JSON object, got {type(row).__name__}')
+    if None in row:
+        raise ValueError(f'Row has {len(row[None])} more columns than the header')
+    payload = {
+        re.sub(r'_([a-z])', lambda match: match.group(1).upper(), key): value
+        for key, value in row.items()
+    }
+    payload.setdefault('type', TYPES[qr_type])
+    return payload
+
+
+def plan_rows(rows, qr_type, kind, encoding):
+    '''Takes iterable of rows from read_rows, default type, file kind, and
+    Encoding. Yields tuple with frontend payload and output filename for each
+    row, assigned in row order so names are the same on every run (resume).
+
+    Rows that normalize to the same payload as an earlier row get filename
+    None (duplicate), rows with the same Qr.filename as an earlier different
+    row get a numeric suffix. Invalid rows get an empty filename and the error
+    message instead of a payload (render_row reports it).
+    '''
+    used = set()
+    filenames = {}
+    for row in rows:
+        try:
+            payload = row_to_payload(row, qr_type)
+            normalized = normalize_payload(payload, encoding)
+        except ValueError as error:
+            yield f'{type(error).__name__}: {error}', ''
+            continue
+
+        key = payload_hash(normalized)
+        if key in filenames:
+            yield payload, None
+            continue
+        filenames[key] = unique_filename(f'{build_qr(normalized).filename}.{kind}', used)
+        yield payload, filenames[key]
+
+
+def render_row(args):
+    '''Takes tuple with frontend payload, output directory, file kind (png or
+    svg), Encoding, and filename from plan_rows. Writes file with Qr.save
+    unless it already exists. Returns "rendered", "skipped", "duplicate", or
+    error message string.
+    '''
+    payload, out_dir, kind, encoding, filename = args
+    if filename is None:
+        return 'duplicate'
+    if not filename:
+        return payload
+    try:
+        qr = build_qr(normalize_payload(payload, encoding), encoding=encoding)
+        path = os.path.join(out_dir, filename)
+        if os.path.exists(path):
+            return 'skipped'
+        qr.save(path, kind)
+        return 'rendered'
+    except Exception as exception:  # pylint: disable=broad-exception-caught
+        return f'{type(exception).__name__}: {exception}'
+
+
+def batch(args):
+    '''Renders every row in args.input to args.out with args.jobs processes.
+    Prints progress and final throughput, returns number of failed rows.
+    '''
+
+    os.makedirs(args.out, exist_ok=True)
+    encoding = Encoding(args.error, args.mask, args.version, args.min_version)
+    work = (
+        (payload, args.out, args.kind, encoding, filename)
+        for payload, filename in plan_rows(read_rows(args.input), args.type, args.kind, encoding)
+    )
+
+    counts = {'rendered': 0, 'skipped': 0, 'duplicate': 0, 'failed': 0}
+    start = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.jobs, initializer=warm_worker) as pool:
+        for row, result in enumerate(pool.imap(render_row, work, args.chunksize), 1):
+            if result in counts:
+                counts[result] += 1
+            else:
+                counts['failed'] += 1
+                print(f'\nRow {row}: {result}', file=sys.stderr)
+
+            if row % args.progress == 0:
+                elapsed = time.perf_counter() - start
+                print(f'\r{row} rows, {row / elapsed:.1f} rows/sec', end='', file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    duplicates = f"{counts['duplicate']} duplicate, " if counts['duplicate'] else ''
+    print(
+        f"\rRendered {counts['rendered']}, skipped {counts['skipped']} existing, {duplicates}"
+        f"failed {counts['failed']} in {elapsed:.1f}s "
+        f"({counts['rendered'] / elapsed:.1f} codes/sec)"
+    )
+    return counts['failed']
+
+
+def layouts(args):
+    '''Renders caption of every row in args.input at each of args.sizes, saves
+    layout cache to args.out. Returns number of failed rows.
+    '''
+
+    failed = 0
+    for row, data in enumerate(read_rows(args.input), 1):
+        try:
+            payload = normalize_payload(row_to_payload(data, args.type))
+            for size in args.sizes:
+                build_qr(payload, size)._caption  # pylint: disable=expression-not-assigned, protected-access
+        except Exception as exception:  # pylint: disable=broad-exception-caught
+            failed += 1
+            print(f'Row {row}: {type(exception).__name__}: {exception}', file=sys.stderr)
+
+    layout_cache.save(args.out)
+    print(f"Saved {layout_cache.stats()['entries']} layouts to {args.out}")
+    return failed
+
+
+def parse_args(argv=None):
+    '''Returns parsed command line args.'''
+    parser = argparse.ArgumentParser(description='Render QR codes in bulk')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_batch = subparsers.add_parser('batch', help='Render 1 QR code per CSV/JSONL row')
+    parser_batch.add_argument('input', help='CSV or JSONL (.jsonl) file')
+    parser_batch.add_argument('--type', choices=TYPES, required=True, help='QR code type')
+    parser_batch.add_argument('--out', default='.', help='Output directory')
+    parser_batch.add_argument(
+        '--kind', choices=('png', 'svg'), default='png', help='Output file format'
+    )
+    parser_batch.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count(), help='Number of processes'
+    )
+    parser_batch.add_argument(
+        '--chunksize', type=int, default=16, help='Rows sent to each process at a time'
+    )
+    parser_batch.add_argument(
+        '--progress', type=int, default=100, help='Print progress every N rows'
+    )
+
+    # Encoding options (see qr.Encoding), a fixed mask skips scoring all 8
+    # masks for every row, a fixed version gives every code the same size
+    parser_batch.add_argument(
+        '--error', choices=ERROR_LEVELS, help='Lowest error correction level'
+    )
+    parser_batch.add_argument(
+        '--mask', type=int, choices=range(8), metavar='0-7', help='Mask pattern'
+    )
+    versions = parser_batch.add_mutually_exclusive_group()
+    versions.add_argument(
+        '--version', type=int, choices=range(1, MAX_VERSION + 1), metavar=f'1-{MAX_VERSION}',
+        help='Fixed QR code version (rows that do not fit fail)'
+    )
+    versions.add_argument(
+        '--min-version', type=int, choices=range(1, MAX_VERSION + 1),
+        metavar=f'1-{MAX_VERSION}', help='Smallest QR code version'
+    )
+
+    parser_layouts = subparsers.add_parser(
+        'layouts', help='Save caption layouts of every CSV/JSONL row to a warm file'
+    )
+    parser_layouts.add_argument('input', help='CSV or JSONL (.jsonl) file')
+    parser_layouts.add_argument('--type', choices=TYPES, required=True, help='QR code type')
+    parser_layouts.add_argument('--out', default='layouts.json', help='Output JSON file')
+    parser_layouts.add_argument(
+        '--sizes', type=int, nargs='+', default=[500], help='Image widths to fit captions for'
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    '''Command line entrypoint, returns exit code.'''
+    args = parse_args(argv)
+    if args.command == 'batch':
+        return 1 if batch(args) else 0
+    if args.command == 'layouts':
+        return 1 if layouts(args) else 0
+    return 0  # pragma: no cover
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
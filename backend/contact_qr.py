@@ -1,8 +1,6 @@
 '''Subclass of Qr for generating contact info QR codes.'''
 
-import segno
-
-from qr import Qr
+from qr import Qr, Field
 
 
 class ContactQr(Qr):
@@ -14,10 +12,37 @@ class ContactQr(Qr):
 
     The image with caption can be accessed at the qr_complete attribute.
     The image with no caption can be accessed at the qr_image attribute.
+    Both are generated the first time they are accessed. Optional size (width
+    in pixels), dpi and encoding keyword args are passed to Qr.
     '''
 
-    def __init__(self, first_name, last_name, phone, email):
-        super().__init__()
+    type_key = 'contact-qr'
+    fields = (
+        Field('firstName', 64),
+        Field('lastName', 64),
+        Field('phone', 32),
+        Field('email', 254)
+    )
+    template = {
+        'type': 'contact-qr',
+        'firstName': 'John',
+        'lastName': 'Doe',
+        'phone': '212-555-1234',
+        'email': 'john.doe@hotmail.com'
+    }
+
+    @classmethod
+    def normalize(cls, data):
+        '''Returns dict of constructor args from validated frontend payload.'''
+        return {
+            'first_name': data['firstName'].strip().capitalize(),
+            'last_name': data['lastName'].strip().capitalize(),
+            'phone': data['phone'].strip(),
+            'email': data['email'].strip().lower()
+        }
+
+    def __init__(self, first_name, last_name, phone, email, **kwargs):
+        super().__init__(**kwargs)
 
         self.first_name = first_name.strip().capitalize()
         self.last_name = last_name.strip().capitalize()
@@ -27,30 +52,27 @@ class ContactQr(Qr):
         # Set attribute for inherited save method
         self.filename = f"{self.first_name}-{self.last_name}_contact"
 
-        # Create QR code
-        self.generate()
-
-    def _generate_qr_code(self):
-        '''Returns segno instance with contact info from class attributes.'''
+    @property
+    def content(self):
+        '''MECARD string with contact info from class attributes.'''
 
         # Remove non-numeric characters
         phone = ''.join(c for c in self.phone if c.isdigit())
 
-        return segno.make(
-            f"MECARD:N:{self.last_name},{self.first_name};TEL:{phone};EMAIL:{self.email};",
-            micro=False
-        )
+        return f"MECARD:N:{self.last_name},{self.first_name};TEL:{phone};EMAIL:{self.email};"
 
     def _generate_caption(self):
         '''Returns list of caption dicts used by Qr.add_text method.'''
 
         # Create name string, get font size
         name = f"{self.first_name} {self.last_name}"
-        name_font = self._get_font(name, self._SANS_FONT_BOLD, 42)
+        name_font = self._get_font(name, self._SANS_FONT_BOLD, self._scaled(42))
 
-        # Create contact info string, get font size (at least 6 points smaller than name)
+        # Create contact info string, get font size (at least 6 points smaller
+        # than name, or 1 point if the name is very long)
         info = f"{self.email}\n{self.phone}"
-        info_font = self._get_font(info, self._SANS_FONT, name_font.size - 6)
+        info_size = max(name_font.size - self._scaled(6), 1)
+        info_font = self._get_font(info, self._SANS_FONT, info_size)
 
         # List of dicts
         # Each dict contains text + font for 1 line under QR image
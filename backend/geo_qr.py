@@ -0,0 +1,87 @@
+'''Subclass of Qr for generating geographic location QR codes.'''
+
+import re
+
+from qr import Qr, Field
+
+
+# Decimal degrees, latitude -90 to 90 and longitude -180 to 180
+_LATITUDE = re.compile(r'[+-]?(90(\.0+)?|[1-8]?\d(\.\d+)?)')
+_LONGITUDE = re.compile(r'[+-]?(180(\.0+)?|(1[0-7]\d|[1-9]?\d)(\.\d+)?)')
+
+
+def format_degrees(value):
+    '''Takes decimal degrees string, returns it rounded to 7 places (about 1
+    cm) without trailing zeros, so equivalent coordinates (eg 40.70 and
+    +40.7) produce the same QR code.
+    '''
+    # Round first, adding 0.0 turns -0.0 (also from eg -0.00000001) into 0.0
+    return f'{round(float(value), 7) + 0.0:.7f}'.rstrip('0').rstrip('.')
+
+
+class GeoQr(Qr):
+    '''Subclass of Qr for generating geographic location QR codes.
+
+    Generates a QR code image containing a geo URI (RFC 5870) with latitude
+    and longitude, which opens the location in a map app. A text caption with
+    the coordinates and optional label is added below the QR code.
+
+    The image with caption can be accessed at the qr_complete attribute.
+    The image with no caption can be accessed at the qr_image attribute.
+    Both are generated the first time they are accessed. Optional size (width
+    in pixels), dpi and encoding keyword args are passed to Qr.
+    '''
+
+    type_key = 'geo-qr'
+    fields = (
+        Field('latitude', 16, pattern=_LATITUDE,
+              description='decimal degrees between -90 and 90'),
+        Field('longitude', 16, pattern=_LONGITUDE,
+              description='decimal degrees between -180 and 180'),
+        Field('label', 128, optional=True)
+    )
+    cost = 0.6
+    template = {
+        'type': 'geo-qr',
+        'latitude': '40.7128',
+        'longitude': '-74.006',
+        'label': 'New York'
+    }
+
+    @classmethod
+    def normalize(cls, data):
+        '''Returns dict of constructor args from validated frontend payload.'''
+        return {
+            'latitude': format_degrees(data['latitude']),
+            'longitude': format_degrees(data['longitude']),
+            'label': (data.get('label') or '').strip() or None
+        }
+
+    def __init__(self, latitude, longitude, label=None, **kwargs):
+        super().__init__(**kwargs)
+
+        self.latitude = format_degrees(latitude)
+        self.longitude = format_degrees(longitude)
+        self.label = label
+
+        # Set attribute for inherited save method
+        self.filename = f"{self.latitude},{self.longitude}_geo"
+
+    @property
+    def content(self):
+        '''geo URI with coordinates from class attributes.'''
+        return f'geo:{self.latitude},{self.longitude}'
+
+    def _generate_caption(self):
+        '''Returns list of caption dicts used by Qr.add_text method.'''
+
+        coordinates = f"{self.latitude}, {self.longitude}"
+        font = self._get_font(coordinates, self._MONO_FONT, self._scaled(42))
+        caption = [{'text': coordinates, 'font': font}]
+
+        # If label given add above coordinates in bold + larger font
+        if self.label:
+            font = self._get_font(self.label, self._MONO_FONT_BOLD, self._scaled(72))
+            caption.insert(0, {'text': self.label, 'font': font})
+
+        return caption
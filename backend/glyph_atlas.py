@@ -0,0 +1,109 @@
+'''Caches rasterized caption glyphs so captions are composited by pasting
+bitmaps instead of rendering every glyph with FreeType on each request.'''
+
+import os
+import math
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+# Disabled by default, set QR_GLYPH_ATLAS=true to draw captions with atlases
+ENABLED = os.environ.get('QR_GLYPH_ATLAS', 'false').lower() == 'true'
+
+# Max glyphs (and kerning pairs) cached per font + size. Captions can contain
+# any unicode character, glyphs after the limit are rasterized every time
+MAX_GLYPHS = 1024
+
+
+class GlyphAtlas():
+    '''Rasterized glyph bitmaps and kerning for 1 font + size.
+
+    Each glyph is rendered once by Pillow (same antialiasing and hinting as
+    ImageDraw.text). Lines are drawn by pasting each glyph at the pen position
+    rounded to the nearest pixel, the pen advances by the glyph width plus
+    kerning with the next character (same positions as Pillow's basic layout).
+    Output matches ImageDraw.text except where antialiased edges of adjacent
+    glyphs overlap (can differ by a few levels of grey).
+    '''
+
+    def __init__(self, font):
+        self.font = font
+        self._glyphs = {}
+        self._kerning = {}
+
+    def _rasterize(self, char):
+        '''Returns tuple with L mode glyph bitmap (None if blank, eg space),
+        offset from pen position to bitmap top left corner, and advance width.
+        '''
+        mask, offset = self.font.getmask2(char, 'L')
+        width, height = mask.size
+        if not width or not height:
+            return None, offset, self.font.getlength(char)
+
+        # Draw with padding so negative offsets (eg j left bearing) are in
+        # bounds, then crop to the same bitmap ImageDraw.text would paste
+        pad = width + height
+        canvas = Image.new('L', (pad * 2 + width + offset[0], pad + height + offset[1]))
+        ImageDraw.Draw(canvas).text((pad, pad), char, font=self.font, fill=255)
+        left, top = pad + offset[0], pad + offset[1]
+        bitmap = canvas.crop((left, top, left + width, top + height))
+        return bitmap, offset, self.font.getlength(char)
+
+    def glyph(self, char):
+        '''Returns cached (bitmap, offset, advance) tuple from _rasterize.'''
+        if char not in self._glyphs:
+            glyph = self._rasterize(char)
+            if len(self._glyphs) >= MAX_GLYPHS:
+                return glyph
+            self._glyphs[char] = glyph
+        return self._glyphs[char]
+
+    def kerning(self, left, right):
+        '''Returns pixels added between left and right characters (usually 0,
+        negative for pairs like AV).
+        '''
+        key = left + right
+        if key not in self._kerning:
+            kerning = (
+                self.font.getlength(key) - self.font.getlength(left) - self.font.getlength(right)
+            )
+            if len(self._kerning) >= MAX_GLYPHS:
+                return kerning
+            self._kerning[key] = kerning
+        return self._kerning[key]
+
+    def draw(self, image, xy, text, fill='black'):
+        '''Draws single line text on image with top left corner at xy (same
+        position and anchor as ImageDraw.text).
+        '''
+
+        # Pen starts at fraction of first pixel (centered lines can start at
+        # half pixels), same as ImageDraw.text start arg
+        pen, x = math.modf(xy[0])
+        x, y = int(x), int(xy[1])
+
+        previous = None
+        for char in text:
+            if previous is not None:
+                pen += self.kerning(previous, char)
+            bitmap, offset, advance = self.glyph(char)
+            if bitmap is not None:
+                left, top = x + math.floor(pen + 0.5) + offset[0], y + offset[1]
+                image.paste(fill, (left, top, left + bitmap.width, top + bitmap.height), bitmap)
+            pen += advance
+            previous = char
+
+
+@lru_cache(maxsize=64)
+def get_atlas(font):
+    '''Returns GlyphAtlas for font (from load_font, cached per font + size).'''
+    return GlyphAtlas(font)
+
+
+def supported(font):
+    '''Returns True if font uses Pillow's basic layout. Raqm layout (installed
+    with libraqm) can shape text (ligatures, combining marks), which can not be
+    drawn 1 glyph at a time.
+    '''
+    return font.layout_engine == ImageFont.Layout.BASIC
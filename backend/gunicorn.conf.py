@@ -0,0 +1,72 @@
+'''Gunicorn settings, overridden with environment variables.
+
+QR_WORKER_CLASS=sync (default) handles 1 request at a time per worker, so a
+slow render blocks every other request on that worker.
+
+QR_WORKER_CLASS=gthread handles QR_THREADS requests concurrently per worker.
+Combine with QR_RENDER_MODE=process so renders run in a bounded process pool
+(separate from the batch pool) and request threads stay free to serve other
+requests (eg the frontend). Each worker's pools get an equal share of the
+CPUs (QR_WORKERS is passed to the app).
+
+QR_PRELOAD=true (default) imports the app and runs warm up (fonts, template
+render) once in the master process, workers share it as copy-on-write memory.
+
+QR_METRICS_DIR (optional) is a directory where each worker writes its metrics,
+/metrics on any worker then returns totals for all workers. Files from the
+previous run are removed at startup.
+
+QR_COALESCE_DIR (optional) is a directory for lock files, concurrent requests
+for the same QR code on different workers then wait for 1 render and read it
+from the on-disk render cache (QR_CACHE_PATH).
+
+QR_MEMORY_BUDGET (optional) is the resident memory (MiB) allowed per worker.
+A worker over budget after a request frees cached memory, if it is still over
+budget it exits once its requests finish and gunicorn starts a new worker.
+'''
+
+import gc
+import os
+import glob
+
+bind = os.environ.get('QR_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('QR_WORKERS', 4))
+
+# Render process pools split the host CPUs between workers (see batch.py)
+os.environ['QR_WORKERS'] = str(workers)
+worker_class = os.environ.get('QR_WORKER_CLASS', 'sync')
+threads = int(os.environ.get('QR_THREADS', 1 if worker_class == 'sync' else 8))
+preload_app = os.environ.get('QR_PRELOAD', 'true').lower() == 'true'
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    '''Creates metrics directory, removes metrics written by previous run
+    (totals restart from 0).
+    '''
+    if os.environ.get('QR_METRICS_DIR'):
+        os.makedirs(os.environ['QR_METRICS_DIR'], exist_ok=True)
+        for path in glob.glob(os.path.join(os.environ['QR_METRICS_DIR'], '*.json')):
+            os.remove(path)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    '''Removes gauges (eg in-flight renders) written by exited worker.'''
+    from metrics import metrics  # pylint: disable=import-outside-toplevel
+    metrics.mark_process_dead(worker.pid)
+
+
+def post_request(worker, req, environ, resp):  # pylint: disable=unused-argument
+    '''Restarts worker (gracefully, same as max_requests) if it is still over
+    QR_MEMORY_BUDGET after freeing cached memory.
+    '''
+    from memory import memory_budget  # pylint: disable=import-outside-toplevel
+    if not memory_budget.check():
+        worker.log.warning('Worker %s over memory budget, restarting', worker.pid)
+        worker.alive = False
+
+
+def pre_fork(server, worker):  # pylint: disable=unused-argument
+    '''Moves objects created by preload to permanent generation so garbage
+    collection in workers does not write to (and copy) shared memory pages.
+    '''
+    gc.freeze()
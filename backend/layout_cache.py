@@ -0,0 +1,161 @@
+'''Caches fitted caption font sizes and text layout shared by all renders.'''
+
+import os
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+import PIL
+from PIL import Image, ImageDraw, ImageFont
+
+
+# Fitted font size, bounding box of whole text, and tuple of (x offset,
+# y offset, line text) for each line (offsets match ImageDraw align=center)
+TextLayout = namedtuple('TextLayout', ('size', 'bbox', 'lines'))
+
+
+@lru_cache(maxsize=512)
+def load_font(font_path, size):
+    '''Returns PIL.ImageFont for the requested font path and size.
+
+    Fonts are cached for the lifetime of the process (shared by all Qr
+    instances), so each TTF file is only parsed from disk once per size.
+    '''
+    return ImageFont.truetype(font_path, size)
+
+
+# Used to measure text (dimensions do not depend on image size or mode)
+_MEASURE = ImageDraw.Draw(Image.new('1', (1, 1)))
+
+
+def measure(text, font, spacing=4):
+    '''Returns TextLayout for text rendered with font (spacing is pixels
+    between lines of multiline text). Always measures, use LayoutCache.fit.
+    '''
+    bbox = _MEASURE.textbbox((0, 0), text, font, spacing=spacing)
+    lines = text.split('\n')
+    if len(lines) == 1:
+        return TextLayout(font.size, bbox, ((0, 0, text),))
+
+    # Same positions ImageDraw.text calculates for multiline text with
+    # align=center (measured in L mode, same as drawing on RGB image)
+    line_spacing = font.getbbox('A', 'L')[3] + spacing
+    widths = [font.getlength(line, 'L') for line in lines]
+    return TextLayout(font.size, bbox, tuple(
+        ((max(widths) - width) / 2.0, index * line_spacing, line)
+        for index, (line, width) in enumerate(zip(lines, widths))
+    ))
+
+
+def fit(text, font_path, max_size, max_width=None, spacing=4):
+    '''Returns TextLayout with largest font size (max_size or smaller, at least
+    1) where text is max_width pixels wide or less (or max_size if max_width
+    is None). Always measures, use LayoutCache.fit.
+    '''
+
+    # Return max size immediately if text already fits (most captions)
+    layout = measure(text, load_font(font_path, max_size), spacing)
+    if max_width is None or layout.bbox[2] <= max_width or max_size == 1:
+        return layout
+
+    # Binary search for largest size that fits (smallest is 1 point)
+    low, high = 1, max_size - 1
+    while low < high:
+        size = (low + high + 1) // 2
+        font = load_font(font_path, size)
+        if _MEASURE.textbbox((0, 0), text, font, spacing=spacing)[2] <= max_width:
+            low = size
+        else:
+            high = size - 1
+
+    return measure(text, load_font(font_path, low), spacing)
+
+
+class LayoutCache():
+    '''Bounded LRU mapping (text, font_path, max_size, max_width, spacing) to
+    the TextLayout returned by fit. Captions repeat across QR codes (same
+    domain, same wifi padding layout), on a hit no text is measured.
+
+    Entries can be saved to a JSON warm file (eg generated with the cli layouts
+    command and shipped in the image) and loaded at startup. Files saved with
+    a different Pillow version are ignored (text metrics may differ).
+    '''
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self.clear_stats()
+
+    def fit(self, text, font_path, max_size, max_width=None, spacing=4):
+        '''Returns cached TextLayout for args (see fit), fits and caches it if
+        not already cached.
+        '''
+        key = (text, font_path, max_size, max_width, spacing)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                return self._entries[key]
+            self._counters['misses'] += 1
+
+        layout = fit(text, font_path, max_size, max_width, spacing)
+        with self._lock:
+            self._set(key, layout)
+        return layout
+
+    def _set(self, key, layout):
+        '''Adds entry, evicts least recently used if full (caller holds lock).'''
+        self._entries[key] = layout
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def clear(self):
+        '''Removes all entries, resets counters.'''
+        with self._lock:
+            self._entries.clear()
+            self.clear_stats()
+
+    def clear_stats(self):
+        '''Resets all counters to 0.'''
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def stats(self):
+        '''Returns dict with hit, miss, and eviction counters and entry count.'''
+        return {**self._counters, 'entries': len(self._entries)}
+
+    def save(self, path):
+        '''Writes all entries to JSON file at path (least recently used first).'''
+        with self._lock:
+            entries = [[*key, *layout] for key, layout in self._entries.items()]
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'pillow': PIL.__version__, 'entries': entries}, file)
+
+    def load(self, path):
+        '''Adds entries from JSON file written by save, returns number loaded
+        (0 if file was saved with a different Pillow version).
+        '''
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+        if data.get('pillow') != PIL.__version__:
+            return 0
+
+        with self._lock:
+            for text, font_path, max_size, max_width, spacing, size, bbox, lines in \
+                    data['entries'][-self.max_entries:]:
+                self._set(
+                    (text, font_path, max_size, max_width, spacing),
+                    TextLayout(size, tuple(bbox), tuple(tuple(line) for line in lines))
+                )
+        return min(len(data['entries']), self.max_entries)
+
+
+# Shared by all Qr instances in the process, warm file loaded from
+# QR_LAYOUT_CACHE_PATH if set and present
+layout_cache = LayoutCache(max_entries=int(os.environ.get('QR_LAYOUT_CACHE_SIZE', 4096)))
+if os.path.exists(os.environ.get('QR_LAYOUT_CACHE_PATH', '')):
+    layout_cache.load(os.environ['QR_LAYOUT_CACHE_PATH'])
@@ -1,8 +1,6 @@
 '''Subclass of Qr for generating link QR codes.'''
 
-import segno
-
-from qr import Qr
+from qr import Qr, Field
 
 
 class LinkQr(Qr):
@@ -14,10 +12,32 @@ class LinkQr(Qr):
 
     The image with caption can be accessed at the qr_complete attribute.
     The image with no caption can be accessed at the qr_image attribute.
+    Both are generated the first time they are accessed. Optional size (width
+    in pixels), dpi and encoding keyword args are passed to Qr.
     '''
 
-    def __init__(self, url, text=None):
-        super().__init__()
+    # URL limit is the most any QR code can hold (the capacity check rejects
+    # shorter URLs that still do not fit)
+    type_key = 'link-qr'
+    fields = (
+        Field('url', 4296),
+        Field('text', 256, optional=True)
+    )
+    cost = 0.7
+    template = {'type': 'link-qr', 'url': 'https://jamedeus.com', 'text': 'Homepage'}
+
+    @classmethod
+    def normalize(cls, data):
+        '''Returns dict of constructor args from validated frontend payload.'''
+
+        # Text is not stripped by LinkQr, empty string is same as no text
+        return {
+            'url': data['url'].strip(),
+            'text': data.get('text') or None
+        }
+
+    def __init__(self, url, text=None, **kwargs):
+        super().__init__(**kwargs)
 
         self.url = url.strip()
         self.text = text
@@ -30,18 +50,16 @@ class LinkQr(Qr):
         else:
             self.filename = f"{self.url}_QR"
 
-        # Create QR code
-        self.generate()
-
-    def _generate_qr_code(self):
-        '''Returns segno instance with URL from class attribute.'''
-        return segno.make(f'{self.url}', micro=False)
+    @property
+    def content(self):
+        '''URL from class attribute.'''
+        return f'{self.url}'
 
     def _generate_caption(self):
         '''Returns list of caption dicts used by Qr.add_text method.'''
 
         # Get font, remove protocol and "_QR" from caption for readability
-        font = self._get_font(self.filename[:-3], self._MONO_FONT, 42)
+        font = self._get_font(self.filename[:-3], self._MONO_FONT, self._scaled(42))
 
         # List of dicts
         # Each dict contains text + font for 1 line under QR image
@@ -51,7 +69,7 @@ class LinkQr(Qr):
 
         # If text given add above URL in bold + larger font
         if self.text:
-            font = self._get_font(self.text, self._MONO_FONT_BOLD, 72)
+            font = self._get_font(self.text, self._MONO_FONT_BOLD, self._scaled(72))
             caption.insert(0, {'text': self.text, 'font': font})
 
         return caption
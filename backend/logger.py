@@ -0,0 +1,132 @@
+'''Structured JSON logging with sampling, redaction, and a non-blocking handler.'''
+
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Payload keys with personal data or secrets, values are never logged
+REDACTED_FIELDS = {'password', 'phone', 'email'}
+
+# Logger used by the backend, configured by setup_logging
+logger = logging.getLogger('qr')
+
+
+def redact(data):
+    '''Takes dict or list (eg /generate payload), returns copy with values of
+    keys in REDACTED_FIELDS replaced (searches nested dicts and lists).
+    '''
+    if isinstance(data, dict):
+        return {
+            key: '[REDACTED]' if key in REDACTED_FIELDS else redact(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [redact(item) for item in data]
+    return data
+
+
+class JsonFormatter(logging.Formatter):
+    '''Formats each record as 1 line JSON object with time, level, logger, and
+    message keys, plus every key in the dict passed as extra={'fields': ...}.
+    '''
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                    + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **redact(getattr(record, 'fields', {}))
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    '''Keeps sample_rate (0-1) fraction of records below WARNING, warnings and
+    errors are always kept.
+    '''
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.sample_rate
+
+
+class AsyncLogHandler(QueueHandler):
+    '''Adds records to a queue, a background thread formats and writes them
+    to stream so request threads never block on stdout.
+
+    Each process has its own queue and thread (restarted after fork, eg in
+    gunicorn workers forked after preload).
+    '''
+
+    def __init__(self, stream):
+        super().__init__(queue.SimpleQueue())
+        self.stream_handler = logging.StreamHandler(stream)
+        self.stream_handler.setFormatter(JsonFormatter())
+        self.listener = None
+        self.start()
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.stop)
+
+    def start(self):
+        '''Starts thread writing queued records.'''
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue, self.stream_handler)
+        self.listener.start()
+
+    def stop(self):
+        '''Writes remaining queued records, stops thread.'''
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+
+    def _after_fork(self):
+        '''Replaces queue and thread in new child process (unless stopped).'''
+        if self.listener:
+            self.start()
+
+    def prepare(self, record):
+        '''Returns copy of record with message args and exception traceback
+        converted to strings (formatting and redaction happen in the thread).
+        '''
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level='INFO', sample_rate=1.0, stream=None):
+    '''Configures qr logger to write JSON lines to stream (default stdout)
+    through AsyncLogHandler. Records below WARNING are sampled at sample_rate.
+    Replaces handlers added by previous calls. Returns the handler.
+    '''
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        if isinstance(handler, AsyncLogHandler):
+            handler.stop()
+
+    handler = AsyncLogHandler(stream or sys.stdout)
+    handler.addFilter(SamplingFilter(sample_rate))
+    logger.addHandler(handler)
+    logger.setLevel(level.upper())
+    logger.propagate = False
+    return handler
@@ -0,0 +1,172 @@
+'''Bounds memory used by renders: reusable encode buffers, reuse of freed
+image memory, and a per-process resident memory budget.'''
+
+import io
+import os
+import gc
+import ctypes
+import threading
+from contextlib import contextmanager
+
+from PIL import Image
+
+
+# Per-process resident memory budget in MiB (0 disables). After each request
+# a worker over budget frees cached memory, if still over budget it is
+# restarted by gunicorn once the request finishes (see gunicorn.conf.py)
+MEMORY_BUDGET = int(os.environ.get('QR_MEMORY_BUDGET', 0)) * 1024 * 1024
+
+# Number of freed PIL image memory blocks kept for reuse by the next image
+# (Pillow default 0 frees every canvas). Renders at standard sizes allocate
+# the same canvases every time, reusing them avoids malloc/free churn that
+# fragments the heap (resident memory grows and is not returned to the OS)
+IMAGE_BLOCKS = int(os.environ.get('QR_IMAGE_BLOCKS', 16))
+
+# Size of each image block (bytes), larger images span several blocks. Caps
+# memory held by idle cached blocks at IMAGE_BLOCKS x IMAGE_BLOCK_SIZE (Pillow
+# default is 16 MiB, cached blocks from 1 large render could pin 256 MiB)
+IMAGE_BLOCK_SIZE = 2 * 1024 * 1024
+
+# Encode buffers larger than this (bytes) are not returned to the pool, so 1
+# huge render does not pin its buffer for the life of the process
+MAX_POOLED_BUFFER = 4 * 1024 * 1024
+
+
+def configure_image_blocks(blocks=IMAGE_BLOCKS, block_size=IMAGE_BLOCK_SIZE):
+    '''Sets number of freed PIL image blocks cached for reuse (0 disables)
+    and size of each block.
+    '''
+    Image.core.set_block_size(block_size)
+    Image.core.set_blocks_max(blocks)
+
+
+class BufferPool():
+    '''Pool of BytesIO buffers reused for encoding images.
+
+    Buffers are rewound instead of truncated (BytesIO shrinks its storage on
+    truncate and copies it on the next write after getvalue), so a buffer
+    grows to the largest image it encoded once and is then written in place.
+    Holds at most max_buffers idle buffers (1 per concurrent encode is enough).
+    '''
+
+    def __init__(self, max_buffers=16, max_size=MAX_POOLED_BUFFER):
+        self.max_buffers = max_buffers
+        self.max_size = max_size
+        self._buffers = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def buffer(self):
+        '''Context manager, yields empty BytesIO positioned at 0 (read the
+        written bytes with pooled_value, not getvalue).
+        '''
+        with self._lock:
+            buffer = self._buffers.pop() if self._buffers else io.BytesIO()
+        buffer.seek(0)
+        try:
+            yield buffer
+        finally:
+            # Size of the storage (largest image written), not this image
+            if buffer.getbuffer().nbytes <= self.max_size:
+                with self._lock:
+                    if len(self._buffers) < self.max_buffers:
+                        self._buffers.append(buffer)
+
+    def clear(self):
+        '''Drops all idle buffers.'''
+        with self._lock:
+            self._buffers.clear()
+
+
+def pooled_value(buffer):
+    '''Returns bytes written to pooled buffer (up to current position, the
+    rest is left over from larger images).
+    '''
+    with buffer.getbuffer() as view:
+        return view[:buffer.tell()].tobytes()
+
+
+# Shared pool for the current process
+buffer_pool = BufferPool()
+
+
+def _load_libc():
+    '''Returns glibc handle (for malloc_trim) or None on other platforms.'''
+    try:
+        libc = ctypes.CDLL('libc.so.6')
+        libc.malloc_trim.argtypes = (ctypes.c_size_t,)
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+def resident_memory():
+    '''Returns resident memory of the current process in bytes (0 if unknown,
+    only read on Linux).
+    '''
+    try:
+        with open('/proc/self/statm', encoding='utf-8') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class MemoryBudget():
+    '''Checks resident memory of the process against a budget (bytes, 0
+    disables). When over budget frees memory with each trimmer (added with
+    add_trimmer, eg clearing caches), collects garbage, releases cached image
+    blocks and encode buffers, and returns free heap pages to the OS.
+
+    Counters of checks over budget (trims) and checks still over budget after
+    trimming (exceeded) are returned by the stats method.
+    '''
+
+    def __init__(self, budget=MEMORY_BUDGET):
+        self.budget = budget
+        self._trimmers = []
+        self._counters = {}
+        self.clear_stats()
+
+    def clear_stats(self):
+        '''Resets all counters to 0.'''
+        self._counters = {'trims': 0, 'exceeded': 0}
+
+    def stats(self):
+        '''Returns dict with trim counters and current resident memory.'''
+        return {**self._counters, 'resident': resident_memory()}
+
+    def add_trimmer(self, func):
+        '''Adds function (no args) called to free memory when over budget.'''
+        self._trimmers.append(func)
+
+    def trim(self):
+        '''Frees cached memory, returns resident memory after trimming.'''
+        for func in self._trimmers:
+            func()
+        buffer_pool.clear()
+        gc.collect()
+        Image.core.clear_cache()
+        if _libc is not None:
+            _libc.malloc_trim(0)
+        return resident_memory()
+
+    def check(self):
+        '''Returns True if within budget (trims first if over budget), False
+        if still over budget after trimming (caller should restart process).
+        '''
+        if not self.budget or resident_memory() <= self.budget:
+            return True
+        self._counters['trims'] += 1
+        if self.trim() <= self.budget:
+            return True
+        self._counters['exceeded'] += 1
+        return False
+
+
+# Shared budget for the current process
+memory_budget = MemoryBudget()
+
+configure_image_blocks()
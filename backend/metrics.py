@@ -0,0 +1,367 @@
+'''Counters, gauges, and histograms exported in Prometheus text format.'''
+
+import os
+import glob
+import json
+import math
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# Histogram upper bounds (seconds), most render stages take 1-50ms
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# File in the metrics directory with totals of exited processes
+EXITED_FILE = 'exited.json'
+
+# Type and help text for each metric name (metrics not listed are untyped)
+METRICS = {
+    'qr_http_requests_total': ('counter', 'HTTP requests by endpoint, method, and status'),
+    'qr_http_request_duration_seconds': ('histogram', 'HTTP request duration by endpoint'),
+    'qr_renders_total': ('counter', 'QR codes rendered by type and format'),
+    'qr_render_errors_total': ('counter', 'Renders that raised an exception by type'),
+    'qr_render_seconds': ('histogram', 'Time to render all requested variants'),
+    'qr_render_stage_seconds': (
+        'histogram', 'Time spent in each render stage by type and symbol version'
+    ),
+    'qr_response_encode_seconds': ('histogram', 'Time to base64 encode /generate images'),
+    'qr_renders_in_flight': ('gauge', 'Renders running or queued (all workers)'),
+    'qr_cache_hits_total': ('counter', 'Render cache hits by tier'),
+    'qr_cache_misses_total': ('counter', 'Render cache misses'),
+    'qr_cache_evictions_total': ('counter', 'Render cache evictions by tier'),
+    'qr_cache_oversized_total': (
+        'counter', 'Render cache entries larger than the byte limit of a tier (not cached)'
+    ),
+    'qr_cache_disk_errors_total': (
+        'counter', 'Render cache disk tier reads and writes that failed (eg database full)'
+    ),
+    'qr_cache_bytes': ('gauge', 'Image bytes in render cache by tier (all workers)'),
+    'qr_renders_coalesced_total': (
+        'counter', 'Requests that shared a concurrent render of the same image by scope'
+    ),
+    'qr_layout_cache_hits_total': ('counter', 'Caption layouts reused without measuring text'),
+    'qr_layout_cache_misses_total': ('counter', 'Caption layouts measured (not cached)'),
+    'qr_layout_cache_evictions_total': ('counter', 'Caption layouts evicted from cache'),
+    'qr_encode_cache_hits_total': ('counter', 'QR codes reused without encoding'),
+    'qr_encode_cache_misses_total': ('counter', 'QR codes encoded (not cached)'),
+    'qr_memory_trims_total': ('counter', 'Times a worker over its memory budget freed memory'),
+    'qr_memory_budget_exceeded_total': (
+        'counter', 'Times a worker was still over its memory budget after freeing memory'
+    ),
+    'qr_resident_memory_bytes': ('gauge', 'Resident memory of worker processes (all workers)'),
+}
+
+
+def _label_key(labels):
+    '''Takes dict of labels, returns hashable tuple of (name, value) pairs.'''
+    return tuple(sorted((name, str(value)) for name, value in (labels or {}).items()))
+
+
+class Metrics():
+    '''Registry of counters, gauges, and histograms for the current process.
+
+    If path is set each process (gunicorn workers and render processes) writes
+    its values to a JSON file in that directory every flush_interval seconds,
+    and collect merges every file so any worker can serve /metrics for all of
+    them. Files are named by pid and process start time, so a new process
+    that reuses a pid does not overwrite the totals of the exited one.
+    Counters and histograms from exited processes are kept (totals must never
+    decrease), gauges are only kept while the process is running.
+
+    Collector functions added with add_collector are called when values are
+    written and return list of (kind, name, labels, value) tuples, used for
+    values owned by other objects (eg render cache counters).
+    '''
+
+    def __init__(self, path=None, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._collectors = []
+        self._values = {}
+        self._flusher = None
+        self._filename = self._process_filename()
+        self.clear()
+
+        # Forked workers do not inherit the flush thread (or a held lock)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        '''Replaces lock, flush thread, and snapshot filename in new child
+        process.
+        '''
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._filename = self._process_filename()
+
+    @staticmethod
+    def _process_filename():
+        '''Returns snapshot filename unique to the current process.'''
+        return f'{os.getpid()}-{time.time_ns()}.json'
+
+    def clear(self):
+        '''Resets all values to 0 (does not remove collectors).'''
+        with self._lock:
+            self._values = {'counter': {}, 'gauge': {}, 'histogram': {}}
+
+    def add_collector(self, func):
+        '''Adds function called on each snapshot, must return list of (kind,
+        name, labels, value) tuples (kind is counter or gauge).
+        '''
+        self._collectors.append(func)
+
+    def inc(self, name, labels=None, value=1):
+        '''Adds value to counter.'''
+        key = (name, _label_key(labels))
+        with self._lock:
+            counters = self._values['counter']
+            counters[key] = counters.get(key, 0) + value
+        self._start_flusher()
+
+    def observe(self, name, value, labels=None):
+        '''Adds value (seconds) to histogram.'''
+        key = (name, _label_key(labels))
+        with self._lock:
+            histograms = self._values['histogram']
+            if key not in histograms:
+                histograms[key] = {'buckets': [0] * len(BUCKETS), 'sum': 0, 'count': 0}
+            histogram = histograms[key]
+
+            # Stored per bucket (not cumulative), values above last bound
+            # are only included in count
+            index = bisect_left(BUCKETS, value)
+            if index < len(BUCKETS):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self._start_flusher()
+
+    @contextmanager
+    def timer(self, name, labels=None):
+        '''Context manager, adds duration of block to histogram.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    def snapshot(self):
+        '''Returns JSON serializable dict with values from this process.'''
+
+        with self._lock:
+            values = {
+                'counter': dict(self._values['counter']),
+                'gauge': dict(self._values['gauge']),
+                'histogram': {
+                    key: {**histogram, 'buckets': list(histogram['buckets'])}
+                    for key, histogram in self._values['histogram'].items()
+                }
+            }
+
+        for collector in self._collectors:
+            for kind, name, labels, value in collector():
+                values[kind][(name, _label_key(labels))] = value
+
+        return {
+            kind: [[name, list(labels), value] for (name, labels), value in samples.items()]
+            for kind, samples in values.items()
+        }
+
+    def flush(self):
+        '''Writes snapshot to <path>/<pid>-<start time>.json (atomic replace).'''
+        if not self.path:
+            return
+        _write_json(os.path.join(self.path, self._filename), self.snapshot())
+
+    def _start_flusher(self):
+        '''Starts thread that calls flush every flush_interval seconds (first
+        time a value is added in each process).
+        '''
+        if not self.path or self._flusher:
+            return
+        with self._lock:
+            if self._flusher:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        '''Calls flush every flush_interval seconds until process exits.'''
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def mark_process_dead(self, pid):
+        '''Moves counters and histograms written by pid (called when gunicorn
+        worker exits) into the exited process totals and removes its file,
+        gauges are dropped. Only called by 1 process (gunicorn master).
+        '''
+        if not self.path:
+            return
+        exited_path = os.path.join(self.path, EXITED_FILE)
+        for path in glob.glob(os.path.join(self.path, f'{pid}-*.json')):
+            snapshot = _read_json(path)
+            if snapshot is None:
+                continue
+            exited = _read_json(exited_path) or {}
+            merged = _merge([exited, snapshot])
+            merged['gauge'] = {}
+
+            # Written before the file is removed and lists it, so collect
+            # never counts it twice or misses it (totals never decrease)
+            files = [name for name in exited.get('files', []) if os.path.exists(
+                os.path.join(self.path, name)
+            )]
+            _write_json(exited_path, {
+                **_to_snapshot(merged), 'files': [*files, os.path.basename(path)]
+            })
+            os.remove(path)
+
+    def collect(self):
+        '''Returns snapshot dict with values from every process (or only this
+        process if path is not set). Values with the same name and labels are
+        added together.
+        '''
+
+        if not self.path:
+            return _merge([self.snapshot()])
+
+        try:
+            self.flush()
+            filenames = os.listdir(self.path)
+        except OSError:
+            # Directory missing or not writable, only this process is included
+            return _merge([self.snapshot()])
+
+        snapshots = {}
+        for filename in filenames:
+            if filename.endswith('.json') and filename != EXITED_FILE:
+                snapshot = _read_json(os.path.join(self.path, filename))
+                if snapshot is not None:
+                    snapshots[filename] = snapshot
+
+        # Read after process files, a file missing above was already merged
+        # into the exited totals, files read above that were also merged are
+        # listed and skipped
+        exited = _read_json(os.path.join(self.path, EXITED_FILE)) or {}
+        for filename in exited.pop('files', []):
+            snapshots.pop(filename, None)
+        return _merge([exited, *snapshots.values()])
+
+    def render(self):
+        '''Returns all values from collect in Prometheus text format.'''
+
+        lines = []
+        described = set()
+        merged = self.collect()
+        for kind in ('counter', 'gauge', 'histogram'):
+            for (name, labels), value in sorted(merged[kind].items()):
+                if name not in described:
+                    described.add(name)
+                    metric_type, description = METRICS.get(name, ('untyped', name))
+                    lines.append(f'# HELP {name} {description}')
+                    lines.append(f'# TYPE {name} {metric_type}')
+
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(BUCKETS, value['buckets']):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{_format_labels(labels, le=f"{bound:g}")} {cumulative}'
+                    )
+                lines.append(f'{name}_bucket{_format_labels(labels, le="+Inf")} {value["count"]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value["sum"])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value["count"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(snapshots):
+    '''Takes list of snapshot dicts, returns dict mapping kind to dict of
+    (name, labels) keys and values, same name and labels added together.
+    '''
+    merged = {'counter': {}, 'gauge': {}, 'histogram': {}}
+    for snapshot in snapshots:
+        for kind, totals in merged.items():
+            for name, labels, value in snapshot.get(kind, []):
+                key = (name, tuple(tuple(label) for label in labels))
+                if kind != 'histogram':
+                    totals[key] = totals.get(key, 0) + value
+                elif key not in totals:
+                    totals[key] = {**value, 'buckets': list(value['buckets'])}
+                else:
+                    total = totals[key]
+                    total['buckets'] = [
+                        a + b for a, b in zip(total['buckets'], value['buckets'])
+                    ]
+                    total['sum'] += value['sum']
+                    total['count'] += value['count']
+    return merged
+
+
+def _to_snapshot(merged):
+    '''Takes dict returned by _merge, returns JSON serializable snapshot.'''
+    return {
+        kind: [[name, list(labels), value] for (name, labels), value in samples.items()]
+        for kind, samples in merged.items()
+    }
+
+
+def _read_json(path):
+    '''Returns object from JSON file, or None if missing or incomplete.'''
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, value):
+    '''Writes value to JSON file (atomic replace, readers never see a partial
+    file).
+    '''
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+        json.dump(value, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def _format_value(value):
+    '''Returns sample value in Prometheus text format, integers as integers
+    and floats with full precision (shortest repr that reads back the same).
+    '''
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labels, **extra):
+    '''Takes tuple of (name, value) pairs, returns Prometheus label string.'''
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+# Shared registry for the current process, files written to QR_METRICS_DIR
+# (if set) are merged so /metrics includes every worker and render process
+metrics = Metrics(
+    path=os.environ.get('QR_METRICS_DIR') or None,
+    flush_interval=float(os.environ.get('QR_METRICS_FLUSH_INTERVAL', 1))
+)
@@ -1,8 +1,83 @@
 '''Base class for generating QR code images with text captions.'''
 
-import io
+import os
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import cached_property, lru_cache
+from xml.sax.saxutils import escape, quoteattr
+
+import segno
+from PIL import Image, ImageDraw
+
+import glyph_atlas
+from capacity import min_version
+from layout_cache import layout_cache, load_font
+
+
+# Translation table mapping segno module values to greyscale pixel values
+# (dark modules are 0x1 = black, light modules are 0x0 = white)
+_MODULE_COLORS = bytes([255, 0]) + bytes(254)
+
+# Options passed to segno when encoding (None lets segno choose): lowest error
+# correction level (L, M, Q or H, segno raises it if it still fits in the same
+# version), mask pattern (0-7, skips scoring all 8 masks), fixed version (1-40,
+# same symbol size for every payload), and minimum version (smallest version
+# the content fits in, but at least min_version)
+Encoding = namedtuple(
+    'Encoding', ('error', 'mask', 'version', 'min_version'), defaults=(None, None, None, None)
+)
+
+# Max encoded QR codes kept per process (QR_ENCODE_CACHE_SIZE, 0 disables).
+# Re-rendering the same content (other sizes, formats or variants) skips
+# encoding and mask evaluation, about 1 KiB per cached version 5 symbol
+ENCODE_CACHE_SIZE = int(os.environ.get('QR_ENCODE_CACHE_SIZE', 1024))
+
+
+# Payload field (frontend key) with max length in characters, all fields are
+# strings and required (must not be blank) unless optional is True. Optional
+# pattern (compiled regex) must match the stripped value, the error message
+# says the field must be description
+Field = namedtuple(
+    'Field',
+    ('name', 'max_length', 'optional', 'pattern', 'description'),
+    defaults=(False, None, None)
+)
+
+# Qr subclasses by payload type key (eg link-qr), each subclass that sets
+# type_key is added when its module is imported (see Qr.__init_subclass__)
+QR_TYPES = {}
+
+
+@lru_cache(maxsize=ENCODE_CACHE_SIZE)
+def encode(content, error=None, mask=None, version=None):
+    '''Returns segno instance encoding content string with options, cached so
+    identical content is only encoded once. Instances are shared between
+    renders and must not be modified.
+    '''
+    return segno.make(content, error=error, mask=mask, version=version, micro=False)
+
+
+# Encode cache hits and misses before the last clear_encode_cache call (the
+# lru_cache counters reset when cleared, metrics totals must never decrease)
+_encode_cleared = {'hits': 0, 'misses': 0}
+
+
+def clear_encode_cache():
+    '''Empties the encode cache (frees memory), keeps its hit/miss totals.'''
+    info = encode.cache_info()
+    _encode_cleared['hits'] += info.hits
+    _encode_cleared['misses'] += info.misses
+    encode.cache_clear()
+
 
-from PIL import Image, ImageDraw, ImageFont
+def encode_cache_stats():
+    '''Returns dict with encode cache hits and misses since process start.'''
+    info = encode.cache_info()
+    return {
+        'hits': _encode_cleared['hits'] + info.hits,
+        'misses': _encode_cleared['misses'] + info.misses
+    }
 
 
 class Qr():
@@ -13,13 +88,31 @@ class Qr():
     to add dynamically-sized text underneath the QR code, and to write the PNG
     to disk.
 
-    The child class must contain a _generate_qr_code method which returns a
-    pyqrcode instance with the appropriate data.
-
-    The child class must also contain a _caption attribute containing a list of
-    dicts, one dict for each line of the caption. Each dict contains a text key
-    with the caption text and a font key with a PIL.ImageFont. Fonts can be
-    generated with the _get_font method on this class.
+    The child class must contain a content property with the string the QR
+    code encodes, it is encoded by the _generate_qr_code method on this class
+    (with the encoding arg options, see Encoding) and used to check capacity
+    before encoding.
+
+    The child class must also contain a _generate_caption method which returns
+    a list of dicts, one dict for each line of the caption. Each dict contains a
+    text key with the caption text and a font key with a PIL.ImageFont. Fonts
+    can be generated with the _get_font method on this class.
+
+    Subclasses that set the type_key class attribute are registered in
+    QR_TYPES and can be rendered from /generate payloads. They must also set
+    fields (tuple of Field, checked before the payload is normalized) and a
+    normalize classmethod, and may set secret, cost and template (see below).
+
+    The size arg sets the approximate width of the image in pixels, caption
+    font sizes and spacing are scaled proportionally (subclasses should pass
+    max font sizes for the default 500 pixel width through _scaled). The dpi
+    arg (optional) is written to saved PNG metadata and sets SVG print size.
+    The encoding arg (optional Encoding) sets error level, mask and version.
+
+    Each stage of the pipeline (qr_raw, qr_image, _caption, qr_complete) is
+    generated the first time it is accessed and then reused, so only the stages
+    the caller actually needs are run. Seconds spent in each stage are added to
+    the stage_timings dict (keys are encode, rasterize, font_size, compose, svg).
     '''
 
     # Font paths
@@ -28,32 +121,150 @@ class Qr():
     _SANS_FONT = "/usr/share/fonts/truetype/ubuntu/Ubuntu-R.ttf"
     _SANS_FONT_BOLD = "/usr/share/fonts/truetype/ubuntu/Ubuntu-B.ttf"
 
-    def __init__(self):
-        # Default filename (subclass should replace)
-        self.filename = "QR"
+    # Width of light area around QR code (modules)
+    _BORDER = 3
+
+    # Default image width (pixels), caption metrics are designed for this width
+    _DEFAULT_SIZE = 500
+
+    # Pixels the caption overlaps the bottom of the QR code border at default
+    # width (never more than the border, caption must not cover modules)
+    _CAPTION_OVERLAP = 24
 
-        # Stores pyqrcode instance generated by _generate_qr_code method
-        self.qr_raw = None
+    # Lazily generated pipeline stages (in order), cleared by generate method
+    _STAGES = ('qr_raw', 'qr_image', '_caption', 'qr_complete')
 
-        # Stores PIL.Image containing QR code PNG
-        self.qr_image = None
+    # Payload type key (registers subclass in QR_TYPES) and payload fields
+    type_key = None
+    fields = ()
 
-        # List returned by _generate_caption method (1 dict per caption line)
-        self._caption = None
+    # Content contains credentials, excluded from on-disk caches by default
+    secret = False
 
-        # Finished PIL.Image PNG with QR code and caption
-        self.qr_complete = None
+    # Relative render time of the template at default size (contact-qr is 1),
+    # batches submit the most expensive renders first so no render process is
+    # left with a long tail
+    cost = 1.0
+
+    # Frontend payload rendered by warm_up so every code path is initialized
+    template = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.type_key is not None:
+            if cls.type_key in QR_TYPES:
+                raise TypeError(f"QR code type {cls.type_key} is already registered")
+            QR_TYPES[cls.type_key] = cls
+
+    def __init__(self, size=500, dpi=None, encoding=None):
+        # Default filename (subclass should replace)
+        self.filename = "QR"
+
+        # Approximate output width (pixels) and optional print resolution
+        self.size = size
+        self.dpi = dpi
+
+        # Encoding options (error level, mask, version) passed to segno
+        self.encoding = encoding or Encoding()
+
+        # TextLayout of each caption row (from layout cache), keys are (text, font)
+        self._text_layouts = {}
+
+        # Seconds spent in each pipeline stage (read by render metrics)
+        self.stage_timings = {}
+
+    @cached_property
+    def qr_raw(self):
+        '''Segno instance generated by _generate_qr_code method'''
+        with self.time_stage('encode'):
+            return self._generate_qr_code()
+
+    @cached_property
+    def qr_image(self):
+        '''PIL.Image containing QR code PNG (no caption)'''
+        with self.time_stage('rasterize'):
+            return self._generate_qr_image()
+
+    @cached_property
+    def _caption(self):
+        '''List returned by _generate_caption method (1 dict per caption line)'''
+        with self.time_stage('font_size'):
+            return self._generate_caption()
+
+    @cached_property
+    def qr_complete(self):
+        '''Finished PIL.Image PNG with QR code and caption'''
+
+        # Generate earlier stages in order before combining them
+        for stage in self._STAGES[:-1]:
+            getattr(self, stage)
+        with self.time_stage('compose'):
+            return self._add_text()
+
+    @contextmanager
+    def time_stage(self, stage):
+        '''Context manager, adds seconds spent in block to stage_timings (also
+        used by callers to time work outside the pipeline, eg PNG encoding).
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_timings[stage] = (
+                self.stage_timings.get(stage, 0) + time.perf_counter() - start
+            )
+
+    @classmethod
+    def preload_fonts(cls, max_size=72):
+        '''Loads all caption fonts at every size up to max_size into the font
+        cache, prevents first render in a new process reading fonts from disk.
+        '''
+        for font_path in (cls._MONO_FONT, cls._MONO_FONT_BOLD, cls._SANS_FONT,
+                          cls._SANS_FONT_BOLD):
+            for size in range(1, max_size + 1):
+                load_font(font_path, size)
 
     def generate(self):
-        '''Calls all methods to generate complete QR code'''
-        self.qr_raw = self._generate_qr_code()
-        self.qr_image = self._generate_qr_image()
-        self._caption = self._generate_caption()
-        self.qr_complete = self._add_text()
+        '''Discards previously generated stages, calls all methods to generate
+        complete QR code (not required, stages are generated when accessed).
+        '''
+        self.release(*self._STAGES)
+        self.stage_timings = {}
+        return self.qr_complete
+
+    def release(self, *stages):
+        '''Discards generated stages (eg images already encoded) so their
+        memory is freed while the instance is still in use. Stages are
+        generated again if accessed later.
+        '''
+        for stage in stages:
+            self.__dict__.pop(stage, None)
+
+    @classmethod
+    def normalize(cls, data):
+        '''Subclass must replace with a classmethod that takes validated payload
+        from frontend (matches fields) and returns dict of constructor args,
+        formatted the same way the constructor formats them (cache key, two
+        payloads that produce the same QR code must return the same dict).
+        '''
+        raise NotImplementedError("Subclass must implement normalize classmethod")
+
+    @property
+    def content(self):
+        '''Subclass must replace with a property that returns encoded string'''
+        raise NotImplementedError("Subclass must implement content property")
 
     def _generate_qr_code(self):
-        '''Subclass must replace with a method that returns pyqrcode instance'''
-        raise NotImplementedError("Subclass must implement _generate_qr_code method")
+        '''Returns segno instance encoding content property with encoding
+        options (shared, from the encode cache).
+        '''
+        error, mask, version, minimum = self.encoding
+        if version is None and minimum is not None:
+            # Smallest version the content fits in, but at least minimum (left
+            # to segno if it does not fit, which raises DataOverflowError)
+            fits = min_version(self.content, error or 'L')
+            version = max(fits, minimum) if fits else None
+        return encode(self.content, error, mask, version)
 
     def _generate_caption(self):
         '''Subclass must replace with a method that returns list of dict (1 for
@@ -62,118 +273,250 @@ class Qr():
         '''
         raise NotImplementedError("Subclass must implement _generate_caption method")
 
-    def _generate_qr_image(self, size=500):
+    def _scaled(self, value):
+        '''Takes caption metric (font size or pixels) for the default 500 pixel
+        width, returns value scaled to self.size (at least 1).
+        '''
+        return max(1, round(value * self.size / self._DEFAULT_SIZE))
+
+    def _get_scale(self, size=None):
+        '''Returns largest integer pixels per module that fits QR code (with
+        border) in size pixels (default self.size), at least 1.
+        '''
+        size = size or self.size
+        return max(1, int(size / self.qr_raw.symbol_size(border=self._BORDER)[0]))
+
+    def _get_width(self, size=None):
+        '''Returns width (and height) of qr_image in pixels without generating it'''
+        return self.qr_raw.symbol_size(border=self._BORDER)[0] * self._get_scale(size)
+
+    def _caption_overlap(self):
+        '''Returns pixels the caption overlaps the bottom of qr_image (scaled,
+        at most the border width so only light pixels are covered).
+        '''
+        return min(self._scaled(self._CAPTION_OVERLAP), self._BORDER * self._get_scale())
+
+    def crop_box(self):
+        '''Returns [left, top, right, bottom] box of the QR code in qr_complete
+        that the caption does not overlap, without generating any images. The
+        rows below the box (down to the qr_image width) are light border, so
+        padding the crop with white to a square gives qr_image.
+        '''
+        width = self._get_width()
+        return [0, 0, width, width - self._caption_overlap()]
+
+    def _generate_qr_image(self, size=None):
         '''Returns PIL.Image with QR code png. Must call _generate_qr_code first.
-        Size arg sets approximate width (pixels) of output PNG (will calculate
-        closest size that does not require scaling).
+        Size arg sets approximate width (pixels) of output PNG (default
+        self.size, will calculate closest size that does not require scaling).
         '''
 
         # Calc scale needed for requested size
-        scale = int(size / self.qr_raw.symbol_size(border=3)[0])
+        width = self.qr_raw.symbol_size(border=self._BORDER)[0]
+        scale = self._get_scale(size)
+
+        # Build 1 pixel per module greyscale image (white border, black modules)
+        modules = len(self.qr_raw.matrix)
+        pixels = b''.join(row.translate(_MODULE_COLORS) for row in self.qr_raw.matrix)
+        image = Image.new('L', (width, width), 255)
+        image.paste(
+            Image.frombytes('L', (modules, modules), pixels),
+            (self._BORDER, self._BORDER)
+        )
 
-        # Write QR to PNG in mem buffer
-        image = io.BytesIO()
-        self.qr_raw.save(image, scale=scale, border=3, kind='png')
+        # Convert to 1-bit (same as segno PNG) while still 1 pixel per module,
+        # then scale straight to output size without interpolation (no full
+        # size greyscale intermediate)
+        image = image.convert('1', dither=Image.Dither.NONE)
+        return image.resize((width * scale, width * scale), Image.Resampling.NEAREST)
 
-        # Return PIL object instantiated from buffer
-        return Image.open(image)
+    def _text_layout(self, text, font):
+        '''Returns TextLayout (bounding box and line positions) of text rendered
+        with font. Fonts sized by _get_font are already known, other text is
+        looked up in the layout cache (only measured once per process).
+        '''
+        key = (text, font)
+        if key not in self._text_layouts:
+            self._text_layouts[key] = layout_cache.fit(
+                text, font.path, font.size, spacing=self._scaled(4)
+            )
+        return self._text_layouts[key]
 
     def _get_font(self, text, font_path, max_size):
-        '''Takes caption string, font path, and image width.
+        '''Takes caption string, font path, and max font size (already scaled).
         Returns PIL.ImageFont with size that makes text 90% image width or less.
         '''
 
-        # For calculating text dimensions
-        draw = ImageDraw.Draw(self.qr_image)
-        max_width = int(self.qr_image.width * 0.90)
-
-        # Start at max size, decrease until text fits
-        font = ImageFont.truetype(font_path, max_size)
-        while draw.textbbox((0, 0), text, font)[2] > max_width:
-            max_size -= 1
-            font = ImageFont.truetype(font_path, max_size)
+        # For calculating text dimensions (does not generate qr_image)
+        max_width = int(self._get_width() * 0.90)
 
+        # Layout is kept so _layout_caption does not look it up again
+        layout = layout_cache.fit(text, font_path, max_size, max_width, self._scaled(4))
+        font = load_font(font_path, layout.size)
+        self._text_layouts[(text, font)] = layout
         return font
 
-    def _add_text(self):
-        '''Iterates self._caption list and adds each string to self.qr_image.
-        Returns completed image with all caption lines underneath QR code.
+    def _layout_caption(self):
+        '''Returns tuple with height of area needed below QR code for caption
+        and list of (row dict, x, y, row width) tuples, where x and y are the
+        position of each caption row's top left corner.
         '''
 
-        # Amount of space needed under QR code for given text + font size
-        add_height = 0
+        width = self._get_width()
+        rows = []
 
-        # Used to calculate dimensions of rendered text
-        draw = ImageDraw.Draw(self.qr_image)
+        # Track space used by each row so next doesn't overlap
+        used_height = 0
 
-        # Iterate rows, calculate height, add to add_height
         for row in self._caption:
-            _, _, row_width, row_height = draw.textbbox(
-                xy=(0, 0),
-                text=row['text'],
-                font=row['font']
-            )
-            add_height += row_height
+            # Get dimensions of each row (already measured by _get_font)
+            _, _, row_width, row_height = self._text_layout(row['text'], row['font']).bbox
 
-        # Create empty space for text
-        text_area = Image.new(
-            'RGB',
-            (self.qr_image.width, add_height),
-            color='white'
-        )
+            # Calc info position (caption overlaps bottom of QR code border)
+            x = (width - row_width) // 2
+            y = width + used_height - self._caption_overlap()
+            rows.append((row, x, y, row_width))
 
-        # Add text_area below QR code with enough space for all rows
+            # Prevent next line overlapping
+            used_height += row_height
+
+        return used_height, rows
+
+    def _add_text(self):
+        '''Iterates self._caption list and adds each string to self.qr_image.
+        Returns completed image with all caption lines underneath QR code.
+        '''
+
+        # Amount of space needed under QR code for given text + font size
+        add_height, rows = self._layout_caption()
+
+        # Create white canvas with enough space for QR code + all rows
         result = Image.new(
             'RGB',
-            (
-                self.qr_image.width,
-                self.qr_image.height + text_area.height
-            )
+            (self.qr_image.width, self.qr_image.height + add_height),
+            color='white'
         )
         result.paste(self.qr_image, (0, 0))
-        result.paste(text_area, (0, self.qr_image.height))
-        draw = ImageDraw.Draw(result)
+        self._draw_caption(result, (0, 0), rows)
+        return result
 
-        # Track space used by each row so next doesn't overlap
-        used_height = 0
+    def _draw_caption(self, image, origin, rows):
+        '''Takes image (any mode), position of QR code top left corner on the
+        image, and caption rows from _layout_caption. Draws each row in black.
+        '''
+        draw = ImageDraw.Draw(image)
+
+        # Add each line of each row to image at position from cached layout
+        # (same positions as multiline draw.text, without measuring each line).
+        # Glyph atlas (if enabled) pastes cached glyphs instead of rasterizing
+        for row, x, y, _ in rows:
+            font = row['font']
+            x, y = x + origin[0], y + origin[1]
+            atlas = None
+            if glyph_atlas.ENABLED and glyph_atlas.supported(font):
+                atlas = glyph_atlas.get_atlas(font)
+            for line_x, line_y, line in self._text_layout(row['text'], font).lines:
+                if atlas:
+                    atlas.draw(image, (x + line_x, y + line_y), line)
+                else:
+                    draw.text((x + line_x, y + line_y), line, font=font, fill='black')
+
+    def get_size(self):
+        '''Returns (width, height) tuple of qr_complete without generating it.'''
+        width = self._get_width()
+        return width, width + self._layout_caption()[0]
+
+    def paste_into(self, image, xy):
+        '''Pastes QR code and caption onto image (any mode, must be white
+        under the caption) with top left corner at xy. Used to compose many QR
+        codes on 1 image without allocating qr_complete for each code.
+        '''
+        for stage in self._STAGES[:-1]:
+            getattr(self, stage)
+        with self.time_stage('compose'):
+            image.paste(self.qr_image, xy)
+            self._draw_caption(image, xy, self._layout_caption()[1])
+
+    def to_svg(self, caption=True):
+        '''Returns SVG bytes of QR code with caption (or without if caption arg
+        is False). Modules are written by segno and caption rows are <text>
+        elements with the same layout as qr_complete, nothing is rasterized.
+        '''
 
-        # Iterate rows again, calculate position, add text
-        for row in self._caption:
-            _, _, row_width, row_height = draw.textbbox(
-                xy=(0, 0),
-                text=row['text'],
-                font=row['font']
-            )
+        # Generate earlier stages in order so each is timed separately
+        for stage in ('qr_raw', '_caption') if caption else ('qr_raw',):
+            getattr(self, stage)
 
-            # Calc info position, add text
-            x = (self.qr_image.width - row_width) // 2
-            y = self.qr_image.height + used_height - 24
+        with self.time_stage('svg'):
+            return self._generate_svg(caption)
 
-            # Prevent next line overlapping
-            used_height += row_height
+    def _generate_svg(self, caption):
+        '''Returns SVG bytes for to_svg (caption must already be generated).'''
 
-            # Add row to image
-            draw.text(
-                (x, y),
-                row['text'],
-                font=row['font'],
-                align='center',
-                fill=(0, 0, 0)
-            )
+        width = self._get_width()
+        add_height, rows = self._layout_caption() if caption else (0, [])
+        height = width + add_height
 
-        return result
+        # Print size in inches if dpi set (otherwise 1 user unit = 1 pixel)
+        if self.dpi:
+            size = f'width="{width / self.dpi:g}in" height="{height / self.dpi:g}in"'
+        else:
+            size = f'width="{width}" height="{height}"'
 
-    def save(self, filename=None):
-        '''Save PNG to disk, uses self.filename unless arg passed'''
+        elements = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" {size} '
+            f'viewBox="0 0 {width} {height}">',
+            '<rect width="100%" height="100%" fill="#fff"/>',
+            self.qr_raw.svg_inline(scale=self._get_scale(), border=self._BORDER)
+        ]
 
-        if filename is None:
-            # Write to disk with default filename format
-            self.qr_complete.save(f"{self.filename}.png")
+        for row, x, y, row_width in rows:
+            elements.extend(self._svg_text(row, x, y, row_width))
 
-        else:
-            # Remove extension if present
-            if filename.endswith(".png"):
-                filename = filename[0:-4]
+        elements.append('</svg>')
+        return '\n'.join(elements).encode('utf-8')
+
+    def _svg_text(self, row, x, y, row_width):
+        '''Takes caption row dict, position, and width from _layout_caption,
+        returns list of SVG <text> elements (1 per line).
+        '''
+
+        font = row['font']
+        family, style = font.getname()
+        weight = 'bold' if 'Bold' in style else 'normal'
+
+        # PIL positions text by top of ascender, SVG uses baseline. Each line
+        # of multiline rows is centered within the row (same as align=center)
+        ascender = font.getmetrics()[0]
+
+        elements = []
+        for _, line_y, line in self._text_layout(row['text'], font).lines:
+            elements.append(
+                f'<text x="{x + row_width / 2:g}" y="{y + ascender + line_y:g}" '
+                f'font-family={quoteattr(family)} font-weight="{weight}" '
+                f'font-size="{font.size}" text-anchor="middle" '
+                f'xml:space="preserve">{escape(line)}</text>'
+            )
+        return elements
+
+    def save(self, filename=None, kind='png'):
+        '''Save PNG (or SVG if kind is svg) to disk, uses self.filename unless
+        arg passed
+        '''
 
-            # Write to disk with chosen name
+        if filename is None:
+            # Use default filename format
+            filename = self.filename
+
+        # Remove extension if present
+        elif filename.endswith(f".{kind}"):
+            filename = filename[0:-len(kind) - 1]
+
+        # Write to disk with chosen name
+        if kind == 'svg':
+            with open(f"{filename}.svg", 'wb') as file:
+                file.write(self.to_svg())
+        elif self.dpi:
+            self.qr_complete.save(f"{filename}.png", dpi=(self.dpi, self.dpi))
+        else:
             self.qr_complete.save(f"{filename}.png")
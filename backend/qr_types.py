@@ -0,0 +1,171 @@
+'''Maps /generate payloads to the Qr subclass registered for each QR code type.'''
+
+import os
+import hmac
+import json
+import hashlib
+import secrets
+
+# Importing each subclass registers it in QR_TYPES
+# pylint: disable=unused-import
+import contact_qr
+import wifi_qr
+import link_qr
+import vcard_qr
+import geo_qr
+# pylint: enable=unused-import
+from qr import QR_TYPES, Encoding
+from capacity import min_version, max_capacity
+
+
+# QR code types containing secrets (excluded from on-disk caches by default)
+SECRET_TYPES = frozenset(key for key, qr_class in QR_TYPES.items() if qr_class.secret)
+
+# Key for hashes of secret types, a plain hash of a wifi payload could be
+# reversed offline by hashing guessed passwords. Random per process if
+# QR_HASH_KEY is not set (workers forked from the preloaded app share it)
+HASH_KEY = os.environ.get('QR_HASH_KEY', '').encode('utf-8') or secrets.token_bytes(32)
+
+
+class PayloadError(ValueError):
+    '''Raised when a payload is invalid, field is the payload key that caused
+    it (None if the payload itself is invalid, eg not a JSON object).
+    '''
+
+    def __init__(self, message, field=None):
+        super().__init__(message)
+        self.field = field
+
+    def to_dict(self):
+        '''Returns dict with error message and field (JSON error response).'''
+        return {'error': str(self), 'field': self.field}
+
+
+def validate_payload(data):
+    '''Takes payload from frontend, checks it against the fields of the Qr
+    subclass registered for its type (cheap, nothing is encoded). Raises
+    PayloadError naming the first invalid field if the type is not supported
+    or any field is missing, not a string, blank, too long, does not match
+    its pattern, or is not valid unicode.
+    '''
+
+    if not isinstance(data, dict):
+        raise PayloadError('Payload must be a JSON object')
+    qr_type = data.get('type')
+    if not isinstance(qr_type, str) or qr_type not in QR_TYPES:
+        raise PayloadError('Unsupported QR code type', 'type')
+
+    for field in QR_TYPES[qr_type].fields:
+        value = data.get(field.name)
+        if value is None and field.optional:
+            continue
+        if value is None:
+            raise PayloadError(f'{field.name} is required', field.name)
+        if not isinstance(value, str):
+            raise PayloadError(f'{field.name} must be a string', field.name)
+        if not value.strip() and not field.optional:
+            raise PayloadError(f'{field.name} is required', field.name)
+        if len(value) > field.max_length:
+            raise PayloadError(
+                f'{field.name} must be at most {field.max_length} characters', field.name
+            )
+        if field.pattern and value.strip() and not field.pattern.fullmatch(value.strip()):
+            raise PayloadError(f'{field.name} must be {field.description}', field.name)
+        try:
+            value.encode('utf-8')
+        except UnicodeError as error:
+            raise PayloadError(f'{field.name} contains invalid characters', field.name) from error
+
+
+def check_capacity(data, payload, encoding=None):
+    '''Takes payload from frontend, dict returned by normalize_payload, and
+    optional Encoding. Finds the QR code version the encoded content needs
+    from the precomputed capacity table (before any encoding or rendering).
+
+    Raises PayloadError naming the longest field if it does not fit in any
+    version, the error field if it only fits at a lower error level, or the
+    version field if it does not fit in the fixed version.
+    '''
+    encoding = encoding or Encoding()
+    error = encoding.error or 'L'
+    content = build_qr(payload).content
+    needed = min_version(content, error)
+
+    if needed is None:
+        mode, length, capacity = max_capacity(content, error)
+        unit = 'bytes' if mode == 'byte' else f'{mode} characters'
+        if min_version(content) is not None:
+            raise PayloadError(
+                f'Payload is too long to fit in a QR code at error level {error} '
+                f'({length} {unit}, max {capacity})',
+                'error'
+            )
+        field = max(
+            (field.name for field in QR_TYPES[data['type']].fields if data.get(field.name)),
+            key=lambda name: len(data[name])
+        )
+        raise PayloadError(
+            f'{field} is too long to fit in a QR code ({length} {unit}, max {capacity})',
+            field
+        )
+
+    if encoding.version is not None and needed > encoding.version:
+        raise PayloadError(
+            f'Payload does not fit in version {encoding.version} at error level '
+            f'{error} (needs version {needed})',
+            'version'
+        )
+
+
+def normalize_payload(data, encoding=None):
+    '''Takes payload from frontend and optional Encoding it will be rendered
+    with, returns dict with type key and constructor args for the Qr subclass,
+    formatted the same way the subclass formats them. Two payloads that
+    produce the same QR code return the same dict.
+
+    Raises PayloadError (ValueError) naming the invalid field if the payload
+    does not match its schema or does not fit in a QR code with encoding.
+    '''
+    validate_payload(data)
+    payload = _normalize_fields(data)
+    check_capacity(data, payload, encoding)
+    return payload
+
+
+def _normalize_fields(data):
+    '''Takes validated payload from frontend, returns normalized dict (type
+    key plus constructor args from the normalize classmethod of its type).
+    '''
+    return {'type': data['type'], **QR_TYPES[data['type']].normalize(data)}
+
+
+def build_qr(payload, size=500, dpi=None, encoding=None):
+    '''Takes dict returned by normalize_payload, optional image width (pixels),
+    dpi, and Encoding, returns instance of the Qr subclass for its type.
+    '''
+    args = dict(payload)
+    qr_class = QR_TYPES.get(args.pop('type'))
+    if qr_class is None:
+        raise ValueError('Unsupported QR code type')
+    return qr_class(**args, size=size, dpi=dpi, encoding=encoding)
+
+
+def render_cost(payload):
+    '''Returns cost hint (relative render time) of normalized payload's type.'''
+    return QR_TYPES[payload['type']].cost
+
+
+def payload_hash(payload, options=None):
+    '''Takes dict returned by normalize_payload and optional dict of render
+    options, returns canonical sha256 hex digest identifying the output.
+    Secret types are keyed with HASH_KEY (HMAC), others are a plain sha256 so
+    their hashes are the same in every process and after restarts.
+    '''
+    canonical = json.dumps(
+        {'payload': payload, 'options': options or {}},
+        sort_keys=True,
+        separators=(',', ':')
+    ).encode('utf-8')
+    if payload.get('type') in SECRET_TYPES:
+        return hmac.new(HASH_KEY, canonical, hashlib.sha256).hexdigest()
+    return hashlib.sha256(canonical).hexdigest()
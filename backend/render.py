@@ -0,0 +1,165 @@
+'''Renders normalized payloads to PNG images.'''
+
+import time
+from contextlib import contextmanager
+
+from qr import Qr, Encoding, QR_TYPES
+from qr_types import build_qr, normalize_payload
+from metrics import metrics
+from memory import buffer_pool, pooled_value
+
+
+# Image variants returned by render_images, values are Qr attribute names
+VARIANTS = {
+    'caption': 'qr_complete',
+    'no_caption': 'qr_image'
+}
+
+# Render options: PNG encoder settings (Pillow defaults, compress_level 0-9
+# trades size for speed), approximate width in pixels, and optional print dpi
+DEFAULT_OPTIONS = {'compress_level': 6, 'optimize': False, 'size': 500, 'dpi': None}
+
+# Encoding options (see qr.Encoding) may also be set: error, mask, version and
+# min_version. They are only added to options when set, so renders with segno
+# defaults keep the same payload hash
+
+# Smallest and largest allowed size option (pixels)
+SIZE_RANGE = (100, 4000)
+
+
+def img_to_png_bytes(img, compress_level=6, optimize=False, dpi=None):
+    '''Takes PIL.Image, saves to pooled memory buffer, returns PNG bytes.
+    Writes dpi to PNG metadata if set.
+    '''
+    with buffer_pool.buffer() as img_buffer:
+        img.save(
+            img_buffer,
+            format="PNG",
+            compress_level=compress_level,
+            optimize=optimize,
+            **({'dpi': (dpi, dpi)} if dpi else {})
+        )
+        return pooled_value(img_buffer)
+
+
+# Output formats, PNG is rasterized and SVG is vector (no raster stages run)
+FORMATS = ('png', 'svg')
+
+
+def image_name(variant, image_format='png'):
+    '''Returns key used for variant + format in render_images output and
+    render cache entries (eg caption for PNG, caption.svg for SVG).
+    '''
+    return variant if image_format == 'png' else f'{variant}.{image_format}'
+
+
+def render_images(payload, variants=tuple(VARIANTS), options=None, image_format='png'):
+    '''Takes dict returned by normalize_payload, optional list of variants,
+    optional dict of render options (keys from DEFAULT_OPTIONS and Encoding),
+    and optional format (png or svg). Returns dict with bytes of QR code with caption
+    (caption key) and/or without caption (no_caption key), keys are returned by
+    image_name. Only the pipeline stages needed for the requested variants are
+    generated, at the requested size (no downscaling).
+    '''
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    qr = build_qr(payload, options['size'], options['dpi'], options_encoding(options))
+    with record_render(qr, payload['type'], image_format):
+        if image_format == 'svg':
+            return {
+                image_name(variant, 'svg'): qr.to_svg(caption=variant == 'caption')
+                for variant in variants
+            }
+
+        images = {}
+        for index, variant in enumerate(variants):
+            image = getattr(qr, VARIANTS[variant])
+
+            # Release images no later variant needs before encoding, so at
+            # most 1 full size canvas is alive while the PNG is written
+            qr.release(*unneeded_stages(qr, variants[index + 1:]))
+            with qr.time_stage('png'):
+                images[variant] = img_to_png_bytes(
+                    image, options['compress_level'], options['optimize'], options['dpi']
+                )
+            del image
+        return images
+
+
+def options_encoding(options):
+    '''Takes dict of render options, returns Encoding with its error, mask,
+    version and min_version keys (None if missing).
+    '''
+    return Encoding(*(options.get(name) for name in Encoding._fields))
+
+
+def unneeded_stages(qr, variants):
+    '''Takes Qr instance and list of variants still to be encoded, returns
+    list of generated image stages that none of them need.
+    '''
+    needed = {VARIANTS[variant] for variant in variants}
+    if 'qr_complete' in needed and 'qr_complete' not in qr.__dict__:
+        needed.add('qr_image')
+    return [stage for stage in VARIANTS.values() if stage not in needed]
+
+
+@contextmanager
+def record_render(qr, qr_type, image_format):
+    '''Context manager wrapping a render of qr (Qr instance). Adds duration,
+    seconds spent in each stage (Qr.stage_timings), and errors to metrics.
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.inc('qr_render_errors_total', {'type': qr_type})
+        raise
+
+    labels = {'type': qr_type, 'format': image_format}
+    metrics.inc('qr_renders_total', labels)
+    metrics.observe('qr_render_seconds', time.perf_counter() - start, labels)
+    for stage, seconds in qr.stage_timings.items():
+        metrics.observe(
+            'qr_render_stage_seconds',
+            seconds,
+            {'type': qr_type, 'version': qr.qr_raw.version, 'stage': stage}
+        )
+
+
+def crop_box(payload, options=None):
+    '''Takes dict returned by normalize_payload and dict of render options,
+    returns [left, top, right, bottom] box of the QR code in the caption image
+    that the caption does not overlap (see Qr.crop_box). Only the encoded
+    symbol is needed (encode cache), no images are generated.
+    '''
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    qr = build_qr(payload, options['size'], options['dpi'], options_encoding(options))
+    return qr.crop_box()
+
+
+def render_file(payload):
+    '''Takes dict returned by normalize_payload, returns tuple with filename
+    (same format as Qr.save) and PNG bytes of QR code with caption.
+    '''
+    qr = build_qr(payload)
+    with record_render(qr, payload['type'], 'png'):
+        image = qr.qr_complete
+        qr.release('qr_image')
+        with qr.time_stage('png'):
+            return f'{qr.filename}.png', img_to_png_bytes(image)
+
+
+def warm_up():
+    '''Loads all caption fonts and renders the template QR code of each type in
+    every format, so lazy imports (PIL plugins, segno writers) and font files
+    are loaded before the first request.
+
+    Safe to call before forking (gunicorn preload_app), everything it loads is
+    read-only and shared with workers as copy-on-write memory. Metrics recorded
+    by the template renders are cleared.
+    '''
+    Qr.preload_fonts()
+    for qr_class in QR_TYPES.values():
+        payload = normalize_payload(qr_class.template)
+        render_images(payload)
+        render_images(payload, image_format='svg')
+    metrics.clear()
@@ -0,0 +1,260 @@
+'''Content-addressed cache for rendered QR code images.'''
+
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+
+from logger import logger
+
+
+# Max number of entries and total bytes (image data) kept in each tier, an
+# entry larger than the byte limit is not cached in that tier (eg size 4000
+# with compress_level 0 is about 47MB)
+CacheLimits = namedtuple(
+    'CacheLimits',
+    ('entries', 'bytes', 'disk_entries', 'disk_bytes'),
+    defaults=(256, 64 * 2**20, 10000, 1024 * 2**20)
+)
+
+
+def entry_size(entry):
+    '''Returns number of bytes of image data in entry.'''
+    return sum(len(data) for data in entry.values())
+
+
+class RenderCache():
+    '''Two tier cache mapping payload hashes to rendered images.
+
+    Each entry is a dict mapping image names (eg "caption", "no_caption") to
+    PNG bytes. Entries are kept in a bounded in-memory LRU (per worker process)
+    and optionally in a sqlite database shared by all workers on the same host.
+    Both tiers are bounded by number of entries and total bytes (CacheLimits).
+
+    Entries marked as secret (eg wifi passwords) are only kept in memory unless
+    persist_secrets is True.
+
+    Hit, miss, and eviction counters are returned by the stats method.
+    '''
+
+    def __init__(self, limits=CacheLimits(), path=None, persist_secrets=False):
+        self.limits = limits
+        self.persist_secrets = persist_secrets
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        # Optional tier shared by all workers
+        self._disk = DiskTier(path, limits.disk_entries, limits.disk_bytes) if path else None
+
+        self._counters = {}
+        self.clear_stats()
+
+    def get(self, key):
+        '''Returns cached entry for key, or None if not cached.'''
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return self._memory[key]
+
+            entry = self._disk_call('get', key) if self._disk else None
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+
+            # Promote to memory tier
+            self._counters['disk_hits'] += 1
+            self._memory_set(key, entry)
+            return entry
+
+    def set(self, key, entry, secret=False):
+        '''Adds entry to memory tier and (unless secret) disk tier.'''
+
+        with self._lock:
+            size = entry_size(entry)
+            if not self._memory_set(key, entry):
+                self._counters['oversized'] += 1
+
+            if self._disk and (not secret or self.persist_secrets):
+                if size > self.limits.disk_bytes:
+                    self._counters['oversized'] += 1
+                else:
+                    self._counters['disk_evictions'] += self._disk_call('set', key, entry) or 0
+
+    def _disk_call(self, method, *args):
+        '''Calls DiskTier method (caller locks), returns None if sqlite raises
+        (eg database full). Disk tier errors are logged and counted but never
+        fail the request, the memory tier still has the images.
+        '''
+        try:
+            return getattr(self._disk, method)(*args)
+        except sqlite3.Error as error:
+            self._counters['disk_errors'] += 1
+            logger.warning('Render cache disk tier %s failed', method, extra={'fields': {
+                'path': self._disk.path, 'error': str(error)
+            }})
+            return None
+
+    def clear(self):
+        '''Removes all entries from both tiers, resets counters.'''
+
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self.clear_stats()
+            if self._disk:
+                self._disk.clear()
+
+    def clear_memory(self):
+        '''Removes all entries from memory tier (disk tier and counters are
+        kept), used to free memory when a worker is over its memory budget.
+        '''
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def clear_stats(self):
+        '''Resets all counters to 0.'''
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'disk_evictions': 0,
+            'disk_errors': 0,
+            'oversized': 0
+        }
+
+    def stats(self):
+        '''Returns dict with hit/miss/eviction counters and current size.'''
+        with self._lock:
+            stats = dict(self._counters)
+            stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+            stats['entries'] = len(self._memory)
+            stats['bytes'] = self._memory_bytes
+            return stats
+
+    def _memory_set(self, key, entry):
+        '''Adds entry to in-memory LRU, evicts least recently used until under
+        both limits (caller locks). Returns False if entry is larger than the
+        byte limit (not added, previous entry for key removed).
+        '''
+        self._memory_pop(key)
+        size = entry_size(entry)
+        if size > self.limits.bytes:
+            return False
+        self._memory[key] = entry
+        self._memory_bytes += size
+        while len(self._memory) > self.limits.entries or self._memory_bytes > self.limits.bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= entry_size(evicted)
+            self._counters['evictions'] += 1
+        return True
+
+    def _memory_pop(self, key):
+        '''Removes entry from in-memory LRU if present (caller locks).'''
+        if key in self._memory:
+            self._memory_bytes -= entry_size(self._memory.pop(key))
+
+
+class DiskTier():
+    '''sqlite database storing render cache entries, safe to share between
+    processes. Evicts least recently accessed entries when max_entries or
+    max_bytes (total image data) is exceeded. Not thread safe, RenderCache
+    locks before calling methods.
+    '''
+
+    def __init__(self, path, max_entries, max_bytes):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # Connection opened lazily (cannot be shared with forked process)
+        self._db = None
+        self._db_pid = None
+
+    def _connection(self):
+        '''Returns sqlite connection for current process, creates if needed.'''
+
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(
+                self.path,
+                timeout=5,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS renders ('
+                'key TEXT NOT NULL, name TEXT NOT NULL, data BLOB NOT NULL, '
+                'accessed REAL NOT NULL, PRIMARY KEY (key, name))'
+            )
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS renders_accessed ON renders (accessed)'
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get(self, key):
+        '''Returns entry from database, or None if not found.'''
+
+        db = self._connection()
+        rows = db.execute(
+            'SELECT name, data FROM renders WHERE key = ?', (key,)
+        ).fetchall()
+        if not rows:
+            return None
+        db.execute(
+            'UPDATE renders SET accessed = ? WHERE key = ?', (time.time(), key)
+        )
+        return {name: bytes(data) for name, data in rows}
+
+    def set(self, key, entry):
+        '''Writes entry to database, evicts least recently used if full.
+        Returns number of evicted entries.
+        '''
+
+        now = time.time()
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(
+                'INSERT OR REPLACE INTO renders VALUES (?, ?, ?, ?)',
+                [(key, name, data, now) for name, data in entry.items()]
+            )
+            evicted = self._evict(db)
+            db.execute('COMMIT')
+        except sqlite3.Error:
+            db.execute('ROLLBACK')
+            raise
+        return evicted
+
+    def _evict(self, db):
+        '''Deletes least recently accessed entries until under both limits
+        (caller is in a transaction). Returns number of evicted entries.
+        '''
+        count, size = db.execute(
+            'SELECT COUNT(DISTINCT key), TOTAL(LENGTH(data)) FROM renders'
+        ).fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return 0
+
+        evicted = []
+        for key, key_size in db.execute(
+            'SELECT key, TOTAL(LENGTH(data)) FROM renders GROUP BY key ORDER BY MAX(accessed)'
+        ).fetchall():
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            size -= key_size
+        db.executemany('DELETE FROM renders WHERE key = ?', evicted)
+        return len(evicted)
+
+    def clear(self):
+        '''Deletes all entries from database.'''
+        self._connection().execute('DELETE FROM renders')
@@ -0,0 +1,73 @@
+'''Runs single renders on a bounded executor with backpressure and timeouts.'''
+
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class RenderQueueFull(Exception):
+    '''Raised when the maximum number of renders are already pending.'''
+
+
+class RenderTimeout(Exception):
+    '''Raised when a render does not finish before the timeout.'''
+
+
+class RenderExecutor():
+    '''Submits CPU-bound render calls to an executor (usually the render process
+    pool) so request threads only wait on the result.
+
+    At most max_pending renders can be queued or running at once, run raises
+    RenderQueueFull instead of queueing more. Waiting for a result raises
+    RenderTimeout after timeout seconds.
+
+    If get_executor is None renders run in the calling thread (no limits, but
+    still included in pending count).
+    '''
+
+    def __init__(self, get_executor=None, max_pending=8, timeout=10):
+        self.get_executor = get_executor
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        # Number of renders queued or running
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def pending(self):
+        '''Returns number of renders queued or running.'''
+        return self._pending
+
+    def _release(self, _=None):
+        '''Decrements pending count (called when render finishes).'''
+        with self._lock:
+            self._pending -= 1
+
+    def run(self, func, *args):
+        '''Calls func with args on executor, returns result.'''
+
+        if self.get_executor is None:
+            with self._lock:
+                self._pending += 1
+            try:
+                return func(*args)
+            finally:
+                self._release()
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise RenderQueueFull()
+            self._pending += 1
+
+        # Released when render finishes (not when caller stops waiting)
+        try:
+            future = self.get_executor().submit(func, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError as exception:
+            future.cancel()
+            raise RenderTimeout() from exception
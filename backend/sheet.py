@@ -0,0 +1,211 @@
+'''Composes many QR codes onto printable pages, output as PDF or PNG pages.'''
+
+import zlib
+from functools import lru_cache
+from collections import namedtuple
+
+from PIL import Image
+
+from qr import QR_TYPES
+from qr_types import build_qr, normalize_payload, PayloadError
+from render import img_to_png_bytes, SIZE_RANGE
+
+
+# Page sizes in millimeters (portrait)
+PAGE_SIZES = {
+    'a4': (210, 297),
+    'letter': (215.9, 279.4)
+}
+
+# Grid of rows x columns cells on each page, margin (millimeters) is blank
+# space around the grid, each QR code is centered in its cell. Encoding
+# (optional qr.Encoding) applies to every code, a fixed version gives every
+# code on the sheet the same number of modules (same symbol size)
+SheetLayout = namedtuple(
+    'SheetLayout', ('page', 'rows', 'columns', 'margin', 'dpi', 'encoding'), defaults=(None,)
+)
+DEFAULT_LAYOUT = SheetLayout(page='a4', rows=4, columns=3, margin=10, dpi=300)
+
+MM_PER_INCH = 25.4
+
+
+def mm_to_pixels(mm, dpi):
+    '''Returns number of whole pixels in mm millimeters at dpi.'''
+    return int(mm / MM_PER_INCH * dpi)
+
+
+def page_size(layout):
+    '''Returns (width, height) of page in pixels.'''
+    width, height = PAGE_SIZES[layout.page]
+    return mm_to_pixels(width, layout.dpi), mm_to_pixels(height, layout.dpi)
+
+
+def cell_size(layout):
+    '''Returns (width, height) of each grid cell in pixels (0 if margins are
+    wider than the page).
+    '''
+    width, height = page_size(layout)
+    margin = mm_to_pixels(layout.margin, layout.dpi)
+    return (
+        max(0, (width - margin * 2) // layout.columns),
+        max(0, (height - margin * 2) // layout.rows)
+    )
+
+
+def paginate(payloads, layout):
+    '''Takes list of payloads, returns list with 1 list of payloads per page.'''
+    per_page = layout.rows * layout.columns
+    return [payloads[index:index + per_page] for index in range(0, len(payloads), per_page)]
+
+
+def fit_qr(payload, width, height, encoding=None):
+    '''Returns Qr instance for normalized payload (optional Encoding) with the
+    largest size where QR code and caption fit in width x height pixels.
+    Raises ValueError if it does not fit even at the smallest size.
+    '''
+
+    # Caption height is proportional to size, scale down by the overflow until
+    # it fits (sizes are rounded to whole pixels per module and fonts to whole
+    # points, so 1 step is often not enough)
+    size = max(SIZE_RANGE[0], min(width, height))
+    qr = build_qr(payload, size, encoding=encoding)
+    qr_width, qr_height = qr.get_size()
+    while qr_width > width or qr_height > height:
+        if size == SIZE_RANGE[0]:
+            raise ValueError(f'QR code does not fit in {width}x{height} pixel cell')
+        size = max(SIZE_RANGE[0], min(size - 1, int(size * min(width / qr_width,
+                                                               height / qr_height))))
+        qr = build_qr(payload, size, encoding=encoding)
+        qr_width, qr_height = qr.get_size()
+    return qr
+
+
+@lru_cache
+def min_cell_size(encoding=None):
+    '''Returns (width, height) of the smallest cell that fits the template of
+    every QR code type at the smallest size (templates that do not fit
+    encoding are skipped).
+    '''
+    sizes = []
+    for qr_class in QR_TYPES.values():
+        try:
+            payload = normalize_payload(qr_class.template, encoding)
+        except PayloadError:
+            continue
+        sizes.append(build_qr(payload, SIZE_RANGE[0], encoding=encoding).get_size())
+    sizes = sizes or [(SIZE_RANGE[0], SIZE_RANGE[0])]
+    return max(width for width, _ in sizes), max(height for _, height in sizes)
+
+
+def compose_page(payloads, layout):
+    '''Takes list of normalized payloads (at most rows x columns) and layout.
+    Returns tuple with greyscale PIL.Image of the page and list of indices (in
+    payloads) that could not be rendered (cells left blank).
+
+    Each QR code is pasted straight onto 1 preallocated page image, captions
+    are drawn from cached layouts (no per-code caption image or measuring).
+    '''
+
+    page = Image.new('L', page_size(layout), color=255)
+    width, height = cell_size(layout)
+    margin = mm_to_pixels(layout.margin, layout.dpi)
+
+    failed = []
+    for index, payload in enumerate(payloads):
+        row, column = divmod(index, layout.columns)
+        try:
+            qr = fit_qr(payload, width, height, layout.encoding)
+            qr_width, qr_height = qr.get_size()
+        except Exception:  # pylint: disable=broad-exception-caught
+            failed.append(index)
+            continue
+
+        # Center QR code in its cell
+        qr.paste_into(page, (
+            margin + column * width + (width - qr_width) // 2,
+            margin + row * height + (height - qr_height) // 2
+        ))
+
+    return page, failed
+
+
+def render_page(args):
+    '''Takes tuple with list of normalized payloads, SheetLayout, and format
+    (png or pdf). Returns tuple with page data and list of failed indices.
+
+    Page data is PNG bytes, or (width, height, zlib compressed greyscale
+    pixels) for stream_pdf. Runs in batch render processes (must be picklable).
+    '''
+    payloads, layout, image_format = args
+    page, failed = compose_page(payloads, layout)
+    if image_format == 'png':
+        return img_to_png_bytes(page, dpi=layout.dpi), failed
+    return (page.width, page.height, zlib.compress(page.tobytes(), 6)), failed
+
+
+def _page_objects(number, page, dpi):
+    '''Takes number of first object, (width, height, zlib compressed greyscale
+    pixels) tuple, and dpi. Returns list of (object number, dictionary, stream)
+    tuples for the page image, page contents (draws image over whole page),
+    and the page (last object, parent is object 2).
+    '''
+    width, height, pixels = page
+
+    # PDF units are points (1/72 inch), image is scaled to fill the page
+    page_width, page_height = f'{width * 72 / dpi:.2f}', f'{height * 72 / dpi:.2f}'
+    content = f'q {page_width} 0 0 {page_height} 0 0 cm /Im1 Do Q'.encode()
+    return [
+        (number, (
+            f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+            '/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode '
+            f'/Length {len(pixels)} >>'
+        ), pixels),
+        (number + 1, f'<< /Length {len(content)} >>', content),
+        (number + 2, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] '
+            f'/Resources << /XObject << /Im1 {number} 0 R >> >> /Contents {number + 1} 0 R >>'
+        ), None)
+    ]
+
+
+def stream_pdf(pages, dpi):
+    '''Takes iterable of (width, height, zlib compressed greyscale pixels)
+    tuples from render_page and dpi, yields PDF file chunks as soon as each
+    page is received, then the page tree and cross reference table. Each page
+    is 1 full page image.
+    '''
+
+    # Byte offset of each object (written in cross reference table)
+    offsets = {}
+    chunk = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    position = 0
+
+    def write(number, dictionary, stream=None):
+        nonlocal position
+        offsets[number] = position + len(chunk)
+        data = f'{number} 0 obj\n{dictionary}'.encode()
+        if stream is not None:
+            data += b'\nstream\n' + stream + b'\nendstream'
+        return data + b'\nendobj\n'
+
+    # Object 1 is the catalog and 2 the page tree (written last, their
+    # numbers are reserved so each page can reference its parent)
+    kids = []
+    for page in pages:
+        for number, dictionary, stream in _page_objects(len(offsets) + 3, page, dpi):
+            chunk += write(number, dictionary, stream)
+        kids.append(f'{number} 0 R')
+        position += len(chunk)
+        yield chunk
+        chunk = b''
+
+    chunk += write(2, f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>')
+    chunk += write(1, '<< /Type /Catalog /Pages 2 0 R >>')
+
+    # Cross reference table has fixed width offset of every object
+    xref = position + len(chunk)
+    chunk += f'xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n'.encode()
+    chunk += b''.join(f'{offsets[number]:010d} 00000 n \n'.encode() for number in sorted(offsets))
+    chunk += f'trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\n'.encode()
+    chunk += f'startxref\n{xref}\n%%EOF\n'.encode()
+    yield chunk
@@ -0,0 +1,120 @@
+'''Coalesces identical concurrent renders so only 1 runs and the rest share it.'''
+
+import os
+import zlib
+import fcntl
+import threading
+from contextlib import contextmanager
+
+
+# Number of lock files used for cross-worker coalescing. Keys are hashed onto
+# a fixed set of files (instead of 1 file per key) so the directory does not
+# grow, unrelated renders only wait on each other if their keys collide.
+LOCK_STRIPES = 256
+
+
+class _Call():  # pylint: disable=too-few-public-methods
+    '''In-progress call, followers wait on done and then read result or error.'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight():
+    '''Runs at most 1 call per key at a time. Threads calling do with a key
+    that is already running wait for it to finish and get the same result (or
+    exception) instead of running func again.
+
+    If lock_dir is set the call also holds a file lock for its key, so workers
+    in other processes wait for each other too. A worker that had to wait for
+    the lock calls check first (eg looks in a render cache shared by all
+    workers), func only runs if check returns None.
+    '''
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counters = {}
+        self.clear_stats()
+
+    def clear_stats(self):
+        '''Resets all counters to 0.'''
+        self._counters = {'calls': 0, 'coalesced_worker': 0, 'coalesced_cross_worker': 0}
+
+    def stats(self):
+        '''Returns dict with number of calls that ran func and number of calls
+        that shared a result from this worker or another worker.
+        '''
+        return {**self._counters, 'in_flight': len(self._calls)}
+
+    def do(self, key, func, check=None):
+        '''Returns tuple with result of func (or of the call already running
+        for key) and how it was shared: None if this call ran func, worker if
+        it waited on another thread, cross_worker if check returned a result
+        after waiting on another process.
+        '''
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self._counters['coalesced_worker'] += 1
+
+        # Follower: wait for first call with same key, share its outcome
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, 'worker'
+
+        try:
+            with self._file_lock(key) as waited:
+                result = check() if waited and check is not None else None
+                shared = 'cross_worker' if result is not None else None
+                self._count('coalesced_cross_worker' if shared else 'calls')
+                if shared is None:
+                    result = func()
+            call.result = result
+            return result, shared
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _count(self, name):
+        '''Increments counter (lock held so concurrent calls are not lost).'''
+        with self._lock:
+            self._counters[name] += 1
+
+    @contextmanager
+    def _file_lock(self, key):
+        '''Holds exclusive lock on the lock file for key (no-op if lock_dir is
+        not set), yields True if another process held it first.
+        '''
+        if not self.lock_dir:
+            yield False
+            return
+
+        stripe = zlib.crc32(str(key).encode()) % LOCK_STRIPES
+        path = os.path.join(self.lock_dir, f'{stripe}.lock')
+        with open(path, 'a', encoding='utf-8') as file:
+            waited = False
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                waited = True
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield waited
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
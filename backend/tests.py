@@ -1,26 +1,61 @@
-# pylint: disable=missing-docstring, protected-access
+# pylint: disable=missing-docstring, protected-access, too-many-lines, too-many-public-methods
 
 import io
 import os
 import json
+import zlib
 import base64
+import hashlib
+import logging
+import fcntl
+import shutil
+import sqlite3
+import zipfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
 from unittest.mock import patch
 
 import PIL
 import segno
+from PIL import ImageChops
 
-from qr import Qr
+from qr import Qr, Encoding, encode, clear_encode_cache, encode_cache_stats, load_font, QR_TYPES
+from layout_cache import LayoutCache, layout_cache
+import glyph_atlas
 from contact_qr import ContactQr
 from wifi_qr import WifiQr
 from link_qr import LinkQr
-from app import app
+from vcard_qr import VCardQr
+from geo_qr import GeoQr
+from render_cache import RenderCache, CacheLimits
+from render_executor import RenderExecutor, RenderQueueFull, RenderTimeout
+from single_flight import SingleFlight, LOCK_STRIPES
+from sheet import SheetLayout, DEFAULT_LAYOUT, PAGE_SIZES, page_size, cell_size, paginate, \
+    compose_page, stream_pdf, render_page, fit_qr, min_cell_size
+from qr_types import normalize_payload, validate_payload, payload_hash, build_qr, PayloadError
+from capacity import CAPACITY, min_version
+import batch
+from batch import render_batch
+from render import warm_up, render_images, unneeded_stages, img_to_png_bytes, DEFAULT_OPTIONS, \
+    SIZE_RANGE
+from memory import BufferPool, MemoryBudget, pooled_value
+from metrics import Metrics, metrics
+from logger import setup_logging, redact, SamplingFilter
+from app import app, render_cache, single_flight
+from cli import main as cli_main
+
+
+# Request logs written by the app would be mixed into test output
+setup_logging(stream=io.StringIO())
 
 
 class EndpointTests(TestCase):
 
     def setUp(self):
         self.app = app.test_client()
+        render_cache.clear()
 
         # Dummy responses for mock methods
         self.dummy_font = PIL.ImageFont.truetype(
@@ -151,9 +186,9 @@ class EndpointTests(TestCase):
     def test_generate_invalid_qr_code_type(self):
         # Payload with unsupported QR code type
         payload = {
-            'lat': '-77.8473197',
-            'lon': '166.6752747',
-            'type': 'geo-qr'
+            'phone': '212-555-1234',
+            'message': 'Hello',
+            'type': 'sms-qr'
         }
 
         # Patch Qr methods to return dummy font and image
@@ -163,12 +198,1071 @@ class EndpointTests(TestCase):
             # Send post request, confirm expected error is returned
             response = self.app.post('/generate', json=payload, content_type='application/json')
             self.assertEqual(response.status_code, 400)
-            self.assertEqual(response.text, 'Unsupported QR code type')
+            self.assertEqual(response.json, {'error': 'Unsupported QR code type', 'field': 'type'})
 
             # Confirm methods used to generate QR code were not called
             self.assertEqual(mock_get_font.call_count, 0)
             self.assertEqual(mock_add_text.call_count, 0)
 
+    def test_generate_invalid_payload(self):
+        contact = {
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'phone': '212-555-1234',
+            'email': 'john.doe@hotmail.com',
+            'type': 'contact-qr'
+        }
+        with patch('app.render_images') as mock_render:
+            for payload, error in (
+                ({**contact, 'email': None}, {'error': 'email is required', 'field': 'email'}),
+                ({**contact, 'phone': 2125551234},
+                 {'error': 'phone must be a string', 'field': 'phone'}),
+                ({**contact, 'firstName': 'Jöhn' * 20},
+                 {'error': 'firstName must be at most 64 characters', 'field': 'firstName'}),
+                ({'type': 'link-qr', 'url': 'https://jamedeus.com/' + 'x' * 5000},
+                 {'error': 'url must be at most 4296 characters', 'field': 'url'}),
+                ({'type': 'link-qr', 'url': 'https://jamedeus.com/' + 'x' * 3000},
+                 {'error': 'url is too long to fit in a QR code (3021 bytes, max 2953)',
+                  'field': 'url'}),
+                ('contact-qr', {'error': 'Payload must be a JSON object', 'field': None})
+            ):
+                response = self.app.post('/generate', json=payload)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json, error)
+
+            # Confirm rejected before rendering
+            mock_render.assert_not_called()
+
+    def test_generate_cached(self):
+        payload = {
+            'ssid': 'AzureDiamond',
+            'password': 'hunter2',
+            'type': 'wifi-qr'
+        }
+
+        # First request should render, second should be served from cache
+        first = self.app.post('/generate', json=payload)
+        with patch.object(Qr, '_add_text') as mock_add_text:
+            second = self.app.post('/generate', json=payload)
+            self.assertEqual(mock_add_text.call_count, 0)
+        self.assertEqual(first.data, second.data)
+
+        # Extra whitespace should normalize to same cache entry
+        payload['ssid'] = '  AzureDiamond '
+        self.app.post('/generate', json=payload)
+
+        # Different capitalization is a different wifi network
+        payload['ssid'] = 'azurediamond'
+        self.app.post('/generate', json=payload)
+
+        response = self.app.get('/cache/stats')
+        self.assertEqual(response.json['hits'], 2)
+        self.assertEqual(response.json['misses'], 2)
+        self.assertEqual(response.json['entries'], 2)
+
+    def test_generate_contact_normalized(self):
+        payload = {
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'phone': '212-555-1234',
+            'email': 'john.doe@hotmail.com',
+            'type': 'contact-qr'
+        }
+        first = self.app.post('/generate', json=payload)
+
+        # Names and email are case-insensitive, should hit cache
+        payload['firstName'] = 'JOHN'
+        payload['email'] = 'John.Doe@Hotmail.com'
+        second = self.app.post('/generate', json=payload)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(render_cache.stats()['hits'], 1)
+
+    def test_generate_variants(self):
+        payload = {
+            'url': 'https://jamedeus.com',
+            'text': 'Homepage',
+            'type': 'link-qr',
+            'variants': ['no_caption']
+        }
+
+        # Confirm only requested variant returned, caption not generated
+        with patch.object(Qr, '_add_text') as mock_add_text:
+            response = self.app.post('/generate', json=payload)
+            self.assertEqual(list(response.json.keys()), ['no_caption'])
+            self.assertEqual(mock_add_text.call_count, 0)
+        no_caption = PIL.Image.open(io.BytesIO(base64.b64decode(response.json['no_caption'])))
+
+        # Request caption with crop box, should render caption and reuse cached no_caption
+        payload['variants'] = ['caption']
+        payload['crop'] = True
+        response = self.app.post('/generate', json=payload)
+        self.assertEqual(list(response.json.keys()), ['caption', 'crop'])
+        self.assertEqual(render_cache.stats()['entries'], 1)
+
+        # Confirm cropping caption image gives same pixels as no_caption image
+        self.assertCropMatches(response.json, no_caption)
+
+    def test_generate_crop_box(self):
+        # Caption overlaps QR code border, crop must exclude it for every type
+        # (multi-line captions, large versions with a thin border, small size)
+        payloads = [
+            {
+                'firstName': 'John',
+                'lastName': 'Doe',
+                'phone': '212-555-1234',
+                'email': 'johndoe@gmail.com',
+                'type': 'contact-qr'
+            },
+            {'ssid': 'AzureDiamond', 'password': 'hunter2', 'type': 'wifi-qr'},
+            {'url': 'https://jamedeus.com/' + 'x' * 1000, 'text': 'Long', 'type': 'link-qr'},
+            {'ssid': 'AzureDiamond', 'password': 'hunter2', 'type': 'wifi-qr', 'size': 120}
+        ]
+        for payload in payloads:
+            with self.subTest(qr_type=payload['type'], size=payload.get('size')):
+                response = self.app.post('/generate', json={**payload, 'crop': True})
+                no_caption = PIL.Image.open(
+                    io.BytesIO(base64.b64decode(response.json['no_caption']))
+                )
+                self.assertCropMatches(response.json, no_caption)
+
+    def assertCropMatches(self, response, no_caption):  # pylint: disable=invalid-name
+        '''Crops caption image in /generate response to crop box, pads it with
+        white to a square, confirms pixels match no_caption image.
+        '''
+        caption = PIL.Image.open(io.BytesIO(base64.b64decode(response['caption'])))
+        left, top, right, bottom = response['crop']
+        self.assertEqual((left, top, right), (0, 0, no_caption.width))
+        self.assertLess(bottom, no_caption.height)
+        padded = PIL.Image.new('1', no_caption.size, 1)
+        padded.paste(caption.crop(response['crop']).convert('1'), (0, 0))
+        self.assertEqual(padded.tobytes(), no_caption.tobytes())
+
+    def test_generate_svg(self):
+        payload = {
+            'ssid': 'AzureDiamond',
+            'password': 'hunter2',
+            'type': 'wifi-qr',
+            'format': 'svg'
+        }
+
+        # Confirm returns base64 SVGs without rasterizing QR code
+        with patch.object(Qr, '_generate_qr_image') as mock_generate_qr_image:
+            response = self.app.post('/generate', json=payload)
+            self.assertEqual(mock_generate_qr_image.call_count, 0)
+        caption = base64.b64decode(response.json['caption'])
+        self.assertIn(b'>SSID: AzureDiamond</text>', caption)
+        self.assertNotIn(b'<text', base64.b64decode(response.json['no_caption']))
+
+        # Confirm same hash serves SVG and PNG
+        key = response.headers['X-QR-Hash']
+        self.assertEqual(self.app.get(f'/qr/{key}.svg').data, caption)
+        self.assertEqual(self.app.get(f'/qr/{key}.png').mimetype, 'image/png')
+
+    def test_generate_compress_level(self):
+        payload = {'ssid': 'AzureDiamond', 'password': 'hunter2', 'type': 'wifi-qr'}
+        default = self.app.post('/generate', json=payload).json
+
+        # Uncompressed PNG should be larger, different cache entry
+        payload['compress_level'] = 0
+        uncompressed = self.app.post('/generate', json=payload).json
+        self.assertGreater(len(uncompressed['caption']), len(default['caption']))
+        self.assertEqual(render_cache.stats()['misses'], 2)
+
+    def test_generate_size_dpi(self):
+        payload = {'url': 'https://jamedeus.com', 'text': 'Homepage', 'type': 'link-qr'}
+        default = self.app.post('/generate', json=payload).json
+        default = PIL.Image.open(io.BytesIO(base64.b64decode(default['caption'])))
+
+        # Request thumbnail with print dpi, confirm rendered at smaller size
+        response = self.app.post('/generate', json={**payload, 'size': 100, 'dpi': 300})
+        image = PIL.Image.open(io.BytesIO(base64.b64decode(response.json['caption'])))
+        self.assertLessEqual(image.width, 100)
+        self.assertLess(image.height, default.height / 4)
+        self.assertEqual(tuple(round(value) for value in image.info['dpi']), (300, 300))
+
+        # Confirm different cache entry, SVG size in inches
+        self.assertEqual(render_cache.stats()['misses'], 2)
+        response = self.app.post(
+            '/generate', json={**payload, 'size': 100, 'dpi': 300, 'format': 'svg'}
+        )
+        svg = base64.b64decode(response.json['caption']).decode()
+        self.assertIn(f'width="{image.width / 300:g}in"', svg)
+
+    def test_generate_invalid_options(self):
+        payload = {'ssid': 'AzureDiamond', 'password': 'hunter2', 'type': 'wifi-qr'}
+        for options, error in (
+            ({'variants': []}, 'variants must be list containing caption, no_caption'),
+            ({'variants': ['thumbnail']}, 'variants must be list containing caption, no_caption'),
+            ({'variants': ['no_caption'], 'crop': True},
+             'crop requires caption variant and png format'),
+            ({'format': 'svg', 'crop': True}, 'crop requires caption variant and png format'),
+            ({'format': 'pdf'}, 'format must be one of png, svg'),
+            ({'compress_level': 10}, 'compress_level must be integer between 0 and 9'),
+            ({'compress_level': True}, 'compress_level must be integer between 0 and 9'),
+            ({'optimize': 'yes'}, 'optimize must be boolean'),
+            ({'size': 50}, 'size must be integer between 100 and 4000'),
+            ({'size': '500'}, 'size must be integer between 100 and 4000'),
+            ({'dpi': 10}, 'dpi must be integer between 72 and 2400'),
+            ({'error': 'X'}, 'error must be one of L, M, Q, H'),
+            ({'mask': 8}, 'mask must be integer between 0 and 7'),
+            ({'mask': True}, 'mask must be integer between 0 and 7'),
+            ({'version': 41}, 'version must be integer between 1 and 40'),
+            ({'min_version': False}, 'min_version must be integer between 1 and 40'),
+            ({'version': 5, 'min_version': 2}, 'version and min_version cannot both be set'),
+            ({'version': 1},
+             'Payload does not fit in version 1 at error level L (needs version 3)'),
+            ({'error': 'H', 'version': 3},
+             'Payload does not fit in version 3 at error level H (needs version 5)')
+        ):
+            response = self.app.post('/generate', json={**payload, **options})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json, {'error': error, 'field': list(options)[-1]})
+
+    def test_generate_encoding(self):
+        payload = {'url': 'https://jamedeus.com', 'type': 'link-qr'}
+        default = self.app.post('/generate', json=payload)
+        self.assertEqual(
+            default.headers['X-QR-Hash'],
+            payload_hash(normalize_payload(payload), DEFAULT_OPTIONS)
+        )
+
+        # Confirm fixed version 10 (57 + 6 border modules, 7 pixels each) has
+        # a larger symbol than version 2 picked by segno, different cache entry
+        response = self.app.post('/generate', json={
+            **payload, 'version': 10, 'error': 'H', 'mask': 3, 'variants': ['no_caption']
+        })
+        self.assertNotEqual(response.headers['X-QR-Hash'], default.headers['X-QR-Hash'])
+        image = PIL.Image.open(io.BytesIO(base64.b64decode(response.json['no_caption'])))
+        self.assertEqual(image.width, 441)
+        self.assertEqual(render_cache.stats()['misses'], 2)
+
+    def test_generate_coalesced(self):
+        payload = {'url': 'https://jamedeus.com', 'text': '', 'type': 'link-qr'}
+        release = threading.Event()
+
+        def slow_render(*args):
+            release.wait()
+            return render_images(*args)
+
+        # Send 4 concurrent requests for same payload while render is blocked
+        single_flight.clear_stats()
+        with patch('app.render_images', side_effect=slow_render) as mock_render, \
+             ThreadPoolExecutor(max_workers=4) as pool:
+            responses = [
+                pool.submit(app.test_client().post, '/generate', json=payload)
+                for _ in range(4)
+            ]
+            while not any(call.waiters == 3 for call in list(single_flight._calls.values())):
+                release.wait(0.001)
+            release.set()
+            responses = [response.result() for response in responses]
+
+        # Confirm rendered once, every request got the same images
+        self.assertEqual(mock_render.call_count, 1)
+        self.assertEqual(len({response.data for response in responses}), 1)
+        self.assertEqual(single_flight.stats()['coalesced_worker'], 3)
+        self.assertIn(
+            'qr_renders_coalesced_total{scope="worker"} 3',
+            self.app.get('/metrics').data.decode()
+        )
+
+    def test_get_qr_file(self):
+        payload = {'url': 'https://jamedeus.com', 'text': '', 'type': 'link-qr'}
+        response = self.app.post('/generate', json=payload)
+        key = response.headers['X-QR-Hash']
+        self.assertEqual(len(key), 64)
+
+        # Confirm returns same PNG as /generate with immutable cache headers
+        response = self.app.get(f'/qr/{key}.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.data, base64.b64decode(
+            self.app.post('/generate', json=payload).json['caption']
+        ))
+        self.assertEqual(response.headers['ETag'], f'"{key}-caption"')
+        self.assertTrue(response.cache_control.immutable)
+        self.assertTrue(response.cache_control.public)
+        self.assertEqual(response.cache_control.max_age, 31536000)
+
+        # Confirm returns 304 if client already has same version
+        response = self.app.get(f'/qr/{key}.png', headers={'If-None-Match': f'"{key}-caption"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        # Confirm no_caption variant has different ETag
+        response = self.app.get(f'/qr/{key}.png?variant=no_caption')
+        self.assertEqual(response.headers['ETag'], f'"{key}-no_caption"')
+        self.assertEqual(PIL.Image.open(io.BytesIO(response.data)).mode, '1')
+
+        # Confirm SVG rendered on demand
+        response = self.app.get(f'/qr/{key}.svg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/svg+xml')
+        self.assertIn(b'<svg', response.data)
+        self.assertIn(b'>jamedeus.com</text>', response.data)
+
+    def test_get_qr_file_errors(self):
+        response = self.app.post('/generate', json={
+            'ssid': 'AzureDiamond',
+            'password': 'hunter2',
+            'type': 'wifi-qr'
+        })
+        key = response.headers['X-QR-Hash']
+
+        # Wifi password should not be cached by shared proxies
+        response = self.app.get(f'/qr/{key}.png')
+        self.assertTrue(response.cache_control.private)
+        self.assertFalse(response.cache_control.public)
+
+        self.assertEqual(self.app.get(f'/qr/{key}.jpg').status_code, 404)
+        self.assertEqual(self.app.get(f'/qr/{key}.png?variant=small').status_code, 400)
+        self.assertEqual(self.app.get(f'/qr/{"0" * 64}.png').status_code, 404)
+
+    def test_generate_render_queue_full(self):
+        payload = {'ssid': 'AzureDiamond', 'password': 'hunter2', 'type': 'wifi-qr'}
+
+        # Confirm returns 503 with Retry-After when render queue full
+        with patch('app.render_executor.run', side_effect=RenderQueueFull):
+            response = self.app.post('/generate', json=payload)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+
+        # Confirm returns 504 when render times out
+        with patch('app.render_executor.run', side_effect=RenderTimeout):
+            response = self.app.post('/generate', json=payload)
+            self.assertEqual(response.status_code, 504)
+
+    def test_generate_batch(self):
+        wifi = {'ssid': 'AzureDiamond', 'password': 'hunter2', 'type': 'wifi-qr'}
+        link = {'url': 'https://jamedeus.com', 'text': '', 'type': 'link-qr'}
+
+        # Cache link QR code, other items should render in worker processes
+        cached = self.app.post('/generate', json=link).json
+        response = self.app.post('/generate/batch', json={'items': [
+            wifi,
+            {'phone': '212-555-1234', 'message': 'Hello', 'type': 'sms-qr'},
+            link,
+            {'ssid': 'missing password', 'type': 'wifi-qr'},
+            wifi
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.json['results']
+
+        # Confirm results in input order, errors do not fail whole batch
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[1], {'error': 'Unsupported QR code type', 'field': 'type'})
+        self.assertEqual(results[2], cached)
+        self.assertEqual(results[3], {'error': 'password is required', 'field': 'password'})
+        self.assertEqual(results[0], results[4])
+        self.assertEqual(results[0], self.app.post('/generate', json=wifi).json)
+
+    def test_generate_batch_invalid(self):
+        # Confirm rejects missing list and oversized batches
+        response = self.app.post('/generate/batch', json=[])
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/generate/batch', json={'items': 'wifi-qr'})
+        self.assertEqual(response.status_code, 400)
+        with patch('app.BATCH_MAX_ITEMS', 2):
+            response = self.app.post('/generate/batch', json={'items': [{}, {}, {}]})
+            self.assertEqual(response.status_code, 413)
+
+    def test_generate_archive(self):
+        contact = {
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'phone': '212-555-1234',
+            'email': 'john.doe@hotmail.com',
+            'type': 'contact-qr'
+        }
+        wifi = {'ssid': 'Office', 'password': 'hunter2', 'type': 'wifi-qr'}
+
+        response = self.app.post('/generate/archive', json={'items': [
+            contact,
+            {'phone': '212-555-1234', 'message': 'Hello', 'type': 'sms-qr'},
+            wifi,
+            contact
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        self.assertTrue(response.is_streamed)
+
+        # Confirm filenames match Qr.save, duplicates get suffix, errors listed
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            self.assertEqual(archive.namelist(), [
+                'John-Doe_contact.png',
+                'Office_Wifi_QR.png',
+                'John-Doe_contact_2.png',
+                'errors.txt'
+            ])
+            self.assertEqual(archive.read('errors.txt'), b'1: Unsupported QR code type')
+            image = PIL.Image.open(io.BytesIO(archive.read('Office_Wifi_QR.png')))
+            self.assertEqual(image.format, 'PNG')
+
+    def test_generate_archive_invalid(self):
+        response = self.app.post('/generate/archive', json={'items': None})
+        self.assertEqual(response.status_code, 400)
+
+    def test_generate_sheet(self):
+        contact = {
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'phone': '212-555-1234',
+            'email': 'john.doe@hotmail.com',
+            'type': 'contact-qr'
+        }
+
+        # Confirm 5 codes on 2x2 grid returns 2 page PDF
+        response = self.app.post('/generate/sheet', json={
+            'items': [contact] * 5, 'rows': 2, 'columns': 2, 'dpi': 100
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/pdf')
+        self.assertTrue(response.is_streamed)
+        self.assertTrue(response.data.startswith(b'%PDF-1.4'))
+        self.assertIn(b'/Count 2', response.data)
+
+        # Confirm png format returns ZIP with 1 PNG per page at requested dpi
+        response = self.app.post('/generate/sheet', json={
+            'items': [contact] * 5, 'rows': 2, 'columns': 2, 'dpi': 100,
+            'format': 'png', 'page': 'letter'
+        })
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            self.assertEqual(archive.namelist(), ['page-001.png', 'page-002.png'])
+            image = PIL.Image.open(io.BytesIO(archive.read('page-001.png')))
+            self.assertEqual(image.size, (850, 1100))
+            self.assertEqual(round(image.info['dpi'][0]), 100)
+
+    def test_generate_sheet_invalid(self):
+        link = {'url': 'https://jamedeus.com', 'type': 'link-qr'}
+        for data, error in (
+            ({'items': []}, 'Expected list of payloads in items key'),
+            ({'items': [link], 'format': 'jpg'}, 'format must be one of pdf, png'),
+            ({'items': [link], 'page': 'a3'}, 'page must be one of a4, letter'),
+            ({'items': [link], 'rows': 0}, 'rows must be integer between 1 and 20'),
+            ({'items': [link], 'margin': 'wide'}, 'margin must be number of millimeters'),
+            ({'items': [link], 'dpi': 1200}, 'dpi must be integer between 72 and 600'),
+            ({'items': [link], 'dpi': 72, 'rows': 20}, 'cells must be at least'),
+            ({'items': [link], 'dpi': 72, 'rows': 7}, 'cells must be at least'),
+            ({'items': [link, {'type': 'sms-qr'}]}, 'Invalid payload at index 1'),
+            ({'items': [link], 'mask': 9}, 'mask must be integer between 0 and 7'),
+            ({'items': [link], 'version': 1}, 'Invalid payload at index 0: Payload does not fit'),
+        ):
+            response = self.app.post('/generate/sheet', json=data)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(error, response.json['error'])
+
+        # Confirm field of invalid payload includes its index
+        response = self.app.post('/generate/sheet', json={'items': [link, {'type': 'sms-qr'}]})
+        self.assertEqual(response.json['field'], 'items.1.type')
+
+
+class SheetTests(TestCase):
+
+    def test_layout(self):
+        # Confirm A4 at 300 dpi, 10mm margins split into 3 columns x 4 rows
+        self.assertEqual(page_size(DEFAULT_LAYOUT), (2480, 3507))
+        self.assertEqual(cell_size(DEFAULT_LAYOUT), ((2480 - 236) // 3, (3507 - 236) // 4))
+        self.assertEqual(
+            [len(page) for page in paginate(list(range(30)), DEFAULT_LAYOUT)],
+            [12, 12, 6]
+        )
+
+    def test_compose_page(self):
+        layout = SheetLayout('letter', 2, 2, 5, 100)
+        payloads = [
+            {'type': 'link-qr', 'url': 'https://jamedeus.com', 'text': 'Homepage'},
+            {'type': 'link-qr', 'url': 'x' * 5000, 'text': ''},
+            {'type': 'wifi-qr', 'ssid': 'Office', 'password': 'hunter2'}
+        ]
+        page, failed = compose_page(payloads, layout)
+        self.assertEqual(page.mode, 'L')
+        self.assertEqual(page.size, (850, 1100))
+
+        # Confirm payload too long to encode is left blank, others fit in cells
+        self.assertEqual(failed, [1])
+        width, height = cell_size(layout)
+        margin = 19
+        for index in (0, 2):
+            row, column = divmod(index, 2)
+            left, top = margin + column * width, margin + row * height
+            box = page.crop((left, top, left + width, top + height)).point(lambda p: p < 255)
+            self.assertIsNotNone(box.getbbox())
+        self.assertIsNone(page.crop((
+            margin + width, margin, margin + width * 2, margin + height
+        )).point(lambda p: p < 255).getbbox())
+        self.assertIsNone(page.crop((0, 0, page.width, margin)).point(lambda p: p < 255).getbbox())
+
+    def test_fit_every_type(self):
+        # Confirm every type fits its cell on each page with the default grid
+        # and with a single row/column of the maximum number of cells
+        payloads = [normalize_payload(qr_class.template) for qr_class in QR_TYPES.values()]
+        payloads.append(normalize_payload(
+            {'type': 'link-qr', 'url': 'https://jamedeus.com/' + 'x' * 1000, 'text': 'Long'}
+        ))
+        for page in PAGE_SIZES:
+            for rows, columns in ((4, 3), (1, 20), (20, 1)):
+                for dpi in (150, 300, 600):
+                    layout = DEFAULT_LAYOUT._replace(page=page, rows=rows, columns=columns,
+                                                     dpi=dpi)
+                    width, height = cell_size(layout)
+                    min_width, min_height = min_cell_size()
+                    if width < min_width or height < min_height:
+                        continue
+                    for payload in payloads:
+                        with self.subTest(layout=layout, qr_type=payload['type']):
+                            self.assertFits(payload, width, height)
+
+    def assertFits(self, payload, width, height):  # pylint: disable=invalid-name
+        '''Confirms fit_qr returns code that fits in width x height, or raises
+        ValueError if it does not fit even at the smallest size (long URL in
+        a narrow cell, left blank).
+        '''
+        try:
+            qr_width, qr_height = fit_qr(payload, width, height).get_size()
+        except ValueError:
+            qr_width, qr_height = build_qr(payload, SIZE_RANGE[0]).get_size()
+            self.assertTrue(qr_width > width or qr_height > height)
+            return
+        self.assertLessEqual(qr_width, width)
+        self.assertLessEqual(qr_height, height)
+
+    def test_fixed_version(self):
+        # Confirm fixed version gives codes of different lengths the same size
+        layout = SheetLayout('a4', 4, 3, 10, 150, Encoding(version=8))
+        width, height = cell_size(layout)
+        codes = [
+            fit_qr(
+                {'type': 'link-qr', 'url': url, 'text': None}, width, height, layout.encoding
+            )
+            for url in ('https://jamedeus.com', 'https://jamedeus.com/' + 'x' * 100)
+        ]
+        self.assertEqual({qr.qr_raw.version for qr in codes}, {8})
+        self.assertEqual(codes[0].qr_image.size, codes[1].qr_image.size)
+
+    def test_stream_pdf(self):
+        layout = SheetLayout('a4', 1, 1, 10, 72)
+        payload = normalize_payload({'type': 'link-qr', 'url': 'https://jamedeus.com'})
+        pages = [render_page(([payload], layout, 'pdf')) for _ in range(2)]
+        self.assertEqual(pages[0][1], [])
+        pages = [page for page, _ in pages]
+        pdf = b''.join(stream_pdf(pages, 72))
+
+        # Confirm every cross reference table offset points to its object
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split()[0])
+        entries = pdf[xref:].split(b'\n')[3:3 + 8]
+        for number, entry in enumerate(entries, 1):
+            self.assertTrue(pdf[int(entry[:10]):].startswith(f'{number} 0 obj'.encode()))
+        self.assertIn(b'/MediaBox [0 0 595.00 841.00]', pdf)
+        self.assertIn(b'/Kids [5 0 R 8 0 R] /Count 2', pdf)
+
+        # Confirm image stream decompresses to page with QR code
+        width, height, pixels = pages[0]
+        page = PIL.Image.frombytes('L', (width, height), zlib.decompress(pixels))
+        self.assertEqual(page.getextrema(), (0, 255))
+
+
+class RenderCacheTests(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'cache.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_memory_lru(self):
+        cache = RenderCache(CacheLimits(entries=2))
+        cache.set('a', {'caption': b'a'})
+        cache.set('b', {'caption': b'b'})
+
+        # Access a so b is least recently used, add c (should evict b)
+        self.assertEqual(cache.get('a'), {'caption': b'a'})
+        cache.set('c', {'caption': b'c'})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), {'caption': b'c'})
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['entries'], 2)
+
+    def test_disk_tier_shared(self):
+        # Simulate 2 workers sharing same sqlite file
+        worker1 = RenderCache(path=self.path)
+        worker2 = RenderCache(path=self.path)
+        worker1.set('a', {'caption': b'png', 'no_caption': b'png2'})
+
+        # Second worker should read from disk, then from memory
+        self.assertEqual(worker2.get('a'), {'caption': b'png', 'no_caption': b'png2'})
+        self.assertEqual(worker2.get('a'), {'caption': b'png', 'no_caption': b'png2'})
+        self.assertEqual(worker2.stats()['disk_hits'], 1)
+        self.assertEqual(worker2.stats()['memory_hits'], 1)
+
+    def test_disk_tier_eviction(self):
+        cache = RenderCache(CacheLimits(disk_entries=2), path=self.path)
+        cache.set('a', {'caption': b'a'})
+        cache.set('b', {'caption': b'b'})
+        cache.set('c', {'caption': b'c'})
+        self.assertEqual(cache.stats()['disk_evictions'], 1)
+        self.assertIsNone(RenderCache(path=self.path).get('a'))
+
+    def test_byte_limits(self):
+        cache = RenderCache(CacheLimits(bytes=10, disk_bytes=10), path=self.path)
+        cache.set('a', {'caption': b'aaaa'})
+        cache.set('b', {'caption': b'bbbb'})
+        self.assertEqual(cache.stats()['bytes'], 8)
+
+        # Confirm least recently used evicted from both tiers when over bytes
+        cache.set('c', {'caption': b'cccc'})
+        self.assertEqual(cache.stats()['bytes'], 8)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['disk_evictions'], 1)
+        self.assertIsNone(RenderCache(path=self.path).get('a'))
+
+        # Confirm entry larger than limit not cached, replaced entry not counted twice
+        cache.set('d', {'caption': b'd' * 11})
+        self.assertIsNone(cache.get('d'))
+        self.assertIsNone(RenderCache(path=self.path).get('d'))
+        self.assertEqual(cache.stats()['oversized'], 2)
+        cache.set('c', {'caption': b'cccc', 'no_caption': b'cc'})
+        self.assertEqual(cache.stats()['bytes'], 10)
+
+    def test_disk_errors_not_fatal(self):
+        cache = RenderCache(path=self.path)
+        full = sqlite3.OperationalError('database or disk is full')
+
+        # Confirm failed write keeps entry in memory, failed read is a miss
+        with patch('render_cache.DiskTier.set', side_effect=full):
+            cache.set('a', {'caption': b'a'})
+        self.assertEqual(cache.get('a'), {'caption': b'a'})
+        with patch('render_cache.DiskTier.get', side_effect=full):
+            self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['disk_errors'], 2)
+
+    def test_secrets_not_persisted(self):
+        cache = RenderCache(path=self.path)
+        cache.set('wifi', {'caption': b'secret'}, secret=True)
+
+        # Should be in memory tier but not on disk
+        self.assertEqual(cache.get('wifi'), {'caption': b'secret'})
+        self.assertIsNone(RenderCache(path=self.path).get('wifi'))
+
+        # Should persist if configured to
+        cache = RenderCache(path=self.path, persist_secrets=True)
+        cache.set('wifi', {'caption': b'secret'}, secret=True)
+        self.assertEqual(RenderCache(path=self.path).get('wifi'), {'caption': b'secret'})
+
+    def test_clear_memory(self):
+        cache = RenderCache(path=self.path)
+        cache.set('a', {'caption': b'a'})
+        cache.clear_memory()
+
+        # Should be read from disk tier after memory tier is cleared
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.get('a'), {'caption': b'a'})
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+
+
+class MemoryTests(TestCase):
+
+    def test_buffer_pool_reuse(self):
+        pool = BufferPool(max_buffers=1)
+        with pool.buffer() as buffer:
+            buffer.write(b'abcdef')
+            self.assertEqual(pooled_value(buffer), b'abcdef')
+
+        # Should reuse same buffer, bytes left over from first write ignored
+        with pool.buffer() as second:
+            self.assertIs(second, buffer)
+            second.write(b'xy')
+            self.assertEqual(pooled_value(second), b'xy')
+
+    def test_buffer_pool_max_size(self):
+        # Buffers larger than max_size should not be returned to the pool
+        pool = BufferPool(max_size=4)
+        with pool.buffer() as buffer:
+            buffer.write(b'abcdef')
+        with pool.buffer() as second:
+            self.assertIsNot(second, buffer)
+
+    def test_img_to_png_bytes(self):
+        # Pooled buffer should return same bytes as a new buffer
+        image = ContactQr('John', 'Doe', '212-555-1234', 'john.doe@hotmail.com').qr_complete
+        expected = io.BytesIO()
+        image.save(expected, format='PNG', compress_level=6, optimize=False)
+        for _ in range(2):
+            self.assertEqual(img_to_png_bytes(image), expected.getvalue())
+        self.assertEqual(img_to_png_bytes(image.crop((0, 0, 50, 50)))[:8], b'\x89PNG\r\n\x1a\n')
+
+    def test_unneeded_stages(self):
+        qr = LinkQr('https://jamedeus.com', 'Homepage')
+
+        # qr_image needed to compose caption variant until it is generated
+        self.assertEqual(unneeded_stages(qr, ['caption']), [])
+        self.assertEqual(unneeded_stages(qr, ['no_caption']), ['qr_complete'])
+        qr.generate()
+        self.assertEqual(unneeded_stages(qr, ['caption']), ['qr_image'])
+        self.assertEqual(unneeded_stages(qr, []), ['qr_complete', 'qr_image'])
+
+        # Released stages should be generated again if accessed
+        qr.release('qr_image', 'qr_complete')
+        self.assertNotIn('qr_image', qr.__dict__)
+        self.assertEqual(qr.qr_complete.mode, 'RGB')
+
+    def test_render_images_releases_stages(self):
+        payload = normalize_payload(
+            {'type': 'link-qr', 'url': 'https://jamedeus.com', 'text': 'Homepage'}
+        )
+        with patch.object(Qr, 'release', autospec=True, side_effect=Qr.release) as mock_release:
+            images = render_images(payload)
+
+        # Both images should be released by the time the last one is encoded
+        self.assertEqual(set(images), {'caption', 'no_caption'})
+        released = {stage for call in mock_release.call_args_list for stage in call.args[1:]}
+        self.assertEqual(released, {'qr_image', 'qr_complete'})
+
+    def test_memory_budget(self):
+        # Disabled and within budget should not trim
+        trimmer = threading.Event()
+        for budget in (0, 1024 ** 4):
+            memory_budget = MemoryBudget(budget)
+            memory_budget.add_trimmer(trimmer.set)
+            self.assertTrue(memory_budget.check())
+            self.assertFalse(trimmer.is_set())
+
+        # Over budget should trim, still over budget after trimming
+        memory_budget = MemoryBudget(1)
+        memory_budget.add_trimmer(trimmer.set)
+        self.assertFalse(memory_budget.check())
+        self.assertTrue(trimmer.is_set())
+        stats = memory_budget.stats()
+        self.assertEqual((stats['trims'], stats['exceeded']), (1, 1))
+        self.assertGreater(stats['resident'], 0)
+
+
+class RenderExecutorTests(TestCase):
+
+    def setUp(self):
+        # 1 thread so each render's done callback runs before the next starts
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.shutdown()
+
+    def test_inline(self):
+        # Confirm calls function directly when no executor
+        executor = RenderExecutor()
+        self.assertEqual(executor.run(sum, [1, 2]), 3)
+
+    def test_run(self):
+        executor = RenderExecutor(lambda: self.pool, max_pending=1)
+        self.assertEqual(executor.run(sum, [1, 2]), 3)
+        self.assertEqual(executor.pending(), 0)
+
+    def test_queue_full(self):
+        executor = RenderExecutor(lambda: self.pool, max_pending=1, timeout=0.01)
+
+        # Start render that blocks, wait times out but render still pending
+        with self.assertRaises(RenderTimeout):
+            executor.run(self.release.wait)
+        self.assertEqual(executor.pending(), 1)
+
+        # Confirm next render rejected until first finishes
+        with self.assertRaises(RenderQueueFull):
+            executor.run(sum, [1, 2])
+        self.release.set()
+        self.pool.submit(lambda: None).result()
+        self.assertEqual(executor.run(sum, [1, 2]), 3)
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.pool = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.shutdown()
+
+    def wait_for_waiters(self, key, count):
+        # Block until count followers are waiting on the call for key
+        while self.flight._calls[key].waiters < count:
+            self.release.wait(0.001)
+
+    def test_coalesce(self):
+        calls = []
+
+        def render():
+            calls.append(1)
+            self.release.wait()
+            return {'caption': b'png'}
+
+        # Start 1 call, confirm 3 concurrent calls with same key wait for it
+        leader = self.pool.submit(self.flight.do, 'key', render)
+        while 'key' not in self.flight._calls:
+            self.release.wait(0.001)
+        followers = [self.pool.submit(self.flight.do, 'key', render) for _ in range(3)]
+        self.wait_for_waiters('key', 3)
+        self.release.set()
+
+        result = leader.result()
+        self.assertEqual(result, ({'caption': b'png'}, None))
+        for follower in followers:
+            self.assertIs(follower.result()[0], result[0])
+            self.assertEqual(follower.result()[1], 'worker')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.flight.stats(), {
+            'calls': 1, 'coalesced_worker': 3, 'coalesced_cross_worker': 0, 'in_flight': 0
+        })
+
+        # Confirm next call runs again (results are not cached)
+        self.assertEqual(self.flight.do('key', lambda: 2), (2, None))
+
+    def test_error_shared(self):
+        def render():
+            self.release.wait()
+            raise RenderQueueFull()
+
+        # Confirm follower gets exception raised by first call
+        leader = self.pool.submit(self.flight.do, 'key', render)
+        while 'key' not in self.flight._calls:
+            self.release.wait(0.001)
+        follower = self.pool.submit(self.flight.do, 'key', render)
+        self.wait_for_waiters('key', 1)
+        self.release.set()
+        with self.assertRaises(RenderQueueFull):
+            leader.result()
+        with self.assertRaises(RenderQueueFull):
+            follower.result()
+        self.assertEqual(self.flight.stats()['in_flight'], 0)
+
+    def test_cross_worker(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            self.flight = SingleFlight(lock_dir=tempdir)
+            self.assertEqual(self.flight.do('key', lambda: 1, lambda: 2), (1, None))
+
+            # Records when non-blocking lock attempt fails (call starts waiting)
+            blocked = threading.Event()
+            real_flock = fcntl.flock
+
+            def flock(file, operation):
+                try:
+                    return real_flock(file, operation)
+                except BlockingIOError:
+                    blocked.set()
+                    raise
+
+            # Hold lock file for key (same as another worker rendering it)
+            stripe = zlib.crc32(b'key') % LOCK_STRIPES
+            with open(os.path.join(tempdir, f'{stripe}.lock'), 'a', encoding='utf-8') as file, \
+                 patch('single_flight.fcntl.flock', side_effect=flock):
+                fcntl.flock(file, fcntl.LOCK_EX)
+                call = self.pool.submit(self.flight.do, 'key', lambda: 1, lambda: 2)
+                blocked.wait()
+                self.assertFalse(call.done())
+
+            # Confirm result from check returned after lock released (not rendered)
+            self.assertEqual(call.result(), (2, 'cross_worker'))
+        self.assertEqual(self.flight.stats()['calls'], 1)
+        self.assertEqual(self.flight.stats()['coalesced_cross_worker'], 1)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_metrics_endpoint(self):
+        client = app.test_client()
+        render_cache.clear()
+        metrics.clear()
+        payload = {'type': 'link-qr', 'url': 'https://jamedeus.com', 'text': 'Homepage'}
+        client.post('/generate', json=payload)
+        client.post('/generate', json=payload)
+        client.post('/generate', json={'type': 'invalid'})
+
+        # Confirm request, render, stage, and cache metrics exported
+        response = client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        text = response.text
+        self.assertIn(
+            'qr_http_requests_total{endpoint="/generate",method="POST",status="200"} 2', text
+        )
+        self.assertIn(
+            'qr_http_requests_total{endpoint="/generate",method="POST",status="400"} 1', text
+        )
+        self.assertIn('qr_renders_total{format="png",type="link-qr"} 1', text)
+        self.assertIn('qr_cache_hits_total{tier="memory"} 1', text)
+        self.assertIn('qr_renders_in_flight 0', text)
+        for stage in ('encode', 'rasterize', 'font_size', 'compose', 'png'):
+            self.assertIn(
+                f'qr_render_stage_seconds_count{{stage="{stage}",type="link-qr",version="2"}} 1',
+                text
+            )
+
+    def test_render(self):
+        registry = Metrics()
+        registry.inc('qr_renders_total', {'type': 'link-qr'})
+        registry.inc('qr_renders_total', {'type': 'link-qr'}, 2)
+        registry.observe('qr_render_seconds', 0.003)
+        registry.observe('qr_render_seconds', 20)
+
+        # Confirm counters added, histogram buckets cumulative (20 only in +Inf)
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE qr_renders_total counter', lines)
+        self.assertIn('qr_renders_total{type="link-qr"} 3', lines)
+        self.assertIn('qr_render_seconds_bucket{le="0.0025"} 0', lines)
+        self.assertIn('qr_render_seconds_bucket{le="0.005"} 1', lines)
+        self.assertIn('qr_render_seconds_bucket{le="10"} 1', lines)
+        self.assertIn('qr_render_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('qr_render_seconds_sum 20.003', lines)
+        self.assertIn('qr_render_seconds_count 2', lines)
+
+    def test_collect_all_processes(self):
+        # Simulate another worker by writing its snapshot with a different pid
+        worker = Metrics()
+        worker.inc('qr_renders_total')
+        worker.observe('qr_render_seconds', 0.003)
+        worker.add_collector(lambda: [('gauge', 'qr_renders_in_flight', None, 2)])
+        with open(os.path.join(self.tempdir, '1-1000.json'), 'w', encoding='utf-8') as file:
+            json.dump(worker.snapshot(), file)
+
+        # Confirm values from both processes added together
+        registry = Metrics(path=self.tempdir)
+        registry.inc('qr_renders_total')
+        registry.observe('qr_render_seconds', 0.003)
+        registry.add_collector(lambda: [('gauge', 'qr_renders_in_flight', None, 1)])
+        lines = registry.render().splitlines()
+        self.assertIn('qr_renders_total 2', lines)
+        self.assertIn('qr_render_seconds_count 2', lines)
+        self.assertIn('qr_render_seconds_bucket{le="0.005"} 2', lines)
+        self.assertIn('qr_renders_in_flight 3', lines)
+
+        # Confirm exited worker's gauges removed, counters kept, file removed
+        registry.mark_process_dead(1)
+        lines = registry.render().splitlines()
+        self.assertIn('qr_renders_total 2', lines)
+        self.assertIn('qr_render_seconds_count 2', lines)
+        self.assertIn('qr_renders_in_flight 1', lines)
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir, '1-1000.json')))
+
+        # Simulate new worker reusing pid 1, confirm exited totals not replaced
+        worker.clear()
+        worker.inc('qr_renders_total')
+        with open(os.path.join(self.tempdir, '1-2000.json'), 'w', encoding='utf-8') as file:
+            json.dump(worker.snapshot(), file)
+        self.assertIn('qr_renders_total 3', registry.render().splitlines())
+        registry.mark_process_dead(1)
+        self.assertIn('qr_renders_total 3', registry.render().splitlines())
+
+    def test_collect_during_exit(self):
+        # Simulate master merging exited worker after its file was read but
+        # before it was removed, confirm values not counted twice
+        worker = Metrics()
+        worker.inc('qr_renders_total')
+        path = os.path.join(self.tempdir, '1-1000.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(worker.snapshot(), file)
+        registry = Metrics(path=self.tempdir)
+        with patch('metrics.os.remove'):
+            registry.mark_process_dead(1)
+        self.assertTrue(os.path.exists(path))
+        self.assertIn('qr_renders_total 1', registry.render().splitlines())
+
+    def test_collect_missing_dir(self):
+        # Confirm values from this process returned if directory was removed
+        registry = Metrics(path=os.path.join(self.tempdir, 'missing'))
+        registry.inc('qr_renders_total')
+        self.assertIn('qr_renders_total 1', registry.render().splitlines())
+
+    def test_render_precision(self):
+        # Confirm integers are not printed as floats and floats keep every digit
+        registry = Metrics()
+        registry.inc('qr_renders_total', value=12345678)
+        registry.observe('qr_render_seconds', 0.1)
+        registry.observe('qr_render_seconds', 0.2)
+        registry.add_collector(lambda: [('gauge', 'qr_resident_memory_bytes', None, 1234567890)])
+        lines = registry.render().splitlines()
+        self.assertIn('qr_renders_total 12345678', lines)
+        self.assertIn('qr_resident_memory_bytes 1234567890', lines)
+        self.assertIn('qr_render_seconds_sum 0.30000000000000004', lines)
+
+
+class LoggerTests(TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = setup_logging(stream=self.stream)
+
+    def tearDown(self):
+        setup_logging(stream=io.StringIO())
+
+    def read_logs(self):
+        # Stop handler thread (writes all queued records), parse JSON lines
+        self.handler.stop()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_redact(self):
+        payload = {
+            'type': 'wifi-qr',
+            'password': 'hunter2',
+            'items': [{'phone': '212-555-1234', 'email': 'john.doe@hotmail.com'}]
+        }
+        self.assertEqual(redact(payload), {
+            'type': 'wifi-qr',
+            'password': '[REDACTED]',
+            'items': [{'phone': '[REDACTED]', 'email': '[REDACTED]'}]
+        })
+
+    def test_sampling(self):
+        # Confirm info records dropped at rate 0, warnings always kept
+        sampler = SamplingFilter(0)
+        info = logging.LogRecord('qr', logging.INFO, '', 0, 'info', None, None)
+        warning = logging.LogRecord('qr', logging.WARNING, '', 0, 'warning', None, None)
+        self.assertFalse(sampler.filter(info))
+        self.assertTrue(sampler.filter(warning))
+
+    def test_request_log(self):
+        # Send request with request ID and secret, confirm ID returned
+        response = app.test_client().post(
+            '/generate',
+            json={'type': 'wifi-qr', 'ssid': 'AzureDiamond', 'password': 'hunter2'},
+            headers={'X-Request-ID': 'abc123'}
+        )
+        self.assertEqual(response.headers['X-Request-ID'], 'abc123')
+
+        # Confirm logged 1 JSON line with request ID, status, and render time
+        logs = self.read_logs()
+        self.assertEqual(len(logs), 1)
+        self.assertEqual(logs[0]['request_id'], 'abc123')
+        self.assertEqual(logs[0]['status'], 200)
+        self.assertEqual(logs[0]['type'], 'wifi-qr')
+        self.assertIn('duration_ms', logs[0])
+        self.assertIn(logs[0]['cache'], ('hit', 'miss'))
+
+    def test_debug_payload_redacted(self):
+        self.handler = setup_logging(level='DEBUG', stream=self.stream)
+        app.test_client().post(
+            '/generate',
+            json={'type': 'wifi-qr', 'ssid': 'AzureDiamond', 'password': 'hunter2'}
+        )
+
+        # Confirm payload logged without password, request ID on both lines
+        logs = self.read_logs()
+        self.assertEqual(logs[0]['payload']['password'], '[REDACTED]')
+        self.assertEqual(logs[0]['payload']['ssid'], 'AzureDiamond')
+        self.assertEqual(logs[0]['request_id'], logs[1]['request_id'])
+        self.assertNotIn('hunter2', self.stream.getvalue())
+
 
 class QrBaseClassTests(TestCase):
 
@@ -184,6 +1278,402 @@ class QrBaseClassTests(TestCase):
         with self.assertRaises(NotImplementedError):
             qr._generate_caption()
 
+    def test_encoding(self):
+        # Confirm error level, mask and version passed to segno
+        url = 'https://jamedeus.com'
+        qr = LinkQr(url, encoding=Encoding(error='H', mask=3, version=10))
+        self.assertEqual((qr.qr_raw.error, qr.qr_raw.mask, qr.qr_raw.version), ('H', 3, 10))
+
+        # Confirm min_version raises version of short content, longer content
+        # uses the smallest version it fits in
+        self.assertEqual(LinkQr(url).qr_raw.version, 2)
+        self.assertEqual(LinkQr(url, encoding=Encoding(min_version=5)).qr_raw.version, 5)
+        long_url = f'{url}/{"x" * 200}'
+        self.assertGreater(min_version(long_url), 5)
+        self.assertEqual(
+            LinkQr(long_url, encoding=Encoding(min_version=5)).qr_raw.version,
+            min_version(long_url)
+        )
+
+    def test_encode_cache(self):
+        # Confirm same content at another size reuses the encoded QR code
+        encode.cache_clear()
+        first = LinkQr('https://jamedeus.com').qr_raw
+        self.assertIs(LinkQr('https://jamedeus.com', size=1000).qr_raw, first)
+        self.assertEqual(encode.cache_info().hits, 1)
+
+        # Confirm different encoding options are encoded separately
+        self.assertIsNot(LinkQr('https://jamedeus.com', encoding=Encoding(mask=3)).qr_raw, first)
+        self.assertEqual(encode.cache_info().misses, 2)
+
+        # Confirm clearing to free memory keeps totals (metrics never decrease)
+        stats = encode_cache_stats()
+        clear_encode_cache()
+        self.assertEqual(encode.cache_info().hits, 0)
+        self.assertEqual(encode_cache_stats(), stats)
+        LinkQr('https://jamedeus.com').qr_raw  # pylint: disable=expression-not-assigned
+        self.assertEqual(encode_cache_stats()['misses'], stats['misses'] + 1)
+
+    def test_warm_up(self):
+        # Confirm warm up loads every caption font size
+        with patch('render.render_images', wraps=render_images) as mock_render, \
+             patch('render.Qr.preload_fonts') as mock_preload_fonts:
+            warm_up()
+        mock_preload_fonts.assert_called_once()
+
+        # Confirm rendered 1 template of each type in both formats
+        self.assertEqual(mock_render.call_count, 10)
+        self.assertEqual(
+            {call.args[0]['type'] for call in mock_render.call_args_list},
+            {'contact-qr', 'wifi-qr', 'link-qr', 'vcard-qr', 'geo-qr'}
+        )
+
+    def test_registry(self):
+        # Confirm every subclass with a type key is registered
+        self.assertEqual(
+            QR_TYPES,
+            {'contact-qr': ContactQr, 'wifi-qr': WifiQr, 'link-qr': LinkQr,
+             'vcard-qr': VCardQr, 'geo-qr': GeoQr}
+        )
+        self.assertEqual({key for key, cls in QR_TYPES.items() if cls.secret}, {'wifi-qr'})
+
+        # Confirm subclass without type key is not registered, duplicate key raises
+        class Untyped(Qr):  # pylint: disable=abstract-method,unused-variable
+            pass
+        self.assertEqual(len(QR_TYPES), 5)
+        with self.assertRaises(TypeError):
+            class Duplicate(Qr):  # pylint: disable=abstract-method,unused-variable
+                type_key = 'link-qr'
+        self.assertIs(QR_TYPES['link-qr'], LinkQr)
+
+        # Confirm build_qr returns instance of registered subclass
+        payload = normalize_payload({'type': 'geo-qr', 'latitude': '1', 'longitude': '2'})
+        self.assertIsInstance(build_qr(payload), GeoQr)
+        with self.assertRaises(ValueError):
+            build_qr({'type': 'sms-qr'})
+
+    def test_render_batch_cost_order(self):
+        payloads = [
+            normalize_payload(QR_TYPES[key].template)
+            for key in ('geo-qr', 'contact-qr', 'vcard-qr')
+        ]
+        with ThreadPoolExecutor(max_workers=1) as executor, \
+             patch.object(executor, 'submit', wraps=executor.submit) as mock_submit:
+            results = render_batch(payloads, executor)
+
+        # Confirm most expensive type submitted first, results in input order
+        self.assertEqual(
+            [call.args[1]['type'] for call in mock_submit.call_args_list],
+            ['vcard-qr', 'contact-qr', 'geo-qr']
+        )
+        self.assertEqual(results[0], render_images(payloads[0]))
+
+    def test_render_batch_window(self):
+        # Confirm large batch does not fill the pool queue (other requests
+        # using the pool would wait for all of it)
+        payloads = [normalize_payload(QR_TYPES['geo-qr'].template)] * 6
+        futures, queued = [], []
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            submit = executor.submit
+
+            def track(func, payload):
+                queued.append(sum(not future.done() for future in futures))
+                futures.append(submit(func, payload))
+                return futures[-1]
+
+            with patch.object(executor, 'submit', side_effect=track):
+                results = render_batch(payloads, executor, window=2)
+        self.assertLessEqual(max(queued), 2)
+        self.assertEqual(len(results), 6)
+
+    def test_separate_render_pool(self):
+        # Confirm single renders and batches use different pools per process
+        with patch('batch.create_executor', side_effect=lambda workers: object()), \
+             patch.dict('batch._executors', clear=True):
+            self.assertIsNot(batch.get_render_executor(), batch.get_executor())
+            self.assertIs(batch.get_render_executor(), batch.get_executor('render'))
+
+    def test_size(self):
+        # Confirm image width and caption font sizes scale with size arg
+        default = LinkQr('https://jamedeus.com', 'Homepage')
+        large = LinkQr('https://jamedeus.com', 'Homepage', size=1000)
+        thumbnail = LinkQr('https://jamedeus.com', 'Homepage', size=100)
+        self.assertEqual(large.qr_image.width, default.qr_image.width * 2)
+        self.assertEqual(large._caption[0]['font'].size, 144)
+        self.assertEqual(thumbnail._caption[0]['font'].size, 14)
+        self.assertLessEqual(thumbnail.qr_complete.width, 100)
+
+        # Confirm size smaller than QR code uses 1 pixel per module
+        tiny = LinkQr('https://jamedeus.com', size=10)
+        self.assertEqual(tiny.qr_image.width, tiny.qr_raw.symbol_size(border=3)[0])
+
+    def test_generate_qr_image_matches_segno_png(self):
+        qr = LinkQr("https://jamedeus.com")
+
+        # Confirm rasterized matrix is pixel-identical to segno PNG output
+        for version in (1, 7, 25, 40):
+            qr.qr_raw = segno.make('test', version=version, micro=False)
+            image = qr._generate_qr_image()
+            scale = int(500 / qr.qr_raw.symbol_size(border=3)[0])
+            buffer = io.BytesIO()
+            qr.qr_raw.save(buffer, scale=scale, border=3, kind='png')
+            expected = PIL.Image.open(buffer)
+            self.assertEqual(image.mode, expected.mode)
+            self.assertEqual(image.size, expected.size)
+            self.assertEqual(image.tobytes(), expected.tobytes())
+
+    def test_lazy_stages(self):
+        # Confirm no stages generated when instantiated
+        with patch.object(Qr, '_get_font') as mock_get_font, \
+             patch.object(Qr, '_add_text') as mock_add_text:
+            qr = LinkQr("https://jamedeus.com")
+            self.assertEqual(qr.filename, 'jamedeus.com_QR')
+            self.assertFalse(set(Qr._STAGES) & vars(qr).keys())
+
+            # Accessing image without caption should not generate caption
+            self.assertIsInstance(qr.qr_image, PIL.Image.Image)
+            self.assertIn('qr_raw', vars(qr))
+            self.assertEqual(mock_get_font.call_count, 0)
+            self.assertEqual(mock_add_text.call_count, 0)
+
+            # Accessing complete image should generate caption once
+            self.assertIs(qr.qr_complete, qr.qr_complete)
+            self.assertEqual(mock_get_font.call_count, 1)
+            self.assertEqual(mock_add_text.call_count, 1)
+
+            # Confirm time spent in each stage recorded
+            self.assertEqual(
+                set(qr.stage_timings), {'encode', 'rasterize', 'font_size', 'compose'}
+            )
+
+            # Generate method should discard and regenerate all stages (same
+            # encoded QR code is returned by the encode cache)
+            qr_image = qr.qr_image
+            qr.generate()
+            self.assertIsNot(qr.qr_image, qr_image)
+            self.assertIn('qr_raw', vars(qr))
+            self.assertEqual(mock_add_text.call_count, 2)
+
+    def test_add_text_reuses_measurements(self):
+        qr = ContactQr("John", "Doe", "(212) 555-1234", "john.doe@hotmail.com")
+        self.assertEqual(len(qr._caption), 2)
+
+        # Confirm rows measured by _get_font are not measured again
+        with patch.object(PIL.ImageDraw.ImageDraw, 'textbbox') as mock_textbbox:
+            image = qr.qr_complete
+            self.assertEqual(mock_textbbox.call_count, 0)
+
+        # Confirm canvas has space for QR code and both rows
+        name_height = qr._text_layouts[('John Doe', qr._caption[0]['font'])].bbox[3]
+        self.assertGreater(image.height, qr.qr_image.height + name_height)
+        self.assertEqual(image.width, qr.qr_image.width)
+
+    def test_to_svg(self):
+        qr = ContactQr("John", "Doe", "(212) 555-1234", "john.doe@hotmail.com")
+        svg = qr.to_svg().decode()
+
+        # Confirm caption rows are text elements (multiline row split)
+        self.assertIn('>John Doe</text>', svg)
+        self.assertIn('>john.doe@hotmail.com</text>', svg)
+        self.assertIn('>(212) 555-1234</text>', svg)
+
+        # Confirm nothing was rasterized
+        self.assertNotIn('qr_image', vars(qr))
+        self.assertNotIn('qr_complete', vars(qr))
+
+        # Confirm same dimensions as PNG, no text without caption
+        self.assertIn(f'width="{qr.qr_complete.width}" height="{qr.qr_complete.height}"', svg)
+        svg = qr.to_svg(caption=False).decode()
+        self.assertNotIn('<text', svg)
+        self.assertIn(f'width="{qr.qr_image.width}" height="{qr.qr_image.height}"', svg)
+
+    def test_load_font_cache(self):
+        # Confirm same font object returned for same path + size
+        font = load_font(Qr._SANS_FONT, 42)
+        self.assertIs(load_font(Qr._SANS_FONT, 42), font)
+        self.assertIsNot(load_font(Qr._SANS_FONT, 41), font)
+
+    def test_get_font_fits_text(self):
+        qr = LinkQr("https://jamedeus.com")
+        draw = PIL.ImageDraw.Draw(qr.qr_image)
+        max_width = int(qr.qr_image.width * 0.90)
+
+        # Short text should use max size
+        self.assertEqual(qr._get_font('short', Qr._MONO_FONT, 64).size, 64)
+
+        # Long text should use largest size that fits
+        font = qr._get_font('x' * 50, Qr._MONO_FONT, 64)
+        self.assertLessEqual(draw.textbbox((0, 0), 'x' * 50, font)[2], max_width)
+        larger = load_font(Qr._MONO_FONT, font.size + 1)
+        self.assertGreater(draw.textbbox((0, 0), 'x' * 50, larger)[2], max_width)
+
+
+class LayoutCacheTests(TestCase):
+
+    def test_cache_hit_does_not_measure(self):
+        ContactQr('John', 'Doe', '212-555-1234', 'john.doe@hotmail.com').to_svg()
+        qr = ContactQr('John', 'Doe', '212-555-1234', 'john.doe@hotmail.com')
+
+        # Render same caption again, confirm text was not measured
+        with patch.object(PIL.ImageDraw.ImageDraw, 'textbbox') as textbbox, \
+             patch.object(PIL.ImageFont.FreeTypeFont, 'getbbox') as getbbox, \
+             patch.object(PIL.ImageFont.FreeTypeFont, 'getlength') as getlength:
+            qr.to_svg()
+            self.assertIsNotNone(qr.qr_complete)
+        textbbox.assert_not_called()
+        getbbox.assert_not_called()
+        getlength.assert_not_called()
+
+    def test_lru_eviction_and_stats(self):
+        cache = LayoutCache(max_entries=2)
+        first = cache.fit('first', Qr._SANS_FONT, 42)
+        cache.fit('second', Qr._SANS_FONT, 42)
+
+        # Confirm hit returns same layout, moves entry to end (evicts second)
+        self.assertIs(cache.fit('first', Qr._SANS_FONT, 42), first)
+        cache.fit('third', Qr._SANS_FONT, 42)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 3, 'evictions': 1, 'entries': 2})
+        cache.fit('second', Qr._SANS_FONT, 42)
+        self.assertEqual(cache.stats()['misses'], 4)
+
+        cache.clear()
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 0, 'evictions': 0, 'entries': 0})
+
+    def test_multiline_layout(self):
+        # Confirm lines centered (shorter line offset right) and spaced down
+        layout = layout_cache.fit('wide line\nnarrow', Qr._SANS_FONT, 42)
+        self.assertEqual(layout.lines[0][:2], (0, 0))
+        self.assertGreater(layout.lines[1][0], 0)
+        self.assertGreater(layout.lines[1][1], 0)
+        self.assertEqual([line[2] for line in layout.lines], ['wide line', 'narrow'])
+
+    def test_save_and_load(self):
+        cache = LayoutCache()
+        layout = cache.fit('a\nb', Qr._MONO_FONT, 64, 100, 4)
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'layouts.json')
+            cache.save(path)
+
+            # Confirm loaded entry is a hit and equal to original layout
+            loaded = LayoutCache()
+            self.assertEqual(loaded.load(path), 1)
+            self.assertEqual(loaded.fit('a\nb', Qr._MONO_FONT, 64, 100, 4), layout)
+            self.assertEqual(loaded.stats()['hits'], 1)
+
+            # Confirm file saved by a different Pillow version is ignored
+            with patch.object(PIL, '__version__', '0.0.0'):
+                self.assertEqual(LayoutCache().load(path), 0)
+
+
+class GlyphAtlasTests(TestCase):
+
+    def test_matches_draw_text(self):
+        qrs = (
+            lambda: ContactQr('Åsa', 'Wójcik', '+1 (212) 555-1234', 'ava.fijq@hotmail.com'),
+            lambda: ContactQr('John', 'Doe', '212-555-1234', 'john.doe@hotmail.com', size=150),
+            lambda: WifiQr('AVA Wally', 'hunter2'),
+            lambda: LinkQr('https://jamedeus.com', 'Homepage')
+        )
+        for factory in qrs:
+            with patch.object(glyph_atlas, 'ENABLED', False):
+                expected = factory().qr_complete
+            with patch.object(glyph_atlas, 'ENABLED', True):
+                actual = factory().qr_complete
+
+            # Confirm less than 0.1% of pixels differ (overlapping glyph edges)
+            histogram = ImageChops.difference(expected, actual).convert('L').histogram()
+            self.assertEqual(actual.size, expected.size)
+            self.assertLess(sum(histogram[1:]), expected.width * expected.height * 0.001)
+
+    def test_glyphs_cached(self):
+        font = load_font(Qr._SANS_FONT, 24)
+        atlas = glyph_atlas.GlyphAtlas(font)
+        image = PIL.Image.new('RGB', (200, 50), 'white')
+        atlas.draw(image, (0, 0), 'abc a')
+        self.assertEqual(set(atlas._glyphs), {'a', 'b', 'c', ' '})
+
+        # Confirm cached glyphs are drawn without rasterizing again
+        with patch.object(font, 'getmask2') as getmask2:
+            atlas.draw(image, (0.5, 0), 'cab')
+        getmask2.assert_not_called()
+
+        # Confirm glyphs past limit are drawn but not cached
+        with patch.object(glyph_atlas, 'MAX_GLYPHS', 4):
+            atlas.draw(image, (0, 0), 'xyz')
+        self.assertEqual(len(atlas._glyphs), 4)
+        self.assertIs(glyph_atlas.get_atlas(font), glyph_atlas.get_atlas(font))
+
+
+class PayloadValidationTests(TestCase):
+
+    def test_capacity_table(self):
+        # Confirm table matches max characters from ISO/IEC 18004 table 7
+        self.assertEqual(CAPACITY['L']['numeric'][0], 41)
+        self.assertEqual(CAPACITY['H']['alphanumeric'][0], 10)
+        self.assertEqual(CAPACITY['L']['byte'][-1], 2953)
+        self.assertEqual(CAPACITY['H']['kanji'][-1], 784)
+
+    def test_min_version_matches_segno(self):
+        for content in (
+            '', '1234567890' * 50, 'HTTPS://JAMEDEUS.COM/' * 40, 'https://jamedeus.com/' * 50,
+            'Jöhn Döe', '日本語' * 200, 'Ωmega 🙂' * 100, 'x' * 2953, 'x' * 2954, '7' * 8000
+        ):
+            try:
+                expected = segno.make(content, micro=False).version
+            except segno.DataOverflowError:
+                expected = None
+            self.assertEqual(min_version(content), expected)
+
+    def test_capacity_with_encoding(self):
+        # Confirm URL that fits at error level L is rejected at H (error field)
+        # and in a fixed version that is too small (version field)
+        data = {'type': 'link-qr', 'url': 'https://jamedeus.com/' + 'x' * 2000}
+        normalize_payload(data)
+        for encoding, field in ((Encoding(error='H'), 'error'), (Encoding(version=20), 'version')):
+            with self.assertRaises(PayloadError) as context:
+                normalize_payload(data, encoding)
+            self.assertEqual(context.exception.field, field)
+
+    def test_validate_payload(self):
+        wifi = {'type': 'wifi-qr', 'ssid': 'Office', 'password': 'hunter2'}
+        validate_payload(wifi)
+        validate_payload({'type': 'link-qr', 'url': 'https://jamedeus.com', 'text': None})
+
+        for data, field in (
+            ([wifi], None),
+            ({**wifi, 'type': ['wifi-qr']}, 'type'),
+            ({**wifi, 'ssid': '   '}, 'ssid'),
+            ({**wifi, 'ssid': 'x' * 33}, 'ssid'),
+            ({**wifi, 'password': '\ud800'}, 'password'),
+            ({'type': 'link-qr', 'url': 'https://jamedeus.com', 'text': 5}, 'text')
+        ):
+            with self.assertRaises(PayloadError) as context:
+                validate_payload(data)
+            self.assertEqual(context.exception.field, field)
+
+    def test_payload_hash_keyed_for_secrets(self):
+        # Confirm public types are a plain sha256 of the canonical payload
+        link = normalize_payload({'type': 'link-qr', 'url': 'https://jamedeus.com'})
+        canonical = json.dumps({'payload': link, 'options': {}}, sort_keys=True,
+                               separators=(',', ':')).encode()
+        self.assertEqual(payload_hash(link), hashlib.sha256(canonical).hexdigest())
+
+        # Confirm wifi hash can not be reproduced without the key
+        wifi = normalize_payload({'type': 'wifi-qr', 'ssid': 'Office', 'password': 'hunter2'})
+        canonical = json.dumps({'payload': wifi, 'options': {}}, sort_keys=True,
+                               separators=(',', ':')).encode()
+        self.assertNotEqual(payload_hash(wifi), hashlib.sha256(canonical).hexdigest())
+        key = payload_hash(wifi)
+        self.assertEqual(payload_hash(dict(wifi)), key)
+        with patch('qr_types.HASH_KEY', b'other deployment'):
+            self.assertNotEqual(payload_hash(wifi), key)
+
+    def test_capacity_checked_before_encoding(self):
+        # Confirm segno is not called for content that can not fit
+        with patch('qr.segno.make') as mock_make, self.assertRaises(PayloadError):
+            normalize_payload({'type': 'link-qr', 'url': 'x' * 3000})
+        mock_make.assert_not_called()
+
 
 class ContactQrTests(TestCase):
 
@@ -194,6 +1684,8 @@ class ContactQrTests(TestCase):
             os.remove('John-Doe_contact.png')
         if os.path.exists('Missing_Extension.png'):
             os.remove('Missing_Extension.png')
+        if os.path.exists('Missing_Extension.svg'):
+            os.remove('Missing_Extension.svg')
 
     def test_contact_qr(self):
         # Instantiate, confirm attributes
@@ -214,7 +1706,7 @@ class ContactQrTests(TestCase):
         self.assertIsInstance(qr._caption[0]['font'], PIL.ImageFont.FreeTypeFont)
         self.assertIsInstance(qr._caption[1]['font'], PIL.ImageFont.FreeTypeFont)
         self.assertIsInstance(qr.qr_raw, segno.QRCode)
-        self.assertIsInstance(qr.qr_image, PIL.PngImagePlugin.PngImageFile)
+        self.assertIsInstance(qr.qr_image, PIL.Image.Image)
         self.assertIsInstance(qr.qr_complete, PIL.Image.Image)
 
         # Confirm save method writes file to disk with correct filename
@@ -230,6 +1722,11 @@ class ContactQrTests(TestCase):
         qr.save('Missing_Extension')
         self.assertTrue(os.path.exists('Missing_Extension.png'))
 
+        # Save as SVG, confirm written with svg extension
+        qr.save('Missing_Extension.svg', kind='svg')
+        with open('Missing_Extension.svg', 'rb') as file:
+            self.assertEqual(file.read(), qr.to_svg())
+
     # Test automatic attribute formatting
     def test_formatting(self):
         # Instantiate with wrong capitalization, confirm corrected
@@ -246,6 +1743,13 @@ class ContactQrTests(TestCase):
         self.assertEqual(qr._caption[1]['text'], 'johnathan.doeth@hotmail.com\n(212) 555-1234')
         self.assertEqual(len(qr._caption), 2)
 
+    def test_long_name(self):
+        # Name font smaller than 7 points should not make info font size 0
+        qr = ContactQr('a' * 500, 'b' * 500, '212-555-1234', 'john.doe@hotmail.com')
+        self.assertLessEqual(qr._caption[0]['font'].size, 6)
+        self.assertEqual(qr._caption[1]['font'].size, 1)
+        self.assertIsInstance(qr.qr_complete, PIL.Image.Image)
+
 
 class WifiQrTests(TestCase):
 
@@ -272,7 +1776,7 @@ class WifiQrTests(TestCase):
         self.assertIsInstance(qr._caption[0]['font'], PIL.ImageFont.FreeTypeFont)
         self.assertIsInstance(qr._caption[1]['font'], PIL.ImageFont.FreeTypeFont)
         self.assertIsInstance(qr.qr_raw, segno.QRCode)
-        self.assertIsInstance(qr.qr_image, PIL.PngImagePlugin.PngImageFile)
+        self.assertIsInstance(qr.qr_image, PIL.Image.Image)
         self.assertIsInstance(qr.qr_complete, PIL.Image.Image)
 
         # Confirm save method writes file to disk with correct filename
@@ -323,7 +1827,7 @@ class LinkQrTests(TestCase):
         # Confirm attributes have correct instance types
         self.assertIsInstance(qr._caption[0]['font'], PIL.ImageFont.FreeTypeFont)
         self.assertIsInstance(qr.qr_raw, segno.QRCode)
-        self.assertIsInstance(qr.qr_image, PIL.PngImagePlugin.PngImageFile)
+        self.assertIsInstance(qr.qr_image, PIL.Image.Image)
         self.assertIsInstance(qr.qr_complete, PIL.Image.Image)
 
         # Confirm save method writes file to disk with correct filename
@@ -358,3 +1862,221 @@ class LinkQrTests(TestCase):
         # Confirm correct text under QR
         self.assertEqual(qr._caption[0]['text'], 'jamedeus.com')
         self.assertEqual(len(qr._caption), 1)
+
+
+class VCardQrTests(TestCase):
+
+    def test_vcard_qr(self):
+        qr = VCardQr('John', 'Doe', {'organization': 'Acme, Inc.', 'email': 'john@acme.com'})
+        self.assertEqual(qr.filename, 'John-Doe_vcard')
+
+        # Confirm text values escaped, only given properties included
+        self.assertEqual(qr.content, (
+            'BEGIN:VCARD\r\nVERSION:3.0\r\nN:Doe;John;;;\r\nFN:John Doe\r\n'
+            'ORG:Acme\\, Inc.\r\nEMAIL;TYPE=INTERNET:john@acme.com\r\nEND:VCARD\r\n'
+        ))
+
+        # Confirm caption has name and details, name only if no details
+        self.assertEqual(
+            [line['text'] for line in qr._caption],
+            ['John Doe', 'Acme, Inc.\njohn@acme.com']
+        )
+        self.assertEqual(len(VCardQr('John', 'Doe')._caption), 1)
+        self.assertIsInstance(qr.qr_complete, PIL.Image.Image)
+
+    def test_vcard_normalize(self):
+        payload = normalize_payload({
+            'type': 'vcard-qr',
+            'firstName': ' John ',
+            'lastName': 'McDonald',
+            'email': 'John@Acme.com',
+            'title': '  ',
+            'url': 'https://acme.com'
+        })
+        self.assertEqual(payload, {
+            'type': 'vcard-qr',
+            'first_name': 'John',
+            'last_name': 'McDonald',
+            'details': {'email': 'john@acme.com', 'url': 'https://acme.com'}
+        })
+        self.assertIn('URL:https://acme.com\r\n', build_qr(payload).content)
+
+    def test_vcard_line_breaks(self):
+        # Confirm URL with line break rejected (would add a property)
+        data = {
+            'type': 'vcard-qr',
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'url': 'https://acme.com\r\nTEL:555-0100'
+        }
+        with self.assertRaises(PayloadError) as context:
+            normalize_payload(data)
+        self.assertEqual(context.exception.field, 'url')
+
+        # Confirm line breaks in text values and direct URL args never start a line
+        qr = VCardQr('John', 'Doe\r\nTEL:555-0100', {
+            'title': 'CEO\rTEL:555-0100',
+            'url': 'https://acme.com\r\nTEL:555-0100'
+        })
+        lines = qr.content.split('\r\n')
+        self.assertFalse(any(line.startswith('TEL') for line in lines))
+        self.assertIn('URL:https://acme.comTEL:555-0100', lines)
+        self.assertIn('TITLE:CEO\\nTEL:555-0100', lines)
+
+class GeoQrTests(TestCase):
+
+    def test_geo_qr(self):
+        qr = GeoQr('40.71280', '-74.0060', 'New York')
+        self.assertEqual(qr.content, 'geo:40.7128,-74.006')
+        self.assertEqual(qr.filename, '40.7128,-74.006_geo')
+        self.assertEqual(
+            [line['text'] for line in qr._caption],
+            ['New York', '40.7128, -74.006']
+        )
+        self.assertEqual(len(GeoQr('0', '0')._caption), 1)
+        self.assertIsInstance(qr.qr_complete, PIL.Image.Image)
+
+    def test_geo_normalize(self):
+        # Confirm equivalent coordinates normalize to the same payload
+        payloads = [
+            normalize_payload({'type': 'geo-qr', 'latitude': lat, 'longitude': lon})
+            for lat, lon in (('+40.70', '-0.0'), ('40.7', '0'), (' 40.700000001 ', '0.00'),
+                             ('40.7', '-0.00000001'))
+        ]
+        self.assertEqual(payloads[0], payloads[1])
+        self.assertEqual(payloads[0], payloads[2])
+        self.assertEqual(payloads[0], payloads[3])
+        self.assertEqual(payloads[0]['latitude'], '40.7')
+        self.assertEqual(payloads[0]['longitude'], '0')
+
+        # Confirm coordinates out of range rejected
+        for lat, lon, field in (('91', '0', 'latitude'), ('0', '180.5', 'longitude'),
+                                ('north', '0', 'latitude'), ('1e3', '0', 'latitude')):
+            with self.assertRaises(PayloadError) as context:
+                normalize_payload({'type': 'geo-qr', 'latitude': lat, 'longitude': lon})
+            self.assertEqual(context.exception.field, field)
+        self.assertEqual(
+            str(context.exception), 'latitude must be decimal degrees between -90 and 90'
+        )
+
+
+class CliTests(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.out = os.path.join(self.tempdir, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_batch_csv(self):
+        path = os.path.join(self.tempdir, 'contacts.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('first_name,lastName,phone,email\n')
+            file.write('John,Doe,212-555-1234,john.doe@hotmail.com\n')
+            file.write('Jane,Doe,212-555-4321,jane.doe@hotmail.com\n')
+
+        # Confirm 1 file written per row with Qr.save filename
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertEqual(cli_main(['batch', path, '--type', 'contact', '--out', self.out]), 0)
+        self.assertEqual(
+            sorted(os.listdir(self.out)),
+            ['Jane-Doe_contact.png', 'John-Doe_contact.png']
+        )
+        self.assertIn('Rendered 2, skipped 0 existing, failed 0', stdout.getvalue())
+
+        # Run again, confirm existing files skipped (resume)
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            cli_main(['batch', path, '--type', 'contact', '--out', self.out])
+        self.assertIn('Rendered 0, skipped 2 existing, failed 0', stdout.getvalue())
+
+    def test_batch_jsonl(self):
+        path = os.path.join(self.tempdir, 'rooms.jsonl')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('{"ssid": "Room 1", "password": "hunter2"}\n\n')
+            file.write('{"url": "https://jamedeus.com", "type": "link-qr"}\n')
+            file.write('{"ssid": "Missing password"}\n')
+
+        # Confirm returns error code when a row fails, other rows still rendered
+        with patch('sys.stdout', new_callable=io.StringIO), \
+             patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            self.assertEqual(cli_main(['batch', path, '--type', 'wifi', '--out', self.out]), 1)
+        self.assertEqual(
+            sorted(os.listdir(self.out)),
+            ['Room 1_Wifi_QR.png', 'jamedeus.com_QR.png']
+        )
+        self.assertIn("Row 3: PayloadError: password is required", stderr.getvalue())
+
+    def test_batch_malformed_rows(self):
+        csv_path = os.path.join(self.tempdir, 'contacts.csv')
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write('firstName,lastName,phone,email\n')
+            file.write('John,Doe,212-555-1234,john.doe@hotmail.com,extra\n')
+            file.write('Jane,Doe,212-555-4321,jane.doe@hotmail.com\n')
+        jsonl_path = os.path.join(self.tempdir, 'rooms.jsonl')
+        with open(jsonl_path, 'w', encoding='utf-8') as file:
+            file.write('{"ssid": "Room 1", "password": \n')
+            file.write('["Room 2", "hunter2"]\n')
+            file.write('{"ssid": "Room 3", "password": "hunter2"}\n')
+
+        # Confirm malformed rows reported as failed, other rows still rendered
+        for path, qr_type, errors, filename in (
+            (csv_path, 'contact', ['Row 1: ValueError: Row has 1 more columns than the header'],
+             'Jane-Doe_contact.png'),
+            (jsonl_path, 'wifi', ['Row 1: JSONDecodeError: Expecting value',
+                                  'Row 2: ValueError: Expected JSON object, got list'],
+             'Room 3_Wifi_QR.png')
+        ):
+            with patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                 patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                self.assertEqual(cli_main(['batch', path, '--type', qr_type, '--out', self.out]), 1)
+            for error in errors:
+                self.assertIn(error, stderr.getvalue())
+            self.assertIn(f'failed {len(errors)}', stdout.getvalue())
+            self.assertIn(filename, os.listdir(self.out))
+
+    def test_batch_same_filename(self):
+        path = os.path.join(self.tempdir, 'contacts.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('firstName,lastName,phone,email\n')
+            file.write('John,Doe,212-555-1234,john.doe@hotmail.com\n')
+            file.write('John,Doe,212-555-4321,john.doe@hotmail.com\n')
+            file.write('john,doe,212-555-1234,John.Doe@hotmail.com\n')
+
+        # Confirm different contact with same name gets suffix in row order,
+        # row identical to an earlier row (after normalizing) is not rendered
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            cli_main(['batch', path, '--type', 'contact', '--out', self.out, '-j', '2'])
+        self.assertEqual(
+            sorted(os.listdir(self.out)),
+            ['John-Doe_contact.png', 'John-Doe_contact_2.png']
+        )
+        self.assertIn('Rendered 2, skipped 0 existing, 1 duplicate, failed 0', stdout.getvalue())
+
+        # Confirm resume assigns the same names (both skipped)
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            cli_main(['batch', path, '--type', 'contact', '--out', self.out, '-j', '2'])
+        self.assertIn('Rendered 0, skipped 2 existing, 1 duplicate', stdout.getvalue())
+
+    def test_batch_svg(self):
+        path = os.path.join(self.tempdir, 'links.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('url,text\nhttps://jamedeus.com,Homepage\n')
+
+        with patch('sys.stdout', new_callable=io.StringIO):
+            cli_main(['batch', path, '--type', 'link', '--out', self.out, '--kind', 'svg'])
+        self.assertEqual(os.listdir(self.out), ['jamedeus.com_QR.svg'])
+
+    def test_layouts(self):
+        path = os.path.join(self.tempdir, 'links.csv')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('url,text\nhttps://jamedeus.com,Homepage\n')
+
+        # Confirm warm file has layout of each caption row (text and url) at each size
+        out = os.path.join(self.tempdir, 'layouts.json')
+        layout_cache.clear()
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            args = ['layouts', path, '--type', 'link', '--out', out, '--sizes', '100', '500']
+            self.assertEqual(cli_main(args), 0)
+        self.assertIn('Saved 4 layouts', stdout.getvalue())
+        self.assertEqual(LayoutCache().load(out), 4)
@@ -0,0 +1,144 @@
+'''Subclass of Qr for generating vCard 3.0 contact QR codes.'''
+
+import re
+
+from qr import Qr, Field
+
+
+# Optional vCard properties: details key (same as frontend field), property
+# name, and whether the value is text (escaped) or a URI (written as is)
+_PROPERTIES = (
+    ('organization', 'ORG', True),
+    ('title', 'TITLE', True),
+    ('phone', 'TEL;TYPE=CELL', True),
+    ('email', 'EMAIL;TYPE=INTERNET', True),
+    ('url', 'URL', False)
+)
+
+
+# URI values are written as is, a line break would start a new property
+_URI = re.compile(r'[^\x00-\x20\x7f]+')
+
+
+def _escape(value):
+    '''Escapes vCard text value (backslash, comma, semicolon, line breaks).'''
+    return (
+        value.replace('\\', '\\\\')
+        .replace(',', '\\,')
+        .replace(';', '\\;')
+        .replace('\r\n', '\\n')
+        .replace('\r', '\\n')
+        .replace('\n', '\\n')
+    )
+
+
+def _uri(value):
+    '''Returns URI value with whitespace and control characters removed.'''
+    return re.sub(r'[\x00-\x20\x7f]', '', value)
+
+
+class VCardQr(Qr):
+    '''Subclass of Qr for generating vCard 3.0 contact QR codes.
+
+    Generates a contact QR code image containing a vCard with first and last
+    name plus any of organization, job title, phone number, email address, and
+    URL (details dict, keys from _PROPERTIES). Unlike ContactQr (MECARD) names
+    are not capitalized and every field except the name is optional. A text
+    caption with the same details is added below the QR code.
+
+    The image with caption can be accessed at the qr_complete attribute.
+    The image with no caption can be accessed at the qr_image attribute.
+    Both are generated the first time they are accessed. Optional size (width
+    in pixels), dpi and encoding keyword args are passed to Qr.
+    '''
+
+    type_key = 'vcard-qr'
+    fields = (
+        Field('firstName', 64),
+        Field('lastName', 64),
+        Field('organization', 128, optional=True),
+        Field('title', 64, optional=True),
+        Field('phone', 32, optional=True),
+        Field('email', 254, optional=True),
+        Field('url', 2048, optional=True, pattern=_URI,
+              description='a URL without spaces or control characters')
+    )
+    cost = 1.5
+    template = {
+        'type': 'vcard-qr',
+        'firstName': 'John',
+        'lastName': 'Doe',
+        'organization': 'Acme',
+        'title': 'Engineer',
+        'phone': '212-555-1234',
+        'email': 'john.doe@hotmail.com',
+        'url': 'https://jamedeus.com'
+    }
+
+    @classmethod
+    def normalize(cls, data):
+        '''Returns dict of constructor args from validated frontend payload.'''
+
+        # Blank optional fields are left out (same as missing)
+        details = {
+            key: data[key].strip()
+            for key, _, _ in _PROPERTIES
+            if data.get(key) and data[key].strip()
+        }
+        if 'email' in details:
+            details['email'] = details['email'].lower()
+        return {
+            'first_name': data['firstName'].strip(),
+            'last_name': data['lastName'].strip(),
+            'details': details
+        }
+
+    def __init__(self, first_name, last_name, details=None, **kwargs):
+        super().__init__(**kwargs)
+
+        self.first_name = first_name.strip()
+        self.last_name = last_name.strip()
+        self.details = {
+            key: value.strip() for key, value in (details or {}).items() if value.strip()
+        }
+
+        # Set attribute for inherited save method
+        self.filename = f"{self.first_name}-{self.last_name}_vcard"
+
+    @property
+    def content(self):
+        '''vCard 3.0 string with contact info from class attributes.'''
+
+        lines = [
+            'BEGIN:VCARD',
+            'VERSION:3.0',
+            f'N:{_escape(self.last_name)};{_escape(self.first_name)};;;',
+            f'FN:{_escape(self.first_name)} {_escape(self.last_name)}'
+        ]
+        for key, name, text in _PROPERTIES:
+            if key in self.details:
+                value = self.details[key]
+                lines.append(f'{name}:{_escape(value) if text else _uri(value)}')
+        lines.append('END:VCARD')
+
+        # vCard lines end with CRLF (RFC 2425)
+        return '\r\n'.join(lines) + '\r\n'
+
+    def _generate_caption(self):
+        '''Returns list of caption dicts used by Qr.add_text method.'''
+
+        # Create name string, get font size
+        name = f"{self.first_name} {self.last_name}"
+        name_font = self._get_font(name, self._SANS_FONT_BOLD, self._scaled(42))
+        caption = [{'text': name, 'font': name_font}]
+
+        # Job title + organization, email, and phone below name (same size as
+        # ContactQr info, skipped if the vCard only contains a name)
+        details = self.details
+        role = ', '.join(filter(None, (details.get('title'), details.get('organization'))))
+        info = '\n'.join(filter(None, (role, details.get('email'), details.get('phone'))))
+        if info:
+            info_size = max(name_font.size - self._scaled(6), 1)
+            caption.append({'text': info, 'font': self._get_font(info, self._SANS_FONT, info_size)})
+
+        return caption
@@ -1,8 +1,6 @@
 '''Subclass of Qr for generating wifi network QR codes.'''
 
-import segno
-
-from qr import Qr
+from qr import Qr, Field
 
 
 class WifiQr(Qr):
@@ -13,10 +11,31 @@ class WifiQr(Qr):
 
     The image with caption can be accessed at the qr_complete attribute.
     The image with no caption can be accessed at the qr_image attribute.
+    Both are generated the first time they are accessed. Optional size (width
+    in pixels), dpi and encoding keyword args are passed to Qr.
     """
 
-    def __init__(self, ssid, password):
-        super().__init__()
+    type_key = 'wifi-qr'
+    fields = (
+        Field('ssid', 32),
+        Field('password', 64)
+    )
+    secret = True
+    cost = 0.7
+    template = {'type': 'wifi-qr', 'ssid': 'AzureDiamond', 'password': 'hunter2'}
+
+    @classmethod
+    def normalize(cls, data):
+        '''Returns dict of constructor args from validated frontend payload.'''
+
+        # Case is significant for SSID and password, only strip
+        return {
+            'ssid': data['ssid'].strip(),
+            'password': data['password'].strip()
+        }
+
+    def __init__(self, ssid, password, **kwargs):
+        super().__init__(**kwargs)
 
         self.ssid = ssid.strip()
         self.password = password.strip()
@@ -24,12 +43,10 @@ class WifiQr(Qr):
         # Set attribute for inherited save method
         self.filename = f"{self.ssid}_Wifi_QR"
 
-        # Create QR code
-        self.generate()
-
-    def _generate_qr_code(self):
-        '''Returns segno instance with wifi credentials from class attributes.'''
-        return segno.make(f"WIFI:T:WPA;S:{self.ssid};P:{self.password};;", micro=False)
+    @property
+    def content(self):
+        '''WIFI string with credentials from class attributes.'''
+        return f"WIFI:T:WPA;S:{self.ssid};P:{self.password};;"
 
     def _generate_caption(self):
         '''Returns list of caption dicts used by Qr.add_text method.'''
@@ -54,7 +71,7 @@ class WifiQr(Qr):
             ssid = f"SSID: {' '*padding_front}{self.ssid}{' '*padding}"
             password = f"PASS: {self.password}"
 
-        font = self._get_font(ssid, self._MONO_FONT, 64)
+        font = self._get_font(ssid, self._MONO_FONT, self._scaled(64))
 
         # List of dicts
         # Each dict contains text + font for 1 line under QR image
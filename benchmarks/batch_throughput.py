@@ -0,0 +1,51 @@
+'''Reports batch render throughput (codes/sec) for each process pool size.
+
+Usage: python3 benchmarks/batch_throughput.py [number of codes]
+'''
+
+import os
+import sys
+import time
+
+from common import print_table
+
+from batch import create_executor, render_batch
+from qr_types import normalize_payload
+
+
+def contact_payloads(count):
+    '''Returns list of count unique normalized contact payloads.'''
+    return [
+        normalize_payload({
+            'type': 'contact-qr',
+            'firstName': f'First{i}',
+            'lastName': f'Last{i}',
+            'phone': f'212-555-{i:04d}',
+            'email': f'first{i}.last{i}@example.com'
+        })
+        for i in range(count)
+    ]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    payloads = contact_payloads(count)
+
+    rows = []
+    worker_counts = sorted({1, 2, 4, 8, os.cpu_count()})
+    for workers in worker_counts:
+        with create_executor(workers) as executor:
+            # Wait for workers to start and warm fonts before timing
+            render_batch(payloads[:workers], executor, workers * 2)
+
+            start = time.perf_counter()
+            render_batch(payloads, executor, workers * 2)
+            elapsed = time.perf_counter() - start
+
+        rows.append((workers, count, f'{elapsed:.2f}', f'{count / elapsed:.1f}'))
+
+    print_table(('workers', 'codes', 'seconds', 'codes/sec'), rows)
+
+
+if __name__ == '__main__':
+    main()
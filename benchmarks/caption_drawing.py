@@ -0,0 +1,75 @@
+'''Compares caption drawing with ImageDraw.text and with glyph atlases.
+
+Reports time to draw the caption (Qr._add_text, fonts already sized) and a
+full render (new instance each time, layouts and glyphs already cached), and
+confirms both produce the same image (differing pixels and largest difference
+in any channel).
+
+Usage: python3 benchmarks/caption_drawing.py
+'''
+
+from PIL import ImageChops
+
+from common import time_call, print_table
+
+import glyph_atlas
+from contact_qr import ContactQr
+from wifi_qr import WifiQr
+from link_qr import LinkQr
+
+
+def compare_images(first, second):
+    '''Returns tuple with number of pixels that differ and largest difference.'''
+    histogram = ImageChops.difference(first, second).convert('L').histogram()
+    changed = sum(histogram[1:])
+    return changed, max((value for value, count in enumerate(histogram) if count), default=0)
+
+
+def main():
+    samples = {
+        'contact': lambda: ContactQr('John', 'Doe', '(212) 555-1234', 'john.doe@hotmail.com'),
+        'contact long': lambda: ContactQr(
+            'Bartholomew', 'Vanderbilt-Featherstonehaugh', '+1 (212) 555-1234',
+            'bartholomew.vanderbilt-featherstonehaugh@hotmail.com'
+        ),
+        'contact 2000px': lambda: ContactQr(
+            'John', 'Doe', '(212) 555-1234', 'john.doe@hotmail.com', size=2000
+        ),
+        'wifi': lambda: WifiQr('mywifi', 'hunter2'),
+        'link': lambda: LinkQr('https://jamedeus.com', 'Homepage')
+    }
+
+    rows = []
+    for name, factory in samples.items():
+        qr = factory()
+
+        glyph_atlas.ENABLED = False
+        expected = qr._add_text()
+        text = time_call(qr._add_text, repeat=100)
+        text_render = time_call(lambda: factory().qr_complete, repeat=50)
+
+        glyph_atlas.ENABLED = True
+        changed, largest = compare_images(expected, qr._add_text())
+        atlas = time_call(qr._add_text, repeat=100)
+        atlas_render = time_call(lambda: factory().qr_complete, repeat=50)
+
+        rows.append((
+            name,
+            f'{text:.3f}',
+            f'{atlas:.3f}',
+            f'{text / atlas:.1f}x',
+            f'{text_render:.3f}',
+            f'{atlas_render:.3f}',
+            changed,
+            largest
+        ))
+
+    print_table(
+        ('type', 'text ms', 'atlas ms', 'speedup', 'text render ms', 'atlas render ms',
+         'changed px', 'max diff'),
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+'''Compares legacy 2-pass Qr._add_text with single-pass layout.
+
+Reports Image allocations, text measurements, and time per render, and
+confirms both produce identical images.
+
+Usage: python3 benchmarks/caption_layout.py
+'''
+
+from unittest.mock import patch
+
+from PIL import Image, ImageDraw
+
+from common import time_call, print_table
+
+from contact_qr import ContactQr
+from wifi_qr import WifiQr
+from link_qr import LinkQr
+
+
+def legacy_add_text(qr):
+    '''Original Qr._add_text implementation (measures every row twice).'''
+    add_height = 0
+    draw = ImageDraw.Draw(qr.qr_image)
+    for row in qr._caption:
+        _, _, row_width, row_height = draw.textbbox(xy=(0, 0), text=row['text'], font=row['font'])
+        add_height += row_height
+
+    text_area = Image.new('RGB', (qr.qr_image.width, add_height), color='white')
+    result = Image.new('RGB', (qr.qr_image.width, qr.qr_image.height + text_area.height))
+    result.paste(qr.qr_image, (0, 0))
+    result.paste(text_area, (0, qr.qr_image.height))
+    draw = ImageDraw.Draw(result)
+
+    used_height = 0
+    for row in qr._caption:
+        _, _, row_width, row_height = draw.textbbox(xy=(0, 0), text=row['text'], font=row['font'])
+        x = (qr.qr_image.width - row_width) // 2
+        y = qr.qr_image.height + used_height - 24
+        used_height += row_height
+        draw.text((x, y), row['text'], font=row['font'], align='center', fill=(0, 0, 0))
+    return result
+
+
+def count_calls(func):
+    '''Returns (Image.new calls, textbbox calls) made by func.'''
+    with patch('PIL.Image.new', wraps=Image.new) as new, \
+         patch.object(ImageDraw.ImageDraw, 'textbbox', autospec=True,
+                      side_effect=ImageDraw.ImageDraw.textbbox) as textbbox:
+        func()
+    return new.call_count, textbbox.call_count
+
+
+def main():
+    samples = {
+        'contact': lambda: ContactQr('John', 'Doe', '(212) 555-1234', 'john.doe@hotmail.com'),
+        'wifi': lambda: WifiQr('mywifi', 'hunter2'),
+        'link': lambda: LinkQr('https://jamedeus.com', 'Homepage')
+    }
+
+    rows = []
+    for name, factory in samples.items():
+        qr = factory()
+        assert qr.qr_complete.tobytes() == legacy_add_text(qr).tobytes()
+
+        # Fonts already sized (same as real render), only _add_text differs
+        old_allocs, old_measures = count_calls(lambda: legacy_add_text(qr))
+        new_allocs, new_measures = count_calls(qr._add_text)
+        old = time_call(lambda: legacy_add_text(qr), repeat=100)
+        new = time_call(qr._add_text, repeat=100)
+
+        rows.append((
+            name,
+            old_allocs,
+            new_allocs,
+            old_measures,
+            new_measures,
+            f'{old:.3f}',
+            f'{new:.3f}',
+            f'{old - new:.3f}'
+        ))
+
+    print_table(
+        ('type', 'old images', 'new images', 'old bbox', 'new bbox',
+         'old ms', 'new ms', 'saved ms'),
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+'''Shared helpers for benchmark scripts.
+
+Benchmarks are standalone scripts run from the repository root, for example:
+
+    python3 benchmarks/font_sizing.py
+'''
+
+import os
+import sys
+import time
+import statistics
+
+# Backend modules use flat imports (same as backend/app.py)
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+
+
+def time_call(func, repeat=20):
+    '''Calls func repeat times, returns median duration in milliseconds.'''
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def percentile(values, percent):
+    '''Returns value at percent (0-100) of sorted values (nearest rank).'''
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def print_table(headers, rows):
+    '''Prints list of row tuples as aligned columns under headers.'''
+    widths = [
+        max(len(str(value)) for value in column)
+        for column in zip(headers, *rows)
+    ]
+    print('  '.join(str(h).rjust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print('  '.join(str(v).rjust(w) for v, w in zip(row, widths)))
@@ -0,0 +1,77 @@
+'''Compares time to encode QR codes (segno.make) with each encoding option.
+
+By default segno finds the smallest version that fits, then scores all 8 mask
+patterns (each is applied to the full matrix and evaluated) and keeps the
+best. A fixed mask only applies 1 pattern, a fixed version skips the version
+search, min_version is looked up in the precomputed capacity table first (see
+qr.Qr._generate_qr_code). Fixed mask and version use the values segno picked
+by default, so every option produces the same symbol. The last column is a
+repeat render of the same content (qr.encode cache hit).
+
+Usage: python3 benchmarks/encode_options.py [--repeat 50]
+'''
+
+import argparse
+
+import segno
+
+from common import time_call, print_table
+
+from qr import Encoding, encode
+from link_qr import LinkQr
+
+
+# Content name: encoded string (longer content needs a larger version)
+CONTENTS = {
+    'wifi': 'WIFI:S:Office;T:WPA;P:hunter2;;',
+    'contact': 'MECARD:N:Doe,John;TEL:2125551234;EMAIL:john.doe@hotmail.com;',
+    'link 256': 'https://jamedeus.com/' + 'x' * 235,
+    'link 1024': 'https://jamedeus.com/' + 'x' * 1003,
+    'link 1200': 'https://jamedeus.com/' + 'x' * 1179
+}
+
+
+def encode_uncached(content, encoding):
+    '''Returns function that encodes content through Qr._generate_qr_code with
+    encoding (includes min_version lookup), encode cache cleared each call.
+    '''
+    qr = LinkQr(content, encoding=encoding)
+
+    def run():
+        encode.cache_clear()
+        return qr._generate_qr_code()  # pylint: disable=protected-access
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark encoding options')
+    parser.add_argument('--repeat', type=int, default=50, help='Encodes per option')
+    args = parser.parse_args()
+
+    rows = []
+    for name, content in CONTENTS.items():
+        default = segno.make(content, micro=False)
+        version, mask = default.version, default.mask
+        timings = (
+            time_call(lambda: segno.make(content, micro=False), args.repeat),
+            time_call(lambda: segno.make(content, error='H', micro=False), args.repeat),
+            time_call(lambda: segno.make(content, mask=mask, micro=False), args.repeat),
+            time_call(lambda: segno.make(content, version=version, micro=False), args.repeat),
+            time_call(
+                lambda: segno.make(content, version=version, mask=mask, micro=False), args.repeat
+            ),
+            time_call(encode_uncached(content, Encoding(min_version=version)), args.repeat),
+            time_call(lambda: LinkQr(content).qr_raw, args.repeat)
+        )
+        rows.append((name, version, *(f'{ms:.3f}' for ms in timings)))
+
+    print('ms per encode')
+    print_table(
+        ('content', 'version', 'default', 'error H', 'mask', 'version',
+         'version + mask', 'min_version', 'cached'),
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''Compares legacy linear font sizing with binary search sizing (cold: no
+fonts or layouts cached) and layout cache hits (warm).
+
+Usage: python3 benchmarks/font_sizing.py
+'''
+
+from PIL import ImageDraw, ImageFont
+
+from common import time_call, print_table
+
+from qr import Qr
+from layout_cache import layout_cache, load_font
+from link_qr import LinkQr
+
+
+def legacy_get_font(qr, text, font_path, max_size):
+    '''Original Qr._get_font implementation (1 point per step, no cache).'''
+    draw = ImageDraw.Draw(qr.qr_image)
+    max_width = int(qr.qr_image.width * 0.90)
+    font = ImageFont.truetype(font_path, max_size)
+    while draw.textbbox((0, 0), text, font)[2] > max_width and max_size > 1:
+        max_size -= 1
+        font = ImageFont.truetype(font_path, max_size)
+    return font
+
+
+def main():
+    qr = LinkQr('https://jamedeus.com')
+
+    rows = []
+    for length in (5, 10, 25, 50, 100, 250, 500):
+        text = 'x' * length
+
+        legacy = time_call(lambda: legacy_get_font(qr, text, Qr._MONO_FONT, 72))
+        load_font.cache_clear()
+        layout_cache.clear()
+        cold = time_call(lambda: qr._get_font(text, Qr._MONO_FONT, 72), repeat=1)
+        warm = time_call(lambda: qr._get_font(text, Qr._MONO_FONT, 72))
+
+        rows.append((
+            length,
+            legacy_get_font(qr, text, Qr._MONO_FONT, 72).size,
+            qr._get_font(text, Qr._MONO_FONT, 72).size,
+            f'{legacy:.3f}',
+            f'{cold:.3f}',
+            f'{warm:.3f}',
+            f'{legacy / warm:.1f}x'
+        ))
+
+    print_table(
+        ('chars', 'old size', 'new size', 'old ms', 'new cold ms', 'new warm ms', 'speedup'),
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
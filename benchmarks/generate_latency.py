@@ -0,0 +1,97 @@
+'''Reports /generate p50/p99 latency for each combination of response options.
+
+Every request uses a unique payload so the render cache never hits. The first
+row is the original /generate response (both variants saved with PIL default
+PNG settings and base64 encoded, no render cache) served from a benchmark-only
+route, so every row uses the same renderer and only the response differs.
+
+Usage: python3 benchmarks/generate_latency.py [requests per option set]
+'''
+
+import io
+import os
+import sys
+import time
+import base64
+
+from flask import request, jsonify
+
+from common import percentile, print_table
+
+# Only log errors (request logs would be included in timings)
+os.environ.setdefault('QR_LOG_LEVEL', 'ERROR')
+
+# pylint: disable=wrong-import-position
+from app import app
+from qr_types import normalize_payload, build_qr
+# pylint: enable=wrong-import-position
+
+
+def img_to_base64_string(img):
+    '''Original app.py implementation (PIL default PNG settings).'''
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format="PNG")
+    return base64.b64encode(img_buffer.getvalue()).decode("utf-8")
+
+
+def original_generate():
+    '''Original /generate response: renders both variants, no cache.'''
+    qr = build_qr(normalize_payload(request.get_json()))
+    return jsonify({
+        'caption': img_to_base64_string(qr.qr_complete),
+        'no_caption': img_to_base64_string(qr.qr_image)
+    })
+
+
+app.add_url_rule('/benchmark/original', view_func=original_generate, methods=['POST'])
+
+
+# Endpoint and option sets sent with each request (first is the original response)
+OPTIONS = {
+    'both variants (original)': ('/benchmark/original', {}),
+    'both variants': ('/generate', {}),
+    'caption only': ('/generate', {'variants': ['caption']}),
+    'caption + crop': ('/generate', {'variants': ['caption'], 'crop': True}),
+    'caption + crop, level 1': (
+        '/generate', {'variants': ['caption'], 'crop': True, 'compress_level': 1}
+    ),
+    'caption + crop, level 0': (
+        '/generate', {'variants': ['caption'], 'crop': True, 'compress_level': 0}
+    ),
+    'both, optimize': ('/generate', {'optimize': True})
+}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    client = app.test_client()
+
+    rows = []
+    for name, (endpoint, options) in OPTIONS.items():
+        durations = []
+        size = 0
+        for i in range(count):
+            payload = {
+                'type': 'link-qr',
+                'url': f'https://jamedeus.com/{name}/{i}',
+                'text': 'Homepage',
+                **options
+            }
+
+            start = time.perf_counter()
+            response = client.post(endpoint, json=payload)
+            durations.append((time.perf_counter() - start) * 1000)
+            size += len(response.data)
+
+        rows.append((
+            name,
+            f'{percentile(durations, 50):.2f}',
+            f'{percentile(durations, 99):.2f}',
+            f'{size / count / 1024:.1f}'
+        ))
+
+    print_table(('options', 'p50 ms', 'p99 ms', 'response KiB'), rows)
+
+
+if __name__ == '__main__':
+    main()
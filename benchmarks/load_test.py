@@ -0,0 +1,156 @@
+'''Compares sync and async (gthread + render process pool) serving modes.
+
+Starts gunicorn with backend/gunicorn.conf.py once per mode, sends a mix of
+slow renders (large link QR codes with long captions, never cached) and
+requests for the frontend page from concurrent clients, then reports latency
+and throughput for each endpoint.
+
+Usage: python3 benchmarks/load_test.py [--duration 20] [--clients 16]
+'''
+
+import os
+import time
+import json
+import socket
+import argparse
+import itertools
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+
+from common import BACKEND_DIR, percentile, print_table
+
+
+# Environment variables for each serving mode
+MODES = {
+    'sync': {
+        'QR_WORKER_CLASS': 'sync'
+    },
+    'async': {
+        'QR_WORKER_CLASS': 'gthread',
+        'QR_THREADS': '8',
+        'QR_RENDER_MODE': 'process'
+    }
+}
+
+
+def free_port():
+    '''Returns unused TCP port.'''
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(url, timeout=30):
+    '''Blocks until url responds or timeout expires.'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f'Server did not start: {url}')
+
+
+def request(url, payload=None):
+    '''Sends GET (or POST if payload), returns (status code, seconds).'''
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    return status, time.perf_counter() - start
+
+
+def run_load(base_url, duration, clients, render_ratio):
+    '''Runs clients threads for duration seconds, returns dict mapping endpoint
+    name to list of (status, seconds) tuples.
+    '''
+    results = {'render': [], 'index': []}
+    counter = itertools.count()
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            i = next(counter)
+            # Spread renders evenly through the request sequence
+            if int((i + 1) * render_ratio) > int(i * render_ratio):
+                # Unique long URL so every render misses the cache (~version 40)
+                status, seconds = request(f'{base_url}/generate', {
+                    'type': 'link-qr',
+                    'url': f'https://example.com/{i}/' + 'x' * 2200,
+                    'text': 'Benchmark link with a long caption ' * 3
+                })
+                name = 'render'
+            else:
+                status, seconds = request(f'{base_url}/')
+                name = 'index'
+            with lock:
+                results[name].append((status, seconds))
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('--duration', type=float, default=20, help='Seconds per mode')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--workers', type=int, default=4, help='Gunicorn workers')
+    parser.add_argument('--render-ratio', type=float, default=0.5,
+                        help='Fraction of requests that render a QR code')
+    parser.add_argument('--mode', action='append', choices=MODES, help='Modes to test')
+    args = parser.parse_args()
+
+    rows = []
+    for mode in args.mode or list(MODES):
+        port = free_port()
+        env = {
+            **os.environ,
+            **MODES[mode],
+            'QR_BIND': f'127.0.0.1:{port}',
+            'QR_WORKERS': str(args.workers)
+        }
+        with subprocess.Popen(
+            ['gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+            cwd=BACKEND_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        ) as server:
+            try:
+                base_url = f'http://127.0.0.1:{port}'
+                wait_for_server(base_url)
+                results = run_load(base_url, args.duration, args.clients, args.render_ratio)
+            finally:
+                server.terminate()
+
+        for name, samples in results.items():
+            durations = [seconds * 1000 for status, seconds in samples if status == 200]
+            rejected = sum(1 for status, _ in samples if status in (503, 504))
+            rows.append((
+                mode,
+                name,
+                len(samples),
+                f'{len(durations) / args.duration:.1f}',
+                f'{percentile(durations, 50):.1f}' if durations else '-',
+                f'{percentile(durations, 99):.1f}' if durations else '-',
+                rejected
+            ))
+
+    print_table(('mode', 'endpoint', 'requests', 'ok/sec', 'p50 ms', 'p99 ms', '503/504'), rows)
+
+
+if __name__ == '__main__':
+    main()
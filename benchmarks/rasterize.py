@@ -0,0 +1,40 @@
+'''Compares segno PNG round-trip with direct matrix rasterization per version.
+
+Usage: python3 benchmarks/rasterize.py
+'''
+
+import io
+
+import segno
+from PIL import Image
+
+from common import time_call, print_table
+
+from link_qr import LinkQr
+
+
+def png_round_trip(qr_raw, size=500):
+    '''Original Qr._generate_qr_image implementation (encode + decode PNG).'''
+    scale = int(size / qr_raw.symbol_size(border=3)[0])
+    image = io.BytesIO()
+    qr_raw.save(image, scale=scale, border=3, kind='png')
+    image = Image.open(image)
+    image.load()
+    return image
+
+
+def main():
+    qr = LinkQr('https://jamedeus.com')
+
+    rows = []
+    for version in range(1, 41):
+        qr.qr_raw = segno.make('benchmark', version=version, micro=False)
+        old = time_call(lambda: png_round_trip(qr.qr_raw))
+        new = time_call(qr._generate_qr_image)
+        rows.append((version, f'{old:.3f}', f'{new:.3f}', f'{old - new:.3f}', f'{old / new:.1f}x'))
+
+    print_table(('version', 'png ms', 'direct ms', 'saved ms', 'speedup'), rows)
+
+
+if __name__ == '__main__':
+    main()
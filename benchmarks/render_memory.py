@@ -0,0 +1,148 @@
+'''Reports memory used by sequential renders (each QR code rendered with and
+without caption, unique payload per render) when every intermediate image is
+kept until the render returns and each PNG is encoded into a new buffer,
+compared to render.render_images (images released once encoded, pooled
+encode buffers) with and without reuse of freed image blocks.
+
+Each mode runs in a fresh interpreter. Reports resident memory (RSS, includes
+PIL image memory) before rendering, highest sample, after the last render,
+and after MemoryBudget.trim (what a worker over QR_MEMORY_BUDGET frees), and
+peak Python heap traced by tracemalloc during the first --traced renders
+(tracing makes renders several times slower, PIL image memory is not traced).
+
+--threads renders that many payloads at once (burst of concurrent requests
+on 1 gthread worker) instead of 1 at a time.
+
+Usage: python3 benchmarks/render_memory.py [--renders 10000] [--size 500] [--threads 1]
+'''
+
+import io
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from common import print_table, BACKEND_DIR
+
+from memory import MemoryBudget, resident_memory, configure_image_blocks, IMAGE_BLOCKS
+from qr_types import build_qr, normalize_payload
+from render import render_images
+
+
+# Mode name: (keep intermediate images, image blocks kept for reuse)
+MODES = {
+    'retained': (True, 0),
+    'released': (False, 0),
+    'released + blocks': (False, IMAGE_BLOCKS)
+}
+
+
+def render_retained(payload, size):
+    '''Renders both variants keeping qr_image and qr_complete alive until
+    both are encoded, each PNG written to a new BytesIO.
+    '''
+    qr = build_qr(payload, size)
+    images = {}
+    for variant, image in (('caption', qr.qr_complete), ('no_caption', qr.qr_image)):
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', compress_level=6)
+        images[variant] = buffer.getvalue()
+    return images
+
+
+def contact_payload(index):
+    '''Returns normalized contact payload with a unique name and email.'''
+    return normalize_payload({
+        'type': 'contact-qr',
+        'firstName': f'Attendee{index}',
+        'lastName': 'Doe',
+        'phone': '212-555-1234',
+        'email': f'attendee{index}@hotmail.com'
+    })
+
+
+def run_mode(mode, args):
+    '''Runs renders in the current process, prints JSON with ms per render
+    (untraced renders), RSS (MiB) before, highest sample, after, and after
+    trimming, and tracemalloc peak (MiB).
+    '''
+    retained, blocks = MODES[mode]
+    configure_image_blocks(blocks)
+
+    def render(index):
+        if retained:
+            return render_retained(contact_payload(index), args.size)
+        return render_images(contact_payload(index), options={'size': args.size})
+
+    # First render loads fonts and PIL plugins, not counted
+    render(-1)
+    before = highest = resident_memory()
+
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        tracemalloc.start()
+        list(executor.map(render, range(args.traced)))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # Render in chunks of sample renders, RSS read between chunks
+        start = time.perf_counter()
+        for first in range(args.traced, args.renders, args.sample):
+            list(executor.map(render, range(first, min(first + args.sample, args.renders))))
+            highest = max(highest, resident_memory())
+        elapsed = time.perf_counter() - start
+
+    after = resident_memory()
+    print(json.dumps({
+        'ms': elapsed * 1000 / max(1, args.renders - args.traced),
+        'before': before / 1024 / 1024,
+        'highest': max(highest, after) / 1024 / 1024,
+        'after': after / 1024 / 1024,
+        'trimmed': MemoryBudget().trim() / 1024 / 1024,
+        'peak': peak / 1024 / 1024
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark render memory usage')
+    parser.add_argument('--renders', type=int, default=10000, help='Renders per mode')
+    parser.add_argument('--size', type=int, default=500, help='Approximate width in pixels')
+    parser.add_argument('--threads', type=int, default=1, help='Concurrent renders')
+    parser.add_argument('--traced', type=int, default=200, help='Renders traced by tracemalloc')
+    parser.add_argument('--sample', type=int, default=100, help='Renders between RSS samples')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process: run 1 mode and print results
+    if args.mode:
+        run_mode(args.mode, args)
+        return
+
+    rows = []
+    for mode in MODES:
+        result = json.loads(subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--renders', str(args.renders),
+             '--size', str(args.size), '--threads', str(args.threads),
+             '--traced', str(args.traced), '--sample', str(args.sample)],
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout)
+        rows.append((
+            mode,
+            f'{result["ms"]:.2f}',
+            *(f'{result[key]:.1f}' for key in ('before', 'highest', 'after', 'trimmed')),
+            f'{result["peak"]:.2f}'
+        ))
+
+    print(f'{args.renders} renders per mode at size {args.size}, '
+          f'{args.threads} at a time (MiB)')
+    print_table(('mode', 'ms/render', 'RSS before', 'RSS highest', 'RSS after',
+                 'RSS trimmed', 'traced peak'), rows)
+
+
+if __name__ == '__main__':
+    main()
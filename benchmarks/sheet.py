@@ -0,0 +1,76 @@
+'''Compares composing label sheets by pasting each finished QR code image
+(qr_complete) onto an RGB page with sheet.compose_page (QR codes and captions
+drawn straight onto 1 greyscale page).
+
+Reports time per page (single process) and size of the page buffer (PIL
+allocates image memory outside the Python heap, not seen by tracemalloc).
+
+Usage: python3 benchmarks/sheet.py [--dpi 300] [--pages 3]
+'''
+
+import time
+import argparse
+
+from PIL import Image
+
+from common import print_table
+
+from qr_types import normalize_payload
+from sheet import SheetLayout, page_size, cell_size, mm_to_pixels, paginate, fit_qr, compose_page
+
+
+def paste_page(payloads, layout):
+    '''Naive composition: renders qr_complete for each payload and pastes it.'''
+    page = Image.new('RGB', page_size(layout), color='white')
+    width, height = cell_size(layout)
+    margin = mm_to_pixels(layout.margin, layout.dpi)
+    for index, payload in enumerate(payloads):
+        row, column = divmod(index, layout.columns)
+        image = fit_qr(payload, width, height).qr_complete
+        page.paste(image, (
+            margin + column * width + (width - image.width) // 2,
+            margin + row * height + (height - image.height) // 2
+        ))
+    return page
+
+
+def measure(func, pages, layout):
+    '''Returns tuple with ms per page and page buffer size (MiB).'''
+    start = time.perf_counter()
+    for page in pages:
+        image = func(page, layout)
+    elapsed = (time.perf_counter() - start) * 1000 / len(pages)
+    if isinstance(image, tuple):
+        image = image[0]
+    return elapsed, len(image.getbands()) * image.width * image.height / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sheet composition')
+    parser.add_argument('--dpi', type=int, default=300, help='Page resolution')
+    parser.add_argument('--pages', type=int, default=3, help='Pages per method')
+    args = parser.parse_args()
+
+    layout = SheetLayout('a4', 4, 3, 10, args.dpi)
+    payloads = [
+        normalize_payload({
+            'type': 'contact-qr',
+            'firstName': f'Attendee{index}',
+            'lastName': 'Doe',
+            'phone': '212-555-1234',
+            'email': f'attendee{index}@hotmail.com'
+        })
+        for index in range(layout.rows * layout.columns * args.pages)
+    ]
+    pages = paginate(payloads, layout)
+
+    rows = []
+    for name, func in (('paste qr_complete', paste_page), ('compose_page', compose_page)):
+        elapsed, buffer = measure(func, pages, layout)
+        rows.append((name, f'{elapsed:.1f}', f'{elapsed / len(pages[0]):.2f}', f'{buffer:.1f}'))
+
+    print_table(('method', 'ms/page', 'ms/code', 'page MiB'), rows)
+
+
+if __name__ == '__main__':
+    main()
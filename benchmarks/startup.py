@@ -0,0 +1,117 @@
+'''Reports app import time and time to first response with and without
+warm up. Every measurement runs in a fresh interpreter, so nothing is imported
+or cached beforehand (same as a newly started worker).
+
+Usage: python3 benchmarks/startup.py
+'''
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+from common import BACKEND_DIR, print_table
+
+
+# Runs in child process: imports app, times 2 /generate requests with different
+# payloads (second request shows steady state latency)
+FIRST_RESPONSE_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+client = app.test_client()
+timings = []
+for url in ('https://jamedeus.com/first', 'https://jamedeus.com/second'):
+    request_start = time.perf_counter()
+    client.post('/generate', json={'type': 'link-qr', 'url': url, 'text': 'Homepage'})
+    timings.append(time.perf_counter() - request_start)
+print(json.dumps({'import': imported - start, 'first': timings[0], 'second': timings[1]}))
+'''
+
+
+def run_python(args, env):
+    '''Runs python interpreter with args in backend dir with extra env vars
+    (request logs disabled), returns CompletedProcess with captured output.
+    '''
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=BACKEND_DIR,
+        env={**os.environ, 'QR_LOG_LEVEL': 'ERROR', **env},
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+
+def import_times(limit=15):
+    '''Returns list of (module, self ms, cumulative ms) tuples for the slowest
+    modules imported directly by app (reported by python -X importtime), and
+    total ms to import app.
+    '''
+    stderr = run_python(['-X', 'importtime', '-c', 'import app'], {'QR_WARMUP': 'false'}).stderr
+
+    modules = []
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timing = (name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000)
+
+        # Nested imports are indented by 2 spaces per level and listed before
+        # the module that imported them (app is last level 0 module)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            modules.append(timing)
+        elif depth == 0 and timing[0] == 'app':
+            total = timing[2]
+            break
+        elif depth == 0:
+            modules = []
+
+    modules.sort(key=lambda module: module[2], reverse=True)
+    return modules[:limit], total
+
+
+def first_response(warmup):
+    '''Returns dict with import, first request, and second request seconds
+    measured in a new process, plus wall seconds from process start to exit.
+    '''
+    start = time.perf_counter()
+    result = json.loads(
+        run_python(['-c', FIRST_RESPONSE_SCRIPT], {'QR_WARMUP': warmup}).stdout
+    )
+    result['wall'] = time.perf_counter() - start
+    return result
+
+
+def main():
+    modules, total = import_times()
+    print(f'Slowest imports (import app total {total:.1f} ms)\n')
+    print_table(
+        ('module', 'self ms', 'cumulative ms'),
+        [(name, f'{self_ms:.1f}', f'{cumulative:.1f}') for name, self_ms, cumulative in modules]
+    )
+
+    rows = []
+    for warmup in ('false', 'true'):
+        result = first_response(warmup)
+        rows.append((
+            warmup,
+            f"{result['import'] * 1000:.1f}",
+            f"{result['first'] * 1000:.1f}",
+            f"{result['second'] * 1000:.1f}",
+            f"{result['wall'] * 1000:.1f}"
+        ))
+
+    print('\nTime to first response (new process)\n')
+    print_table(
+        ('QR_WARMUP', 'import ms', '1st request ms', '2nd request ms', 'process total ms'),
+        rows
+    )
+
+
+if __name__ == '__main__':
+    main()
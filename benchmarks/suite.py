@@ -0,0 +1,305 @@
+'''Benchmark suite covering every QR type, payload length, output size, and
+output format.
+
+Each case renders a payload with the Qr subclass directly (per-stage timings
+from Qr.stage_timings and peak memory from tracemalloc), then the /generate
+endpoint is timed through the Flask test client (cache misses and hits).
+
+Results are written as JSON. If a baseline file exists every case is compared
+with it and the script exits with status 1 if any case is slower than the
+threshold. Baselines are machine specific, save one on the same machine before
+making changes:
+
+    python3 benchmarks/suite.py --save-baseline
+    (make changes)
+    python3 benchmarks/suite.py
+
+Usage: python3 benchmarks/suite.py [--repeat N] [--filter TEXT] [--output FILE]
+                                   [--baseline FILE] [--save-baseline] [--threshold 0.2]
+'''
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import statistics
+
+import PIL
+import segno
+
+from common import BACKEND_DIR, percentile, print_table
+
+# Only log errors (request logs would be included in endpoint timings)
+os.environ.setdefault('QR_LOG_LEVEL', 'ERROR')
+
+# pylint: disable=wrong-import-position
+from app import app, render_cache
+from qr import encode
+from qr_types import normalize_payload, build_qr
+from render import img_to_png_bytes
+
+
+# Characters in each payload (spread over its text fields, each field is
+# capped at its max length so contact and wifi payloads stop growing, lengths
+# that would repeat the previous payload are skipped), longer payloads use
+# larger versions
+PAYLOAD_LENGTHS = (8, 64, 256, 512)
+
+# QR code types benchmarked (every registered type)
+QR_TYPES = ('contact-qr', 'wifi-qr', 'link-qr', 'vcard-qr', 'geo-qr')
+
+# Output widths (pixels) and formats rendered for each payload
+SIZES = (100, 500, 2000)
+FORMATS = ('png', 'svg')
+
+# Default baseline path (not committed, timings depend on the machine)
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def filler(length, suffix=''):
+    '''Returns length characters of lowercase text ending with suffix.'''
+    text = 'abcdefghijklmnopqrstuvwxyz' * (length // 26 + 1)
+    return text[:max(length - len(suffix), 0)] + suffix
+
+
+def make_payload(qr_type, length, index=0):
+    '''Returns frontend payload for qr_type with about length characters in
+    its text fields (within each field's max length, the url or email field
+    grows). Index is added to the payload so each endpoint request misses the
+    cache.
+    '''
+    suffix = str(index)
+    if qr_type == 'contact-qr':
+        name = min(length // 4, 64)
+        return {
+            'type': qr_type,
+            'firstName': filler(name, suffix),
+            'lastName': filler(name),
+            'phone': '212-555-1234',
+            'email': f'{filler(min(length - 2 * name, 242))}@hotmail.com'
+        }
+    if qr_type == 'wifi-qr':
+        ssid = min(length // 4, 32)
+        return {
+            'type': qr_type,
+            'ssid': filler(ssid, suffix),
+            'password': filler(min(length - ssid, 64))
+        }
+    if qr_type == 'vcard-qr':
+        part = max(length // 8, 1)
+        return {
+            'type': qr_type,
+            'firstName': filler(min(part, 64), suffix),
+            'lastName': filler(min(part, 64)),
+            'organization': filler(min(part, 128)),
+            'title': filler(min(part, 64)),
+            'phone': '212-555-1234',
+            'email': f'{filler(min(part, 242))}@hotmail.com',
+            'url': f'https://jamedeus.com/{filler(min(length - 5 * part, 2027))}'
+        }
+    if qr_type == 'geo-qr':
+        # Content is always 2 coordinates, length only changes the caption
+        return {
+            'type': qr_type,
+            'latitude': f'40.{index:04d}',
+            'longitude': '-74.006',
+            'label': filler(min(length, 128))
+        }
+    return {
+        'type': qr_type,
+        'url': f'https://jamedeus.com/{filler(min(length, 4275), suffix)}',
+        'text': 'Homepage'
+    }
+
+
+def render(payload, size, image_format):
+    '''Renders normalized payload at size in image_format (same stages as
+    render_images caption variant), returns Qr instance. The encode cache is
+    cleared first so every repeat encodes (same work as a unique payload).
+    '''
+    encode.cache_clear()
+    qr = build_qr(payload, size)
+    if image_format == 'svg':
+        qr.to_svg()
+    else:
+        image = qr.qr_complete
+        with qr.time_stage('png'):
+            img_to_png_bytes(image)
+    return qr
+
+
+def bench_render(qr_type, length, size, image_format, repeat):
+    '''Returns result dict for 1 render case: QR version, p50/p99 total ms,
+    median ms per stage, and peak traced memory (KiB) of a single render.
+    '''
+    payload = normalize_payload(make_payload(qr_type, length))
+
+    totals = []
+    stages = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        qr = render(payload, size, image_format)
+        totals.append((time.perf_counter() - start) * 1000)
+        for stage, seconds in qr.stage_timings.items():
+            stages.setdefault(stage, []).append(seconds * 1000)
+
+    # Separate traced render (tracemalloc slows down allocations)
+    tracemalloc.start()
+    render(payload, size, image_format)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'version': str(qr.qr_raw.version),
+        'p50_ms': round(percentile(totals, 50), 3),
+        'p99_ms': round(percentile(totals, 99), 3),
+        'stages_ms': {
+            stage: round(statistics.median(durations), 3) for stage, durations in stages.items()
+        },
+        'peak_kib': round(peak / 1024, 1)
+    }
+
+
+def bench_endpoint(qr_type, length, repeat):
+    '''Returns result dict with p50/p99 ms of /generate requests for unique
+    payloads (cache misses) and the same payload (cache hits).
+    '''
+    client = app.test_client()
+    render_cache.clear()
+
+    misses = []
+    for index in range(repeat):
+        payload = make_payload(qr_type, length, index)
+        start = time.perf_counter()
+        response = client.post('/generate', json=payload)
+        misses.append((time.perf_counter() - start) * 1000)
+
+        # Rejected payload would only time validation
+        if response.status_code != 200:
+            raise ValueError(f'{qr_type} payload rejected: {response.json}')
+
+    hits = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.post('/generate', json=payload)
+        hits.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'p50_ms': round(percentile(misses, 50), 3),
+        'p99_ms': round(percentile(misses, 99), 3),
+        'hit_p50_ms': round(percentile(hits, 50), 3)
+    }
+
+
+def run_suite(repeat, name_filter=None):
+    '''Runs every case (or cases with name_filter in their name), returns dict
+    mapping case names to result dicts.
+    '''
+    cases = {}
+    for qr_type in QR_TYPES:
+        previous = None
+        for length in PAYLOAD_LENGTHS:
+            # Skip length if every field was already at its max length
+            if make_payload(qr_type, length) == previous:
+                continue
+            previous = make_payload(qr_type, length)
+
+            for size in SIZES:
+                for image_format in FORMATS:
+                    name = f'render/{qr_type}/{length}/{size}/{image_format}'
+                    if not name_filter or name_filter in name:
+                        cases[name] = bench_render(qr_type, length, size, image_format, repeat)
+
+            name = f'endpoint/{qr_type}/{length}'
+            if not name_filter or name_filter in name:
+                cases[name] = bench_endpoint(qr_type, length, repeat)
+    return cases
+
+
+def compare(cases, baseline, threshold):
+    '''Takes cases from run_suite, baseline cases, and allowed slowdown (0.2 =
+    20%). Returns dict mapping case names to (change ratio, regressed bool) for
+    cases in both.
+    '''
+    changes = {}
+    for name, result in cases.items():
+        if name in baseline:
+            change = result['p50_ms'] / baseline[name]['p50_ms'] - 1
+            changes[name] = (change, change > threshold)
+    return changes
+
+
+def parse_args():
+    '''Returns parsed command line args.'''
+    parser = argparse.ArgumentParser(description='Run benchmark suite')
+    parser.add_argument('--repeat', type=int, default=20, help='Renders per case')
+    parser.add_argument('--filter', help='Only run cases containing this text')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline results JSON')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Write results to baseline path (no comparison)')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Flag cases with p50 this fraction slower than baseline')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pillow': PIL.__version__,
+            'segno': segno.__version__,
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'backend': os.path.abspath(BACKEND_DIR)
+        },
+        'cases': run_suite(args.repeat, args.filter)
+    }
+    cases = results['cases']
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)['cases']
+    changes = compare(cases, baseline, args.threshold)
+
+    rows = []
+    for name, result in cases.items():
+        change, regressed = changes.get(name, (None, False))
+        rows.append((
+            name,
+            result.get('version', ''),
+            f"{result['p50_ms']:.2f}",
+            f"{result['p99_ms']:.2f}",
+            ' '.join(f'{stage}={ms:.2f}' for stage, ms in result.get('stages_ms', {}).items()),
+            result.get('peak_kib', ''),
+            '' if change is None else f'{change:+.0%}{" REGRESSION" if regressed else ""}'
+        ))
+    print_table(
+        ('case', 'version', 'p50 ms', 'p99 ms', 'stages (median ms)', 'peak KiB', 'vs baseline'),
+        rows
+    )
+
+    for path in (args.output, args.baseline if args.save_baseline else None):
+        if path:
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+            print(f'\nResults written to {path}')
+
+    regressions = [name for name, (_, regressed) in changes.items() if regressed]
+    if regressions:
+        print(f'\n{len(regressions)} cases slower than baseline by more than '
+              f'{args.threshold:.0%}: {", ".join(regressions)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
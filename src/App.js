@@ -75,8 +75,13 @@ function App() {
             setQrVisible(true);
             console.log(result);
         } else {
+            // Validation errors are JSON with message and invalid field
             const error = await response.text();
-            alert(error);
+            try {
+                alert(JSON.parse(error).error);
+            } catch {
+                alert(error);
+            }
         }
     }
 